@@ -0,0 +1,217 @@
+import logging
+from collections import Counter
+import numpy as np
+from step_tokenizer import RecordReader
+
+logger = logging.getLogger(__name__)
+
+# Presentation records between a STYLED_ITEM and its colour
+STYLE_TYPES = (
+    'PRESENTATION_STYLE_ASSIGNMENT', 'PRESENTATION_STYLE_BY_CONTEXT', 'SURFACE_STYLE_USAGE',
+    'SURFACE_SIDE_STYLE', 'SURFACE_STYLE_FILL_AREA', 'FILL_AREA_STYLE', 'FILL_AREA_STYLE_COLOUR',
+    'SURFACE_STYLE_RENDERING', 'SURFACE_STYLE_RENDERING_WITH_PROPERTIES', 'CURVE_STYLE'
+)
+STYLED_ITEM_TYPES = ('STYLED_ITEM', 'OVER_RIDING_STYLED_ITEM')
+COLOUR_TYPES = ('COLOUR_RGB', 'DRAUGHTING_PRE_DEFINED_COLOUR')
+# Styled items coloured as a whole body, reported by name
+BODY_TYPES = (
+    'MANIFOLD_SOLID_BREP', 'BREP_WITH_VOIDS', 'FACETED_BREP', 'SHELL_BASED_SURFACE_MODEL',
+    'GEOMETRIC_CURVE_SET', 'MAPPED_ITEM'
+)
+# Records between a property or material definition and its PRODUCT
+PRODUCT_PATH_TYPES = (
+    'PRODUCT_DEFINITION_SHAPE', 'PRODUCT_DEFINITION', 'PRODUCT_DEFINITION_FORMATION',
+    'PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE', 'CHARACTERIZED_OBJECT'
+)
+MATERIAL_PROPERTY_TYPES = ('MATERIAL_PROPERTY', 'PROPERTY_DEFINITION')
+
+
+class AttributeExtractor:
+    """Extract product names, part numbers, colours, layers and materials
+
+    Reference chains are resolved over the whole file at once on the CSR
+    reference graph; records are parsed only where a name or value is needed,
+    which is a small fraction of the file.
+    """
+
+    def __init__(self, index, buffer):
+        self.index = index
+        self.records = RecordReader(index, buffer)
+        self._part_numbers = {}
+
+    def extract(self):
+        """Return the normalized attributes dict"""
+        attributes = {}
+        for extract in (self._extract_products, self._extract_colors,
+                        self._extract_layers, self._extract_materials):
+            try:
+                attributes.update(extract())
+            except Exception as e:
+                logger.warning(f"Error in {extract.__name__}: {str(e)}")
+        return attributes
+
+    def _extract_products(self):
+        """Collect PRODUCT part numbers, names and their revisions"""
+        products = {}
+        for row in self.index.rows_of_type('PRODUCT').tolist():
+            # id, name, description, frame_of_reference
+            params = self.records.attributes(row, 'PRODUCT')
+            part_number = params[0]
+            self._part_numbers[row] = part_number
+            products[f"product:{part_number}"] = {
+                'category': 'product',
+                'part_number': part_number,
+                'name': params[1],
+                'description': params[2],
+                'revisions': []
+            }
+
+        for row in self.index.rows_of_type('PRODUCT_DEFINITION_FORMATION',
+                                           'PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE').tolist():
+            # id, description, of_product
+            params = self.records.attributes(row, 'PRODUCT_DEFINITION_FORMATION') or \
+                self.records.attributes(row, 'PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE')
+            part_number = self._part_numbers.get(self.records.row(params[2]))
+            if part_number is not None and params[0]:
+                products[f"product:{part_number}"]['revisions'].append(params[0])
+        return products
+
+    def _extract_colors(self):
+        """Resolve the colour of every styled item in one pass over the graph"""
+        graph = self.index.references
+        styled_rows = self.index.rows_of_type(*STYLED_ITEM_TYPES)
+        if graph is None or not styled_rows.size:
+            return {}
+        type_codes = self.index.type_codes
+
+        # Item each style applies to: the direct reference that is not a style
+        not_style = ~self.index.type_mask(*STYLE_TYPES + STYLED_ITEM_TYPES)
+        item_styles, items = graph.reach(styled_rows, type_codes, not_style, np.zeros_like(not_style), max_depth=1)
+
+        # Colour of each styled item through its presentation style chain
+        color_styles, colors = graph.reach(styled_rows, type_codes, self.index.type_mask(*COLOUR_TYPES),
+                                           self.index.type_mask(*STYLE_TYPES))
+        if not color_styles.size:
+            return {}
+        # Keep the first colour of a style that has several (surface and curve colour)
+        color_styles, first = np.unique(color_styles, return_index=True)
+        color_rows, color_codes = np.unique(colors[first], return_inverse=True)
+        color_names = [self._color_name(row) for row in color_rows.tolist()]
+
+        # Colour code of every styled item; -1 when it has none
+        positions = np.minimum(np.searchsorted(color_styles, item_styles), color_styles.size - 1)
+        item_colors = np.where(color_styles[positions] == item_styles, color_codes[positions], -1)
+        item_codes = type_codes[items].astype(np.int64)
+        is_body = self.index.type_mask(*BODY_TYPES)[item_codes]
+
+        attributes = {}
+        repeats = Counter()
+        body = is_body & (item_colors >= 0)
+        for item, color in zip(items[body].tolist(), item_colors[body].tolist()):
+            item_type = self.index.type_names[type_codes[item]]
+            name = self.records.parse(item)[1]
+            name = name[0] if isinstance(name, list) and name and isinstance(name[0], str) else ''
+            key = f"color:{item_type}:{name}"
+            # Several bodies may share a name; number the repeats in file order
+            repeats[key] += 1
+            if repeats[key] > 1:
+                key = f"{key} ({repeats[key]})"
+            attributes[key] = {'category': 'color', 'item_type': item_type, 'name': name, 'color': color_names[color]}
+
+        # Faces and edges are rarely named; compare their colour histogram
+        other = ~is_body & (item_colors >= 0)
+        pairs, counts = np.unique(item_codes[other] * len(color_names) + item_colors[other], return_counts=True)
+        usage = {}
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            code, color = divmod(pair, len(color_names))
+            usage.setdefault(self.index.type_names[code], Counter())[color_names[color]] += count
+
+        for item_type, counts in usage.items():
+            attributes[f"colors:{item_type}"] = {
+                'category': 'color_usage',
+                'item_type': item_type,
+                'counts': dict(sorted(counts.items()))
+            }
+        return attributes
+
+    def _color_name(self, row):
+        """Format a COLOUR_RGB as #rrggbb, or return a pre-defined colour's name"""
+        type_name, params = self.records.parse(row)
+        if type_name == 'COLOUR_RGB':
+            # name, red, green, blue
+            red, green, blue = (int(round(float(value) * 255)) for value in params[1:4])
+            return f"#{red:02x}{green:02x}{blue:02x}"
+        return params[0] if params else type_name
+
+    def _extract_layers(self):
+        """Collect each presentation layer with the number and types of its items"""
+        graph = self.index.references
+        layers = {}
+        for row in self.index.rows_of_type('PRESENTATION_LAYER_ASSIGNMENT').tolist():
+            # name, description, assigned_items
+            params = self.records.attributes(row, 'PRESENTATION_LAYER_ASSIGNMENT')
+            item_codes = np.zeros(0, dtype=np.int64)
+            if graph is not None:
+                targets = graph.targets(row)
+                item_codes = self.index.type_codes[targets[targets >= 0]]
+            codes, counts = np.unique(item_codes, return_counts=True)
+            layers[f"layer:{params[0]}"] = {
+                'category': 'layer',
+                'name': params[0],
+                'description': params[1],
+                'item_count': int(counts.sum()),
+                'item_types': {self.index.type_names[code]: count
+                               for code, count in zip(codes.tolist(), counts.tolist())}
+            }
+        return layers
+
+    def _extract_materials(self):
+        """Collect material designations and material property values per part"""
+        materials = {}
+        graph = self.index.references
+        if graph is None:
+            return materials
+        type_codes = self.index.type_codes
+        product_mask = self.index.type_mask('PRODUCT')
+        path_mask = self.index.type_mask(*PRODUCT_PATH_TYPES)
+
+        designations = self.index.rows_of_type('MATERIAL_DESIGNATION')
+        origins, products = graph.reach(designations, type_codes, product_mask, path_mask)
+        for row in designations.tolist():
+            # name, definitions
+            name = self.records.attributes(row, 'MATERIAL_DESIGNATION')[0]
+            materials[f"material:{name}"] = {
+                'category': 'material',
+                'name': name,
+                'applied_to': sorted(str(self._part_numbers.get(product, ''))
+                                     for product in products[origins == row].tolist())
+            }
+
+        # PROPERTY_DEFINITION_REPRESENTATION(definition, used_representation)
+        for row in self.index.rows_of_type('PROPERTY_DEFINITION_REPRESENTATION').tolist():
+            try:
+                definition, representation = self.records.attributes(row, 'PROPERTY_DEFINITION_REPRESENTATION')[:2]
+                definition_row = self.records.row(definition)
+                type_name, params = self.records.parse(definition_row)
+                if type_name not in MATERIAL_PROPERTY_TYPES or 'material' not in str(params[0]).lower():
+                    continue
+                _, part_rows = graph.reach([definition_row], type_codes, product_mask, path_mask)
+                part_number = self._part_numbers.get(int(part_rows[0]), '') if part_rows.size else ''
+
+                # REPRESENTATION(name, items, context_of_items)
+                _, rep_params = self.records.resolve(representation)
+                for item in rep_params[1]:
+                    value, unit = self.records.measure(item)
+                    item_name = self.records.item_name(item)
+                    if value is None or not item_name:
+                        continue
+                    materials[f"material_property:{part_number}:{item_name}"] = {
+                        'category': 'material_property',
+                        'part_number': part_number,
+                        'name': item_name,
+                        'value': value,
+                        'unit': unit
+                    }
+            except Exception as e:
+                logger.debug(f"Skipping property record #{self.index.ids[row]}: {str(e)}")
+        return materials
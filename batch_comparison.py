@@ -0,0 +1,171 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from step_parser import StepParser
+from comparison_engine import ComparisonEngine, measure_step_file
+from geometric_properties import GeometricProperties
+from surface_deviation import TriangleBVH
+from parse_cache import file_sha256
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Entity hashes of the baseline, set once in each candidate worker process
+_baseline = None
+
+
+class BaselineComparison:
+    """Compares one baseline STEP file against many candidate revisions
+
+    The baseline is parsed, transferred, fingerprinted and meshed once, with
+    a TriangleBVH of its mesh kept for the surface deviation of every pair.
+    Candidates are parsed and measured in worker processes, one candidate
+    per task, and each pair is diffed as soon as its candidate is ready.
+    At most two candidate analyses per worker are in flight, so memory does
+    not grow with the number of candidates.
+    """
+
+    def __init__(self, cache=None, jobs=0, eps=None, face_tolerance=0.01, geometry=True, similarity_index=None):
+        # Optional ParseCache shared across runs
+        self.cache = cache
+        # Optional SimilarityIndex that every parsed file is added to
+        self.similarity_index = similarity_index
+        # Worker processes for the candidates (0 = all CPU cores)
+        self.jobs = jobs
+        # Relative accuracy of the mass property integration (None = OCC default)
+        self.eps = eps
+        # Length below which face signatures count as equal (mm)
+        self.face_tolerance = face_tolerance
+        # Compare shapes as well as the parsed structure
+        self.geometry = geometry
+
+    def compare(self, baseline_file, candidate_files):
+        """Compare the baseline with each candidate; returns one result per candidate, in order
+
+        Each result holds the candidate 'file', its 'differences' against
+        the baseline, and an 'error' message if it could not be compared.
+        """
+        baseline = self._analyze_baseline(baseline_file)
+        results = []
+        for candidate_file, analysis in zip(candidate_files, self._analyze_candidates(candidate_files, baseline)):
+            results.append(self._compare_pair(baseline, candidate_file, analysis))
+        return results
+
+    def _analyze_baseline(self, baseline_file):
+        """Parse and measure the baseline once"""
+        logger.info(f"Analyzing baseline {baseline_file}")
+        file_hash = file_sha256(baseline_file)
+        data = StepParser(workers=self.jobs, cache=self.cache,
+                          similarity_index=self.similarity_index).parse(baseline_file, file_hash)
+        measurement, bvh = None, None
+        if self.geometry:
+            measurement = _measurement(measure_step_file(baseline_file, self.eps))
+            if measurement is not None and len(measurement[3][1]):
+                bvh = TriangleBVH(*measurement[3])
+        return {'file_hash': file_hash, 'data': data, 'measurement': measurement, 'bvh': bvh}
+
+    def _analyze_candidates(self, candidate_files, baseline):
+        """Yield the analysis of each candidate, in order, as the workers finish them"""
+        workers = min(len(candidate_files), self.jobs or os.cpu_count() or 1)
+        arguments = [(candidate_file, baseline['file_hash'], self.eps, self.cache, self.geometry,
+                      self.similarity_index) for candidate_file in candidate_files]
+        if workers < 2:
+            _set_baseline(baseline['data']['entity_hashes'])
+            for args in arguments:
+                yield _analyze_candidate(*args)
+            return
+
+        done = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_set_baseline,
+                                     initargs=(baseline['data']['entity_hashes'],)) as pool:
+                futures = deque()
+                for args in arguments:
+                    futures.append(pool.submit(_analyze_candidate, *args))
+                    if len(futures) >= 2 * workers:
+                        analysis = futures.popleft().result()
+                        done += 1
+                        yield analysis
+                while futures:
+                    analysis = futures.popleft().result()
+                    done += 1
+                    yield analysis
+        except Exception as e:
+            logger.error(f"Error analyzing candidates in worker processes, analyzing the rest serially: {str(e)}")
+            _set_baseline(baseline['data']['entity_hashes'])
+            for args in arguments[done:]:
+                yield _analyze_candidate(*args)
+
+    def _compare_pair(self, baseline, candidate_file, analysis):
+        """Diff one candidate's analysis against the baseline"""
+        engine = ComparisonEngine(eps=self.eps, face_tolerance=self.face_tolerance)
+        if analysis.get('error'):
+            return {'file': candidate_file, 'differences': None, 'error': analysis['error']}
+        if analysis['identical']:
+            return {'file': candidate_file, 'differences': engine.identical(analysis['identical']), 'error': None}
+
+        measurements = None
+        if baseline['measurement'] and analysis['measurement']:
+            measurements = (baseline['measurement'], analysis['measurement'])
+        try:
+            differences = engine.compare(baseline['data'], analysis['data'],
+                                         measurements=measurements, bvh1=baseline['bvh'], level='precise')
+        except Exception as e:
+            logger.error(f"Error comparing {candidate_file} with the baseline: {str(e)}")
+            return {'file': candidate_file, 'differences': None, 'error': str(e)}
+        return {'file': candidate_file, 'differences': differences, 'error': None}
+
+
+def rank_results(results):
+    """Candidates ordered from most to least similar to the baseline, failures last"""
+    ranked = []
+    for result in results:
+        summary = result['differences']['summary'] if result['differences'] else {}
+        deviation = result['differences']['geometric']['deviation'] if result['differences'] else {}
+        ranked.append({
+            'file': result['file'],
+            'similarity_score': summary.get('similarity_score'),
+            'total_differences': summary.get('total_differences'),
+            'structural_differences': summary.get('structural_differences'),
+            'pmi_differences': summary.get('pmi_differences'),
+            'attribute_differences': summary.get('attribute_differences'),
+            'geometric_differences': summary.get('geometric_differences'),
+            'hausdorff': deviation.get('hausdorff'),
+            'identical': summary.get('identical'),
+            'error': result['error']
+        })
+    ranked.sort(key=lambda entry: (entry['similarity_score'] is None, -(entry['similarity_score'] or 0),
+                                   entry['total_differences'] or 0))
+    for rank, entry in enumerate(ranked, 1):
+        entry['rank'] = rank
+    return ranked
+
+
+def _measurement(result):
+    """Turn a measure_step_file result back into a measurement tuple"""
+    if result is None:
+        return None
+    return (GeometricProperties(**result[0]), *result[1:])
+
+
+def _set_baseline(entity_hashes):
+    """Worker initializer: keep the baseline entity hashes for the identity check"""
+    global _baseline
+    _baseline = {'entity_hashes': entity_hashes}
+
+
+def _analyze_candidate(candidate_file, baseline_hash, eps, cache, geometry, similarity_index):
+    """Worker process: parse and measure one candidate unless it is identical to the baseline"""
+    try:
+        file_hash = file_sha256(candidate_file)
+        if file_hash == baseline_hash:
+            return {'identical': 'byte'}
+        data = StepParser(cache=cache, similarity_index=similarity_index).parse(candidate_file, file_hash)
+        if ComparisonEngine().same_model(_baseline, data):
+            return {'identical': 'semantic'}
+
+        measurement = _measurement(measure_step_file(candidate_file, eps)) if geometry else None
+        return {'identical': None, 'data': data, 'measurement': measurement}
+    except Exception as e:
+        logger.error(f"Error analyzing {candidate_file}: {str(e)}")
+        return {'error': str(e)}
@@ -1,17 +1,112 @@
+import time
+import threading
+import multiprocessing
 import numpy as np
-from OCC.Core.GProp import GProp_GProps
-from OCC.Core.BRepGProp import brepgprop
-from OCC.Core.BRepBndLib import brepbndlib
-from OCC.Core.Bnd import Bnd_Box
-from OCC.Core.STEPControl import STEPControl_Reader
-from OCC.Core.IFSelect import IFSelect_RetDone
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from geometric_properties import GeometricProperties, solid_fingerprints, face_signatures, shape_mesh
+from solid_matching import FINGERPRINT_FIELDS, match_solids
+from face_matching import FACE_SIGNATURE_FIELDS, match_faces
+from surface_deviation import surface_deviation
+from entity_hashing import diff_entity_hashes, same_entities
+from shape_provider import shape_provider as default_shape_provider
+from streaming_geometry import measure_streaming, large_assembly
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Entities listed one by one in the instance diff, per direction
+MAX_LISTED_ENTITIES = 1000
+# Comparison depths, from the cheapest to the most thorough
+COMPARISON_LEVELS = ('quick', 'standard', 'precise')
+# Target seconds of a comparison at each level, once both files are parsed.
+# quick answers interactive triage, standard a routine review and precise
+# locates every changed solid, face and surface; comparators without a
+# budget of their own are cut off at their level's budget
+LEVEL_BUDGETS = {'quick': 5, 'standard': 30, 'precise': 300}
+# Extra seconds for comparators that read and transfer the STEP files through
+# OCC, which takes long on large files however little the level measures
+TRANSFER_BUDGET = 120
+# Start method of comparator processes; fork is unsafe while comparator
+# threads are running
+_PROCESS_CONTEXT = 'spawn'
+# FILE_DESCRIPTION, FILE_NAME and FILE_SCHEMA fields compared at every level
+HEADER_FIELDS = ('schemas', 'application_protocol', 'implementation_level', 'description', 'name',
+                 'time_stamp', 'author', 'organization', 'preprocessor_version', 'originating_system',
+                 'authorization')
+
+class Comparator:
+    """One independent part of a comparison, run concurrently with the others
+
+    function(engine, data1, data2, job) fills the differences sections it
+    declares on the engine it is given. inputs are the parse result keys it
+    reads, level the lowest comparison level it runs at, and budget its
+    time limit in seconds (None: the budget of the comparison level).
+    geometry marks comparators that need the STEP files or their
+    measurements, which job holds along with the level. isolated
+    comparators transfer the STEP files not already cached in child
+    processes, which are terminated when the comparator overruns.
+    """
+
+    def __init__(self, name, function, inputs=(), sections=(), level='quick', budget=None, geometry=False,
+                 isolated=False):
+        self.name = name
+        self.function = function
+        # Parse result keys that must be present in both files
+        self.inputs = inputs
+        # Paths of the differences sections it fills, e.g. ('structural', 'entity_differences')
+        self.sections = sections
+        self.level = level
+        self.budget = budget
+        self.geometry = geometry
+        self.isolated = isolated
+
+    def skip_reason(self, data1, data2, job):
+        """Why the comparator cannot run on a job, or None if it can"""
+        if COMPARISON_LEVELS.index(job['level']) < COMPARISON_LEVELS.index(self.level):
+            return f"not run at the {job['level']} level"
+        if self.geometry and not (job['measurements'] or (job['step_file1'] and job['step_file2'])):
+            return "no STEP files or measurements given"
+        missing = [key for key in self.inputs if data1.get(key) is None or data2.get(key) is None]
+        if missing:
+            return f"missing {', '.join(missing)}"
+        return None
+
+    def time_budget(self, job):
+        """Seconds the comparator may take on a job"""
+        budget = self.budget or LEVEL_BUDGETS[job['level']]
+        if self.geometry and not job['measurements']:
+            budget += TRANSFER_BUDGET
+        return budget
+
+
 class ComparisonEngine:
-    def __init__(self):
+    def __init__(self, shape_provider=None, eps=None, parallel=False, face_tolerance=0.01, comparators=None,
+                 streaming=None, isolated=False):
+        # Cache of transferred OCC shapes shared across comparisons
+        self.shape_provider = shape_provider or default_shape_provider
+        # Relative accuracy of the mass property integration (None = OCC default)
+        self.eps = eps
+        # Load and measure the two files in separate worker processes
+        self.parallel = parallel
+        # Length below which face signatures count as equal (mm)
+        self.face_tolerance = face_tolerance
+        # Comparators run by compare (default: every registered one)
+        self.comparators = comparators if comparators is not None else COMPARATORS
+        # Measure geometry part by part (None = only for assemblies over STREAMING_MIN_PRODUCTS products)
+        self.streaming = streaming
+        # Transfer uncached STEP files in child processes that cancel() terminates
+        self.isolated = isolated
+        # Measurement processes started so far, and whether cancel() was called
+        self._runs = []
+        self._cancelled = False
+        self._runs_lock = threading.Lock()
+        # Meshes and per-vertex distances of the last surface deviation
+        self.deviation = None
         self.differences = {
+            # Status of each comparator: complete, skipped, timed_out or failed
+            'comparators': {},
+            # HEADER fields that differ; informational, since every export stamps a new time
+            'header': {},
             'structural': {
                 'entity_differences': {
                     'only_in_file1': {},
@@ -22,6 +117,24 @@ class ComparisonEngine:
                     'only_in_file1': {},
                     'only_in_file2': {},
                     'count_differences': {}
+                },
+                'assembly_differences': {
+                    'only_in_file1': {},
+                    'only_in_file2': {},
+                    'value_differences': {}
+                },
+                'instance_differences': {
+                    'only_in_file1': {},
+                    'only_in_file2': {},
+                    'removed': [],
+                    'added': [],
+                    'unchanged': 0
+                },
+                'shape_differences': {
+                    'changed': [],
+                    'only_in_file1': [],
+                    'only_in_file2': [],
+                    'unchanged': 0
                 }
             },
             'pmi': {
@@ -52,6 +165,12 @@ class ComparisonEngine:
                     'file2': [0, 0, 0],
                     'distance': 0
                 },
+                'principal_moments': {
+                    'file1': [0, 0, 0],
+                    'file2': [0, 0, 0],
+                    'difference': 0,
+                    'percentage': 0
+                },
                 'bounding_box': {
                     'file1': {
                         'dimensions': [0, 0, 0],
@@ -63,6 +182,42 @@ class ComparisonEngine:
                     },
                     'difference': 0,
                     'percentage': 0
+                },
+                'oriented_bounding_box': {
+                    'file1': {
+                        'dimensions': [0, 0, 0],
+                        'volume': 0
+                    },
+                    'file2': {
+                        'dimensions': [0, 0, 0],
+                        'volume': 0
+                    },
+                    'difference': 0,
+                    'percentage': 0
+                },
+                'solids': {
+                    'removed': [],
+                    'added': [],
+                    'modified': [],
+                    'unchanged': 0
+                },
+                'faces': {
+                    'removed': [],
+                    'added': [],
+                    'modified': [],
+                    'unchanged': 0
+                },
+                'deviation': {
+                    'file1_to_file2': {'max': 0, 'mean': 0, 'rms': 0, 'points': 0},
+                    'file2_to_file1': {'max': 0, 'mean': 0, 'rms': 0, 'points': 0},
+                    'hausdorff': 0
+                },
+                # Per-part volume and area, when the geometry was measured part by part
+                'parts': {
+                    'changed': [],
+                    'only_in_file1': [],
+                    'only_in_file2': [],
+                    'unchanged': 0
                 }
             },
             'summary': {
@@ -71,204 +226,507 @@ class ComparisonEngine:
                 'pmi_differences': 0,
                 'attribute_differences': 0,
                 'geometric_differences': 0,
-                'similarity_score': 100  # Percentage
+                'similarity_score': 100,  # Percentage
+                # 'byte' or 'semantic' when the full comparison was skipped
+                'identical': None,
+                # Comparison level the differences were found at
+                'level': None,
+                # Whether a comparator timed out or failed, leaving its sections empty
+                'partial': False
             }
         }
     
-    def compare(self, data1, data2, step_file1=None, step_file2=None):
-        """Compare two STEP-AP242 data structures and identify differences"""
-        # Compare entity types and counts
-        self._compare_entities(data1['entities'], data2['entities'])
-        
-        # Compare relationships
-        self._compare_relationships(data1['relationships'], data2['relationships'])
-        
-        # Compare PMI data
-        self._compare_pmi(data1['pmi_data'], data2['pmi_data'])
-        
-        # Compare other attributes
-        self._compare_attributes(data1['attributes'], data2['attributes'])
+    def compare(self, data1, data2, step_file1=None, step_file2=None, measurements=None, bvh1=None,
+                level='standard'):
+        """Compare two STEP-AP242 data structures and identify differences
+
+        level sets how deep the comparison goes (see LEVEL_BUDGETS):
+        'quick' compares the HEADER, entity counts and bounding boxes;
+        'standard' adds the instance, product shape, relationship, assembly,
+        PMI and attribute diffs and the mass properties; 'precise' adds
+        solid and face matching and the surface deviation. Geometry is only
+        compared when STEP files or their measurements are given.
+
+        Each part is a registered Comparator, run concurrently with the
+        others within its own time budget. Parts that overrun or fail are
+        left at their defaults, listed in differences['comparators'] and
+        flagged by summary['partial'], instead of holding up the result.
+
+        measurements optionally holds the (properties, solids, faces, mesh)
+        of both files, measured beforehand, and bvh1 a TriangleBVH of the
+        first file's mesh, so a baseline compared many times is measured once.
+        """
+        if level not in COMPARISON_LEVELS:
+            raise ValueError(f"Unknown comparison level: {level}")
+        start = time.perf_counter()
         
-        # Compare geometric properties if STEP files are provided
-        if step_file1 and step_file2:
-            self._compare_geometric_properties(step_file1, step_file2)
+        job = {
+            'step_file1': step_file1,
+            'step_file2': step_file2,
+            'measurements': measurements,
+            'bvh1': bvh1,
+            'level': level
+        }
+        self._run_comparators(data1, data2, job)
         
         # Calculate summary statistics
         self._calculate_summary()
+        self.differences['summary']['level'] = level
+        
+        logger.info(f"The {level} comparison took {time.perf_counter() - start:.1f} s")
+        return self.differences
+    
+    def _run_comparators(self, data1, data2, job):
+        """Run the comparators concurrently, keeping the sections of those that finish within budget
+
+        Each comparator runs on a daemon thread and fills a scratch engine
+        of its own, so one still running past its budget cannot touch the
+        returned differences. Python cannot stop a thread: the budget only
+        bounds how long the comparison waits, and an overrunning thread
+        keeps working in the background, without holding up the exit. The
+        STEP transfers of isolated comparators, which take longest, run in
+        child processes instead, and those are terminated.
+        """
+        statuses = self.differences['comparators']
+        runnable = []
+        for comparator in self.comparators:
+            reason = comparator.skip_reason(data1, data2, job)
+            if reason:
+                statuses[comparator.name] = {'status': 'skipped', 'reason': reason}
+            else:
+                runnable.append(comparator)
         
+        # Everything starts at once, so every budget starts counting now
+        start = time.perf_counter()
+        runs = [(comparator, self._start_comparator(comparator, data1, data2, job)) for comparator in runnable]
+        for comparator, run in runs:
+            budget = comparator.time_budget(job)
+            try:
+                engine, seconds = run.result(max(budget - (time.perf_counter() - start), 0))
+            except TimeoutError:
+                logger.warning(f"Comparator {comparator.name} exceeded its {budget} s budget, skipping it")
+                statuses[comparator.name] = {'status': 'timed_out', 'budget': budget}
+                run.cancel()
+                continue
+            except Exception as e:
+                logger.error(f"Error in comparator {comparator.name}: {str(e)}")
+                statuses[comparator.name] = {'status': 'failed', 'error': str(e)}
+                continue
+            
+            for path in comparator.sections:
+                self._section(path)[path[-1]] = engine._section(path)[path[-1]]
+            if engine.deviation is not None:
+                self.deviation = engine.deviation
+            statuses[comparator.name] = {'status': 'complete', 'seconds': seconds}
+    
+    def _start_comparator(self, comparator, data1, data2, job):
+        """Start one comparator on a daemon thread, filling a scratch engine that shares the shape cache"""
+        engine = ComparisonEngine(self.shape_provider, eps=self.eps, parallel=self.parallel,
+                                  face_tolerance=self.face_tolerance, streaming=self.streaming,
+                                  isolated=comparator.isolated)
+        return _ThreadRun(comparator, engine, data1, data2, job)
+    
+    def cancel(self):
+        """Terminate the measurement processes of an isolated engine, and start no more"""
+        with self._runs_lock:
+            self._cancelled = True
+            runs = list(self._runs)
+        for run in runs:
+            run.terminate()
+    
+    def _section(self, path):
+        """The dict holding the last key of a differences section path"""
+        target = self.differences
+        for key in path[:-1]:
+            target = target[key]
+        return target
+    
+    def same_model(self, data1, data2):
+        """Whether two parse results hold the same entity instances up to renumbering"""
+        # The hashes only cover the DATA section, so HEADER timestamps and
+        # originating system names do not matter
+        return same_entities(data1.get('entity_hashes'), data2.get('entity_hashes'))
+    
+    def identical(self, identity):
+        """Differences of two files found identical ('byte' or 'semantic') without comparing them"""
+        self._calculate_summary()
+        self.differences['summary']['identical'] = identity
         return self.differences
     
+    def _compare_headers(self, header1, header2):
+        """Record the HEADER fields whose values differ between two models"""
+        for field in HEADER_FIELDS:
+            if header1.get(field) != header2.get(field):
+                self.differences['header'][field] = {'file1': header1.get(field), 'file2': header2.get(field)}
+    
     def _compare_entities(self, entities1, entities2):
         """Compare entity types and counts between two models"""
-        # Find entities only in file 1
-        for entity_type, count in entities1.items():
-            if entity_type not in entities2:
-                self.differences['structural']['entity_differences']['only_in_file1'][entity_type] = count
-            elif entities1[entity_type] != entities2[entity_type]:
-                diff = entities1[entity_type] - entities2[entity_type]
-                change = "+" + str(diff) if diff > 0 else str(diff)
-                self.differences['structural']['entity_differences']['count_differences'][entity_type] = {
-                    'file1': entities1[entity_type],
-                    'file2': entities2[entity_type],
-                    'change': change
-                }
+        self._compare_counts(entities1, entities2,
+                             self.differences['structural']['entity_differences'])
+    
+    def _compare_instances(self, data1, data2):
+        """Find the entity instances of each model with no equal instance in the other"""
+        hashes1, hashes2 = data1.get('entity_hashes'), data2.get('entity_hashes')
+        index1, index2 = data1.get('index'), data2.get('index')
+        if hashes1 is None or hashes2 is None or index1 is None or index2 is None:
+            return
         
-        # Find entities only in file 2
-        for entity_type, count in entities2.items():
-            if entity_type not in entities1:
-                self.differences['structural']['entity_differences']['only_in_file2'][entity_type] = count
+        removed, added = diff_entity_hashes(hashes1, hashes2)
+        target = self.differences['structural']['instance_differences']
+        target['only_in_file1'] = self._count_instance_types(index1, removed)
+        target['only_in_file2'] = self._count_instance_types(index2, added)
+        target['removed'] = self._list_instances(index1, removed)
+        target['added'] = self._list_instances(index2, added)
+        target['unchanged'] = len(hashes1) - len(removed)
+        logger.info(f"Instance diff: {len(removed)} removed, {len(added)} added, "
+                    f"{target['unchanged']} unchanged")
+    
+    def _count_instance_types(self, index, rows):
+        """Number of the given index rows per entity type"""
+        counts = np.bincount(index.type_codes[rows], minlength=len(index.type_names))
+        return {index.type_names[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+    
+    def _list_instances(self, index, rows):
+        """Id and type of the first MAX_LISTED_ENTITIES of the given index rows"""
+        rows = rows[:MAX_LISTED_ENTITIES]
+        return [{'id': entity_id, 'type': index.type_names[code]}
+                for entity_id, code in zip(index.ids[rows].tolist(), index.type_codes[rows].tolist())]
+    
+    def _compare_revision_trees(self, tree1, tree2):
+        """Find the products whose shape representations changed, by their tree hashes"""
+        products1, products2 = tree1.get('products', {}), tree2.get('products', {})
+        target = self.differences['structural']['shape_differences']
+        target['changed'] = sorted(part for part, shape in products1.items()
+                                   if part in products2 and products2[part] != shape)
+        target['only_in_file1'] = sorted(part for part in products1 if part not in products2)
+        target['only_in_file2'] = sorted(part for part in products2 if part not in products1)
+        target['unchanged'] = len(products1) - len(target['changed']) - len(target['only_in_file1'])
+    
+    def _streams(self, data1, data2):
+        """Whether to measure the geometry part by part rather than as whole shapes"""
+        if self.streaming is not None:
+            return self.streaming
+        return large_assembly(data1) or large_assembly(data2)
+    
+    def _same_geometry(self, data1, data2):
+        """Whether no shape representation or placement differs between two parse results"""
+        geometry1 = data1.get('revision_tree', {}).get('geometry')
+        return geometry1 is not None and geometry1 == data2.get('revision_tree', {}).get('geometry')
     
     def _compare_relationships(self, relationships1, relationships2):
         """Compare relationships between entities in two models"""
-        # Implementation for comparing relationships
-        # Similar to _compare_entities but for relationship data
-        pass
+        # Relationships are reference counts per 'SOURCE_TYPE -> TARGET_TYPE'
+        # pair, so they diff exactly like entity counts
+        self._compare_counts(relationships1, relationships2,
+                             self.differences['structural']['relationship_differences'])
+    
+    def _compare_assemblies(self, structure1, structure2):
+        """Compare the usage occurrences (parent, child, placement) of two assemblies"""
+        self._compare_entries(structure1.get('occurrences', {}), structure2.get('occurrences', {}),
+                              self.differences['structural']['assembly_differences'])
+    
+    def _compare_counts(self, counts1, counts2, target):
+        """Record keys only in one model and keys whose counts differ"""
+        # Find keys only in file 1
+        for key, count in counts1.items():
+            if key not in counts2:
+                target['only_in_file1'][key] = count
+            elif counts1[key] != counts2[key]:
+                diff = counts1[key] - counts2[key]
+                change = "+" + str(diff) if diff > 0 else str(diff)
+                target['count_differences'][key] = {
+                    'file1': counts1[key],
+                    'file2': counts2[key],
+                    'change': change
+                }
+        
+        # Find keys only in file 2
+        for key, count in counts2.items():
+            if key not in counts1:
+                target['only_in_file2'][key] = count
     
     def _compare_pmi(self, pmi1, pmi2):
         """Compare Product and Manufacturing Information between two models"""
-        # Implementation for comparing PMI data
-        pass
+        # PMI entries are keyed by category, type, name and target, so entries
+        # with the same key are the same annotation in both revisions
+        self._compare_entries(pmi1, pmi2, self.differences['pmi'])
+    
+    def _compare_entries(self, entries1, entries2, target):
+        """Record keys only in one model and entries whose fields differ"""
+        for key, entry in entries1.items():
+            if key not in entries2:
+                target['only_in_file1'][key] = entry
+            elif entry != entries2[key]:
+                changed = sorted(field for field in set(entry) | set(entries2[key])
+                                 if entry.get(field) != entries2[key].get(field))
+                target['value_differences'][key] = {
+                    'file1': entry,
+                    'file2': entries2[key],
+                    'changed': changed
+                }
+        
+        for key, entry in entries2.items():
+            if key not in entries1:
+                target['only_in_file2'][key] = entry
     
     def _compare_attributes(self, attributes1, attributes2):
         """Compare attributes between two models"""
-        # Implementation for comparing attributes
-        pass
+        self._compare_entries(attributes1, attributes2, self.differences['attributes'])
     
-    def _compare_geometric_properties(self, step_file1, step_file2):
-        """Compare geometric properties between two models"""
+    def _compare_geometric_properties(self, step_file1, step_file2, same_geometry=False, level='precise',
+                                      indexes=None):
+        """Compare geometric properties between two models
+
+        indexes holds the EntityIndex of each file (or None) to measure them
+        part by part; None measures whole shapes.
+        """
         try:
-            # Load the STEP files
-            shape1 = self._load_step_file(step_file1)
-            shape2 = self._load_step_file(step_file2)
+            if same_geometry:
+                # Equal shape hashes: measure one file and skip the surface deviation
+                measurement = without_mesh(self._measure_step_files(step_file1, level=level,
+                                                                    indexes=indexes and indexes[:1])[0])
+                self._compare_measurements(measurement, measurement, level=level)
+                return
+            # One property bundle per shape instead of a pass per property
+            self._compare_measurements(*self._measure_step_files(step_file1, step_file2, level=level, indexes=indexes),
+                                       level=level)
+        except Exception as e:
+            logger.error(f"Error comparing geometric properties: {str(e)}")
+    
+    def _compare_measurements(self, measurement1, measurement2, bvh1=None, level='precise'):
+        """Compare the (properties, solids, faces, mesh) measurements of two models, as deep as level"""
+        try:
+            props1, solids1, faces1, mesh1 = measurement1
+            props2, solids2, faces2, mesh2 = measurement2
             
-            if shape1 and shape2:
-                # Calculate volume
-                vol1 = self._calculate_volume(shape1)
-                vol2 = self._calculate_volume(shape2)
-                vol_diff = abs(vol1 - vol2)
-                vol_pct = (vol_diff / max(vol1, vol2)) * 100 if max(vol1, vol2) > 0 else 0
+            if props1 and props2:
+                geometric = self.differences['geometric']
                 
-                self.differences['geometric']['volume'] = {
-                    'file1': vol1,
-                    'file2': vol2,
-                    'difference': vol_diff,
-                    'percentage': vol_pct
+                box = self._compare_values(props1.bounding_box['volume'], props2.bounding_box['volume'])
+                geometric['bounding_box'] = {
+                    'file1': props1.bounding_box,
+                    'file2': props2.bounding_box,
+                    'difference': box['difference'],
+                    'percentage': box['percentage']
                 }
+                if level == 'quick':
+                    return
                 
-                # Calculate surface area
-                area1 = self._calculate_surface_area(shape1)
-                area2 = self._calculate_surface_area(shape2)
-                area_diff = abs(area1 - area2)
-                area_pct = (area_diff / max(area1, area2)) * 100 if max(area1, area2) > 0 else 0
-                
-                self.differences['geometric']['surface_area'] = {
-                    'file1': area1,
-                    'file2': area2,
-                    'difference': area_diff,
-                    'percentage': area_pct
-                }
+                geometric['volume'] = self._compare_values(props1.volume, props2.volume)
+                geometric['surface_area'] = self._compare_values(props1.surface_area, props2.surface_area)
                 
                 # Calculate center of mass
-                com1 = self._calculate_center_of_mass(shape1)
-                com2 = self._calculate_center_of_mass(shape2)
-                com_distance = np.linalg.norm(np.array(com1) - np.array(com2))
-                
-                self.differences['geometric']['center_of_mass'] = {
-                    'file1': com1,
-                    'file2': com2,
+                com_distance = np.linalg.norm(np.array(props1.center_of_mass) - np.array(props2.center_of_mass))
+                geometric['center_of_mass'] = {
+                    'file1': props1.center_of_mass,
+                    'file2': props2.center_of_mass,
                     'distance': com_distance
                 }
                 
-                # Calculate bounding box
-                bbox1 = self._calculate_bounding_box(shape1)
-                bbox2 = self._calculate_bounding_box(shape2)
-                bbox_vol_diff = abs(bbox1['volume'] - bbox2['volume'])
-                bbox_vol_pct = (bbox_vol_diff / max(bbox1['volume'], bbox2['volume'])) * 100 if max(bbox1['volume'], bbox2['volume']) > 0 else 0
+                # Principal moments, sorted, so a moved or rotated part still matches
+                moments1 = np.array(props1.principal_moments)
+                moments2 = np.array(props2.principal_moments)
+                moments_diff = float(np.linalg.norm(moments1 - moments2))
+                moments_scale = max(np.linalg.norm(moments1), np.linalg.norm(moments2))
+                geometric['principal_moments'] = {
+                    'file1': props1.principal_moments,
+                    'file2': props2.principal_moments,
+                    'difference': moments_diff,
+                    'percentage': (moments_diff / moments_scale) * 100 if moments_scale > 0 else 0
+                }
                 
-                self.differences['geometric']['bounding_box'] = {
-                    'file1': bbox1,
-                    'file2': bbox2,
-                    'difference': bbox_vol_diff,
-                    'percentage': bbox_vol_pct
+                box = self._compare_values(props1.oriented_bounding_box['volume'],
+                                           props2.oriented_bounding_box['volume'])
+                geometric['oriented_bounding_box'] = {
+                    'file1': props1.oriented_bounding_box,
+                    'file2': props2.oriented_bounding_box,
+                    'difference': box['difference'],
+                    'percentage': box['percentage']
                 }
+                if props1.parts is not None and props2.parts is not None:
+                    geometric['parts'] = self._compare_parts(props1.parts, props2.parts)
+                
+                # Streamed measurements hold no solids, faces or meshes
+                if level == 'standard' or solids1 is None or solids2 is None:
+                    return
+                
+                # Which bodies were added, removed or changed
+                geometric['solids'] = match_solids(solids1, solids2)
+                # Which faces were added, removed or changed, with their locations
+                geometric['faces'] = match_faces(faces1, faces2, self.face_tolerance)
+                # How far each surface lies from the other
+                geometric['deviation'] = self._compare_surfaces(mesh1, mesh2, bvh1)
             
         except Exception as e:
             logger.error(f"Error comparing geometric properties: {str(e)}")
     
+    def _compare_parts(self, parts1, parts2):
+        """Parts whose instance count, volume or area (over 1%) differ, by part number"""
+        target = {'changed': [], 'only_in_file1': [], 'only_in_file2': [], 'unchanged': 0}
+        for name, part in parts1.items():
+            other = parts2.get(name)
+            if other is None:
+                target['only_in_file1'].append(name)
+            elif part['instances'] != other['instances'] or \
+                    self._compare_values(part['volume'], other['volume'])['percentage'] > 1 or \
+                    self._compare_values(part['surface_area'], other['surface_area'])['percentage'] > 1:
+                target['changed'].append({'part': name, 'file1': part, 'file2': other})
+            else:
+                target['unchanged'] += 1
+        target['only_in_file2'] = [name for name in parts2 if name not in parts1]
+        return target
+    
+    def _compare_surfaces(self, mesh1, mesh2, bvh1=None):
+        """Surface deviation statistics of two meshes; keeps the per-vertex distances"""
+        if not len(mesh1[1]) or not len(mesh2[1]):
+            return self.differences['geometric']['deviation']
+        try:
+            deviation = surface_deviation(*mesh1, *mesh2, bvh1=bvh1)
+        except Exception as e:
+            logger.error(f"Error computing surface deviation: {str(e)}")
+            return self.differences['geometric']['deviation']
+        self.deviation = {
+            'file1': {'vertices': mesh1[0], 'triangles': mesh1[1], 'distances': deviation['distances1']},
+            'file2': {'vertices': mesh2[0], 'triangles': mesh2[1], 'distances': deviation['distances2']}
+        }
+        return {key: deviation[key] for key in ('file1_to_file2', 'file2_to_file1', 'hausdorff')}
+    
+    def _compare_values(self, value1, value2):
+        """Absolute and percentage difference of a scalar property"""
+        diff = abs(value1 - value2)
+        return {
+            'file1': value1,
+            'file2': value2,
+            'difference': diff,
+            'percentage': (diff / max(value1, value2)) * 100 if max(value1, value2) > 0 else 0
+        }
+    
+    def _measure_step_files(self, *step_files, level='precise', indexes=None):
+        """Return (property bundle, solid fingerprints, face signatures, mesh) of each STEP file
+
+        All four are None for a file that cannot be loaded. Below the
+        precise level, only the property bundle is measured: the bounding
+        box alone for quick, the mass properties too for standard. Given
+        indexes (one EntityIndex or None per file), files are measured part
+        by part and, again, only the property bundle is measured.
+
+        An isolated engine measures the files whose shape is not cached in
+        child processes of their own, all at once if parallel, given only
+        the file path; part by part, the child indexes the file again.
+        """
+        streamed = indexes is not None
+        indexes = indexes or [None] * len(step_files)
+        if not self.parallel and not self.isolated:
+            return [self._measure_step_file(step_file, level, streamed, index)
+                    for step_file, index in zip(step_files, indexes)]
+        
+        # Shapes already transferred (e.g. for meshing) are measured here;
+        # the rest are loaded and measured in their own process, since OCC
+        # shapes cannot be sent between processes and only the numbers come back
+        properties = [(None, None, None, None)] * len(step_files)
+        pending = []
+        for i, step_file in enumerate(step_files):
+            if not streamed and self.shape_provider.cached_shape(step_file) is not None:
+                properties[i] = self._measure_step_file(step_file, level)
+            else:
+                pending.append(i)
+        
+        if self.isolated:
+            batches = [pending] if self.parallel else [[i] for i in pending]
+            for batch in batches:
+                runs = [(i, self._start_measurement(step_files[i], level, streamed)) for i in batch]
+                for i, run in runs:
+                    properties[i] = run.result()
+            return properties
+        
+        if len(pending) < 2:
+            for i in pending:
+                properties[i] = self._measure_step_file(step_files[i], level, streamed, indexes[i])
+            return properties
+        
+        try:
+            with ProcessPoolExecutor(max_workers=len(pending)) as pool:
+                results = pool.map(measure_step_file, [step_files[i] for i in pending], [self.eps] * len(pending),
+                                   [level] * len(pending), [streamed] * len(pending), [indexes[i] for i in pending])
+                for i, result in zip(pending, results):
+                    properties[i] = (GeometricProperties(**result[0]), *result[1:]) if result else (None, None, None, None)
+        except Exception as e:
+            logger.error(f"Error measuring STEP files in worker processes, measuring serially: {str(e)}")
+            for i in pending:
+                properties[i] = self._measure_step_file(step_files[i], level, streamed, indexes[i])
+        return properties
+    
+    def _start_measurement(self, step_file, level, streamed):
+        """Start measuring a STEP file in a child process; raises RuntimeError once cancelled"""
+        with self._runs_lock:
+            if self._cancelled:
+                raise RuntimeError("the comparison was cancelled")
+            run = _MeasurementRun(step_file, self.eps, level, streamed)
+            self._runs.append(run)
+        return run
+    
+    def _measure_step_file(self, step_file, level='precise', streamed=False, index=None):
+        """Load a STEP file and measure it in this process, whole or part by part"""
+        if streamed:
+            return measure_streaming(step_file, self.eps, level, index)
+        shape = self._load_step_file(step_file)
+        if not shape:
+            return None, None, None, None
+        return self._measure_shape(shape, level)
+    
+    def _measure_shape(self, shape, level='precise'):
+        """Measure a shape as deep as level; what a level does not need is None"""
+        if level == 'quick':
+            return self._calculate_extents(shape), None, None, None
+        if level == 'standard':
+            return self._calculate_properties(shape), None, None, None
+        return (self._calculate_properties(shape), self._calculate_solid_fingerprints(shape),
+                self._calculate_face_signatures(shape), self._calculate_mesh(shape))
+    
     def _load_step_file(self, step_file):
         """Load a STEP file and return the shape"""
+        # Shared with meshing, so each file is transferred through OCC once
+        return self.shape_provider.get_shape(step_file)
+    
+    def _calculate_properties(self, shape):
+        """Calculate the geometric property bundle of a shape"""
         try:
-            step_reader = STEPControl_Reader()
-            status = step_reader.ReadFile(step_file)
-            
-            if status == IFSelect_RetDone:
-                step_reader.TransferRoots()
-                shape = step_reader.Shape()
-                return shape
-            else:
-                logger.error(f"Failed to read STEP file: {step_file}")
-                return None
+            return GeometricProperties.from_shape(shape, self.eps)
         except Exception as e:
-            logger.error(f"Error loading STEP file: {str(e)}")
-            return None
+            logger.error(f"Error calculating geometric properties: {str(e)}")
+            return GeometricProperties()
     
-    def _calculate_volume(self, shape):
-        """Calculate the volume of a shape"""
+    def _calculate_extents(self, shape):
+        """Calculate the bounding box of a shape, without the mass properties"""
         try:
-            props = GProp_GProps()
-            brepgprop.VolumeProperties(shape, props)
-            return props.Mass()
+            return GeometricProperties.extents(shape)
         except Exception as e:
-            logger.error(f"Error calculating volume: {str(e)}")
-            return 0
+            logger.error(f"Error calculating bounding box: {str(e)}")
+            return GeometricProperties()
     
-    def _calculate_surface_area(self, shape):
-        """Calculate the surface area of a shape"""
+    def _calculate_solid_fingerprints(self, shape):
+        """Calculate the fingerprint matrix of the solids of a shape"""
         try:
-            props = GProp_GProps()
-            brepgprop.SurfaceProperties(shape, props)
-            return props.Mass()
+            return solid_fingerprints(shape, self.eps)
         except Exception as e:
-            logger.error(f"Error calculating surface area: {str(e)}")
-            return 0
+            logger.error(f"Error calculating solid fingerprints: {str(e)}")
+            return np.zeros((0, len(FINGERPRINT_FIELDS)))
     
-    def _calculate_center_of_mass(self, shape):
-        """Calculate the center of mass of a shape"""
+    def _calculate_face_signatures(self, shape):
+        """Calculate the signature matrix of the faces of a shape"""
         try:
-            props = GProp_GProps()
-            brepgprop.VolumeProperties(shape, props)
-            com = props.CentreOfMass()
-            return [com.X(), com.Y(), com.Z()]
+            return face_signatures(shape)
         except Exception as e:
-            logger.error(f"Error calculating center of mass: {str(e)}")
-            return [0, 0, 0]
+            logger.error(f"Error calculating face signatures: {str(e)}")
+            return np.zeros((0, len(FACE_SIGNATURE_FIELDS)))
     
-    def _calculate_bounding_box(self, shape):
-        """Calculate the bounding box of a shape"""
+    def _calculate_mesh(self, shape):
+        """Triangulate a shape into vertex and triangle arrays"""
         try:
-            bbox = Bnd_Box()
-            brepbndlib.Add(shape, bbox)
-            
-            xmin, ymin, zmin, xmax, ymax, zmax = bbox.Get()
-            
-            dimensions = [
-                abs(xmax - xmin),
-                abs(ymax - ymin),
-                abs(zmax - zmin)
-            ]
-            
-            volume = dimensions[0] * dimensions[1] * dimensions[2]
-            
-            return {
-                'dimensions': dimensions,
-                'volume': volume
-            }
+            return shape_mesh(shape)
         except Exception as e:
-            logger.error(f"Error calculating bounding box: {str(e)}")
-            return {
-                'dimensions': [0, 0, 0],
-                'volume': 0
-            }
+            logger.error(f"Error meshing shape: {str(e)}")
+            return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
     
     def _calculate_summary(self):
         """Calculate summary statistics for the comparison"""
@@ -279,7 +737,13 @@ class ComparisonEngine:
             len(self.differences['structural']['entity_differences']['count_differences']) +
             len(self.differences['structural']['relationship_differences']['only_in_file1']) +
             len(self.differences['structural']['relationship_differences']['only_in_file2']) +
-            len(self.differences['structural']['relationship_differences']['count_differences'])
+            len(self.differences['structural']['relationship_differences']['count_differences']) +
+            len(self.differences['structural']['assembly_differences']['only_in_file1']) +
+            len(self.differences['structural']['assembly_differences']['only_in_file2']) +
+            len(self.differences['structural']['assembly_differences']['value_differences']) +
+            len(self.differences['structural']['instance_differences']['only_in_file1']) +
+            len(self.differences['structural']['instance_differences']['only_in_file2']) +
+            len(self.differences['structural']['shape_differences']['changed'])
         )
         
         # Count PMI differences
@@ -306,6 +770,11 @@ class ComparisonEngine:
             geo_diffs += 1
         if self.differences['geometric']['bounding_box']['percentage'] > 1:
             geo_diffs += 1
+        if self.differences['geometric']['deviation']['hausdorff'] > 0.1:
+            geo_diffs += 1
+        solids = self.differences['geometric']['solids']
+        geo_diffs += len(solids['removed']) + len(solids['added']) + len(solids['modified'])
+        geo_diffs += len(self.differences['geometric']['parts']['changed'])
         
         # Calculate total differences
         total_diffs = structural_diffs + pmi_diffs + attr_diffs + geo_diffs
@@ -316,11 +785,157 @@ class ComparisonEngine:
         similarity_score = max(0, 100 - (total_diffs / max_possible_diffs * 100))
         
         # Update summary
-        self.differences['summary'] = {
+        self.differences['summary'].update({
             'total_differences': total_diffs,
             'structural_differences': structural_diffs,
             'pmi_differences': pmi_diffs,
             'attribute_differences': attr_diffs,
             'geometric_differences': geo_diffs,
-            'similarity_score': similarity_score
-        } 
\ No newline at end of file
+            'similarity_score': similarity_score,
+            'identical': None,
+            'partial': any(status['status'] in ('timed_out', 'failed')
+                           for status in self.differences['comparators'].values())
+        })
+
+
+def measure_step_file(step_file, eps, level='precise', streamed=False, index=None):
+    """Worker process: load a STEP file and return its properties dict, solid fingerprints, face signatures and mesh"""
+    if streamed:
+        properties, *rest = measure_streaming(step_file, eps, level, index)
+        return None if properties is None else (properties.to_dict(), *rest)
+    shape = default_shape_provider.get_shape(step_file)
+    if not shape:
+        return None
+    properties, solids, faces, mesh = ComparisonEngine(eps=eps)._measure_shape(shape, level)
+    return properties.to_dict(), solids, faces, mesh
+
+
+def _measure_isolated(step_file, eps, level, streamed, connection):
+    """Child process: measure a STEP file and send back the measure_step_file result, or its error"""
+    try:
+        connection.send((measure_step_file(step_file, eps, level, streamed), None))
+    except Exception as e:
+        connection.send((None, str(e)))
+    finally:
+        connection.close()
+
+
+class _ThreadRun:
+    """A comparator running on a daemon thread, with the scratch engine it fills"""
+
+    def __init__(self, comparator, engine, data1, data2, job):
+        self.engine = engine
+        self.outcome = None
+        self.thread = threading.Thread(target=self._run, args=(comparator, data1, data2, job), daemon=True)
+        self.thread.start()
+
+    def _run(self, comparator, data1, data2, job):
+        try:
+            start = time.perf_counter()
+            comparator.function(self.engine, data1, data2, job)
+            self.outcome = (time.perf_counter() - start, None)
+        except Exception as e:
+            self.outcome = (None, e)
+
+    def result(self, timeout):
+        """(engine, seconds) once the comparator is done; raises TimeoutError or its error"""
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            raise TimeoutError()
+        seconds, error = self.outcome
+        if error is not None:
+            raise error
+        return self.engine, seconds
+
+    def cancel(self):
+        """Terminate the engine's measurement processes; the thread itself finishes in the background"""
+        self.engine.cancel()
+
+
+class _MeasurementRun:
+    """A STEP file measured in a child process, which can be terminated"""
+
+    def __init__(self, step_file, eps, level, streamed):
+        context = multiprocessing.get_context(_PROCESS_CONTEXT)
+        self.connection, child_connection = context.Pipe(duplex=False)
+        # Daemonic, so it cannot start processes of its own that would outlive it
+        self.process = context.Process(target=_measure_isolated,
+                                       args=(step_file, eps, level, streamed, child_connection), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def result(self):
+        """The (properties, solids, faces, mesh) measurement; raises RuntimeError if the process failed"""
+        try:
+            result, error = self.connection.recv()
+        except EOFError:
+            self.process.join()
+            raise RuntimeError(f"measurement process exited with code {self.process.exitcode}")
+        finally:
+            self.connection.close()
+        self.process.join()
+        if error is not None:
+            raise RuntimeError(error)
+        if result is None:
+            return None, None, None, None
+        return (GeometricProperties(**result[0]), *result[1:])
+
+    def terminate(self):
+        """Stop the process, with the transfer or measurement it is in"""
+        self.process.terminate()
+        self.process.join()
+
+
+def without_mesh(measurement):
+    """A measurement tuple with an empty mesh, for models that need no surface deviation"""
+    return (*measurement[:3], (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)))
+
+
+def register_comparator(comparator):
+    """Add a Comparator to those run by every engine, replacing one of the same name"""
+    for i, registered in enumerate(COMPARATORS):
+        if registered.name == comparator.name:
+            COMPARATORS[i] = comparator
+            return
+    COMPARATORS.append(comparator)
+
+
+def _compare_geometry(engine, data1, data2, job):
+    """Comparator: geometric properties from the given measurements or STEP files"""
+    if job['measurements']:
+        engine._compare_measurements(*job['measurements'], bvh1=job['bvh1'], level=job['level'])
+    else:
+        indexes = (data1.get('index'), data2.get('index')) if engine._streams(data1, data2) else None
+        engine._compare_geometric_properties(job['step_file1'], job['step_file2'],
+                                             engine._same_geometry(data1, data2), job['level'], indexes)
+
+
+# Built-in comparators, in report order. Budgets are seconds; geometry gets
+# the budget of the comparison level, plus TRANSFER_BUDGET to load the files
+COMPARATORS = [
+    Comparator('header', lambda engine, data1, data2, job: engine._compare_headers(data1['header'], data2['header']),
+               inputs=('header',), sections=[('header',)], budget=5),
+    Comparator('entities', lambda engine, data1, data2, job: engine._compare_entities(data1['entities'], data2['entities']),
+               inputs=('entities',), sections=[('structural', 'entity_differences')], budget=5),
+    Comparator('instances', lambda engine, data1, data2, job: engine._compare_instances(data1, data2),
+               inputs=('entity_hashes', 'index'), sections=[('structural', 'instance_differences')],
+               level='standard', budget=30),
+    Comparator('shapes', lambda engine, data1, data2, job: engine._compare_revision_trees(data1['revision_tree'],
+                                                                                         data2['revision_tree']),
+               inputs=('revision_tree',), sections=[('structural', 'shape_differences')],
+               level='standard', budget=5),
+    Comparator('relationships', lambda engine, data1, data2, job: engine._compare_relationships(data1['relationships'],
+                                                                                               data2['relationships']),
+               inputs=('relationships',), sections=[('structural', 'relationship_differences')],
+               level='standard', budget=10),
+    Comparator('assemblies', lambda engine, data1, data2, job: engine._compare_assemblies(data1['product_structure'],
+                                                                                          data2['product_structure']),
+               inputs=('product_structure',), sections=[('structural', 'assembly_differences')],
+               level='standard', budget=10),
+    Comparator('pmi', lambda engine, data1, data2, job: engine._compare_pmi(data1['pmi_data'], data2['pmi_data']),
+               inputs=('pmi_data',), sections=[('pmi',)], level='standard', budget=10),
+    Comparator('attributes', lambda engine, data1, data2, job: engine._compare_attributes(data1['attributes'],
+                                                                                         data2['attributes']),
+               inputs=('attributes',), sections=[('attributes',)], level='standard', budget=10),
+    Comparator('geometry', _compare_geometry, sections=[('geometric',)], geometry=True, isolated=True)
+]
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import zipfile
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Extensions accepted for upload besides plain .stp/.step/.p21
+COMPRESSED_EXTENSIONS = ('.stp.gz', '.step.gz', '.p21.gz', '.stpz')
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZIP_MAGIC = b'PK\x03\x04'
+_CHUNK_SIZE = 1024 * 1024
+
+
+def compression_of(file_path):
+    """Return 'gzip', 'zip' or None, judged by the file's magic bytes rather than its name"""
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return 'gzip'
+    if magic == _ZIP_MAGIC:
+        return 'zip'
+    return None
+
+
+def _zip_member(archive):
+    """Pick the STEP file inside a .stpZ archive (its only or largest member)"""
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if not members:
+        raise ValueError("Zip archive contains no STEP file")
+    return max(members, key=lambda info: info.file_size)
+
+
+@contextmanager
+def open_decompressed(file_path):
+    """Open a plain, gzip or zip-compressed STEP file as a stream of its Part 21 text"""
+    compression = compression_of(file_path)
+    if compression == 'gzip':
+        with gzip.open(file_path, 'rb') as stream:
+            yield stream
+    elif compression == 'zip':
+        with zipfile.ZipFile(file_path) as archive:
+            with archive.open(_zip_member(archive)) as stream:
+                yield stream
+    else:
+        with open(file_path, 'rb') as stream:
+            yield stream
+
+
+def _decompressed_size_hint(file_path, compression):
+    """Size of the decompressed text from the zip directory or the gzip ISIZE trailer"""
+    if compression == 'zip':
+        with zipfile.ZipFile(file_path) as archive:
+            return _zip_member(archive).file_size
+    # ISIZE is the size modulo 2**32 of the last member only, so it is a hint
+    with open(file_path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), 'little')
+
+
+def read_decompressed(file_path):
+    """Stream-decompress a compressed STEP file into memory, hashing it on the way
+
+    Returns (buffer, sha256 hex digest of the decompressed text). The buffer
+    is an anonymous memory map, so nothing is written to disk.
+    """
+    compression = compression_of(file_path)
+    capacity = max(_decompressed_size_hint(file_path, compression), 1)
+    buffer = mmap.mmap(-1, capacity)
+    hash_sha256 = hashlib.sha256()
+    size = 0
+
+    with open_decompressed(file_path) as stream:
+        for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b""):
+            hash_sha256.update(chunk)
+            if size + len(chunk) > capacity:
+                # The size hint was short (multi-member or >4 GB gzip); grow
+                capacity = max(capacity * 2, size + len(chunk))
+                grown = mmap.mmap(-1, capacity)
+                grown[:size] = buffer[:size]
+                buffer.close()
+                buffer = grown
+            buffer[size:size + len(chunk)] = chunk
+            size += len(chunk)
+
+    if size != len(buffer):
+        # The tokenizer takes the buffer length as the end of the data
+        exact = mmap.mmap(-1, size) if size else b''
+        if size:
+            exact[:size] = buffer[:size]
+        buffer.close()
+        buffer = exact
+    return buffer, hash_sha256.hexdigest()
+
+
+@contextmanager
+def spilled_step_file(file_path):
+    """Yield a path OCC can read: the file itself, or a temporary decompressed copy
+
+    Only geometry loading needs this; the parser reads compressed files
+    directly.
+    """
+    if compression_of(file_path) is None:
+        yield file_path
+        return
+
+    fd, plain_path = tempfile.mkstemp(suffix='.stp')
+    try:
+        with os.fdopen(fd, 'wb') as plain, open_decompressed(file_path) as stream:
+            shutil.copyfileobj(stream, plain, _CHUNK_SIZE)
+        yield plain_path
+    finally:
+        try:
+            os.remove(plain_path)
+        except OSError as e:
+            logger.warning(f"Could not remove temporary STEP file {plain_path}: {str(e)}")
@@ -0,0 +1,270 @@
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Refinement rounds before references that lead into a cycle stop being followed
+MAX_ROUNDS = 64
+# Bytes of records canonicalized and hashed together
+CHUNK_SIZE = 4 * 1024 * 1024
+# Hash functions in a MinHash signature
+MINHASH_PERMUTATIONS = 128
+# Distinct hashes remixed together by minhash_signature, sized to keep the
+# block of remixed values in cache
+MINHASH_BLOCK = 512
+# Bump whenever entity hashes change, so stored signatures are rebuilt
+HASH_VERSION = 2
+
+_QUOTE, _HASH, _LPAREN, _RPAREN, _COMMA, _EQUALS, _SLASH, _STAR = (ord(c) for c in "'#(),=/*")
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b' \t\r\n\f\v')] = True
+_DIGITS = np.zeros(256, dtype=bool)
+_DIGITS[list(b'0123456789')] = True
+# Hash of a reference to an id that is not in the file
+_MISSING = np.uint64(0x9E3779B97F4A7C15)
+# Odd multiplier of the polynomial text hash
+_PRIME = np.uint64(0x100000001B3)
+# Offset of the MinHash seeds, away from the small integers
+_MINHASH_SEED = np.uint64(0xD1B54A32D192ED03)
+
+
+def _mix(values):
+    """SplitMix64 finalizer: spread every bit of a uint64 array over the whole word"""
+    with np.errstate(over='ignore'):
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xBF58476D1CE4E5B9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _row_chunks(index):
+    """Split the index rows into runs of about CHUNK_SIZE record bytes"""
+    ends = np.cumsum(index.lengths, dtype=np.int64)
+    total = int(ends[-1]) if ends.size else 0
+    bounds = np.searchsorted(ends, np.arange(CHUNK_SIZE, total, CHUNK_SIZE), side='right')
+    bounds = np.unique(np.concatenate([[0], bounds, [len(index)]]))
+    return zip(bounds[:-1].tolist(), bounds[1:].tolist())
+
+
+def _canonical_chunk(data, index, first, last):
+    """Canonical text of rows [first, last), concatenated, and the length of each
+
+    The text of a record runs from its type name to the ';', with strings
+    kept as they are, every reference cut down to a bare '#', and whitespace
+    and comments dropped, so it no longer depends on the instance numbering.
+    """
+    offsets = index.offsets[first:last].astype(np.int64)
+    ends = offsets + index.lengths[first:last]
+    low, high = int(offsets[0]), int(ends[-1])
+    region = data[low:high]
+    equals = low + np.flatnonzero(region == _EQUALS)
+    starts = equals[np.minimum(np.searchsorted(equals, offsets), equals.size - 1)] + 1 - low
+
+    # Bytes between the '=' and the end of each record
+    runs = np.empty(2 * starts.size, dtype=np.int64)
+    runs[0::2] = starts - np.concatenate([[0], ends[:-1] - low])
+    runs[1::2] = ends - low - starts
+    inside = np.repeat(np.tile([False, True], starts.size), runs)
+
+    quotes = (region == _QUOTE) & inside
+    in_string = np.logical_xor.accumulate(quotes) | quotes
+    whitespace = _WHITESPACE[region]
+    drop = ~inside | (whitespace & ~in_string)
+
+    # Comments are rare inside records; blank them out one by one
+    comments = np.flatnonzero((region[:-1] == _SLASH) & (region[1:] == _STAR) & ~in_string[:-1] & inside[:-1])
+    if comments.size:
+        text = region.tobytes()
+        for start in comments.tolist():
+            if not drop[start]:
+                end = text.find(b'*/', start + 2)
+                drop[start:end + 2 if end >= 0 else region.size] = True
+        quotes &= ~drop
+        in_string = np.logical_xor.accumulate(quotes) | quotes
+        drop |= whitespace & ~in_string
+
+    # Reference digits: the run of digits right after a '#' outside strings
+    digits = _DIGITS[region]
+    run_starts = np.maximum.accumulate(np.where(digits, 0, np.arange(region.size, dtype=np.int32)))
+    references = (region == _HASH) & ~in_string & ~drop
+    drop |= digits & references[run_starts]
+
+    kept = np.concatenate([[0], np.cumsum(~drop, dtype=np.int64)])
+    return region[~drop], kept[ends - low] - kept[starts]
+
+
+def _hash_texts(text, lengths):
+    """64-bit hash of each of a run of concatenated byte strings"""
+    lengths = lengths.astype(np.int64)
+    starts = np.cumsum(lengths) - lengths
+    sums = np.zeros(lengths.size, dtype=np.uint64)
+    if text.size:
+        # Polynomial hash: byte j of an n-byte string weighs PRIME ** (n - 1 - j)
+        with np.errstate(over='ignore'):
+            powers = np.full(int(lengths.max()), _PRIME, dtype=np.uint64)
+            powers[0] = 1
+            powers = np.cumprod(powers)
+            distances = np.repeat(starts + lengths - 1, lengths) - np.arange(text.size)
+            terms = (text.astype(np.uint64) + np.uint64(1)) * powers[distances]
+            nonempty = lengths > 0
+            sums[nonempty] = np.add.reduceat(terms, starts[nonempty])
+    return _mix(sums ^ _mix(lengths.astype(np.uint64)))
+
+
+def _reference_slots(text, lengths, ref_counts):
+    """Attribute slot of every reference in canonical record texts, in record order
+
+    A reference's slot counts the attribute separators before it, so the
+    references of one attribute share a slot. Complex instances have one
+    more level of parentheses, one list per partial type. Records whose
+    references cannot be lined up with the reference graph put them all in
+    slot 0.
+    """
+    lengths = lengths.astype(np.int64)
+    expected = np.asarray(ref_counts, dtype=np.int64)
+    if not text.size:
+        return np.zeros(int(expected.sum()), dtype=np.int64)
+    record_starts = np.minimum(np.cumsum(lengths) - lengths, text.size - 1)
+    record_rows = np.repeat(np.arange(lengths.size), lengths)
+
+    quotes = text == _QUOTE
+    in_string = np.logical_xor.accumulate(quotes) | quotes
+    opens = (text == _LPAREN) & ~in_string
+    closes = (text == _RPAREN) & ~in_string
+    depth_before = np.cumsum(opens.astype(np.int32) - closes.astype(np.int32), dtype=np.int32) - opens + closes
+    # Depth relative to the start of each record, in case one is unbalanced
+    depth_before -= np.repeat(depth_before[record_starts], lengths)
+
+    complex_records = text[record_starts] == _LPAREN
+    level = np.where(complex_records, 2, 1)[record_rows]
+    counter = np.cumsum(((text == _COMMA) | opens) & ~in_string & (depth_before <= level), dtype=np.int32)
+
+    references = np.flatnonzero((text == _HASH) & ~in_string)
+    owners = record_rows[references]
+    slots = counter[references] - counter[record_starts[owners]]
+
+    found = np.bincount(owners, minlength=lengths.size)
+    if (found == expected).all():
+        return slots
+    aligned = found == expected
+    result = np.zeros(int(expected.sum()), dtype=np.int64)
+    result[np.repeat(aligned, expected)] = slots[np.repeat(aligned, found)]
+    return result
+
+
+def _slot_positions(ref_counts, slots):
+    """Position of every reference among those of its record and slot, in record order"""
+    owners = np.repeat(np.arange(len(ref_counts)), ref_counts)
+    if not owners.size:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.concatenate([[True], (owners[1:] != owners[:-1]) | (slots[1:] != slots[:-1])])
+    positions = np.arange(owners.size)
+    return positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+
+def entity_hashes(index, buffer):
+    """Renumbering-invariant content hash of every entity, aligned with index rows
+
+    Each record starts from a hash of its type and literal attributes with
+    the instance ids left out. Every round then mixes in the hashes of the
+    records it references, tagged with their attribute slot and their
+    position in it, in the style of Weisfeiler-Lehman refinement. After as
+    many rounds as the reference graph is deep, a hash covers everything
+    the entity points to and stops changing. Two exports of the same model
+    that only renumber '#ids' give equal hashes, while a reversed loop or a
+    permuted point list does not. The schema is not known here, so a
+    reordered SET changes the hash too.
+
+    Each round is a full pass over the reference graph, and the rounds stop
+    once no hash changes. Entities that reach a reference cycle never stop
+    changing, so a file with any such cycle costs MAX_ROUNDS (64) passes;
+    their hashes are cut off there, which is the same for every file, so
+    they still compare.
+    """
+    graph = index.references
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    ref_counts = np.diff(graph.indptr) if graph is not None else np.zeros(len(index), dtype=np.int64)
+    literals, slots = [np.zeros(0, dtype=np.uint64)], [np.zeros(0, dtype=np.int64)]
+    for first, last in _row_chunks(index):
+        text, lengths = _canonical_chunk(data, index, first, last)
+        literals.append(_hash_texts(text, lengths))
+        slots.append(_reference_slots(text, lengths, ref_counts[first:last]))
+    literals = np.concatenate(literals)
+    if graph is None or not graph.indices.size:
+        return _mix(literals)
+
+    slots = np.concatenate(slots)
+    positions = _slot_positions(ref_counts, slots)
+    with np.errstate(over='ignore'):
+        slot_tags = _mix(_mix(slots.astype(np.uint64) + np.uint64(1)) + positions.astype(np.uint64))
+    targets = graph.indices.astype(np.int64)
+    resolved = targets >= 0
+    has_references = ref_counts > 0
+    starts = graph.indptr[:-1][has_references]
+
+    hashes = _mix(literals)
+    for rounds in range(1, MAX_ROUNDS + 1):
+        target_hashes = np.where(resolved, hashes[np.maximum(targets, 0)], _MISSING)
+        # Sum over each record's references; the tags keep them in order
+        with np.errstate(over='ignore'):
+            sums = np.zeros(len(literals), dtype=np.uint64)
+            sums[has_references] = np.add.reduceat(_mix(target_hashes ^ slot_tags), starts)
+            refined = _mix(literals + _mix(sums))
+        if np.array_equal(refined, hashes):
+            break
+        hashes = refined
+    logger.debug(f"Hashed {len(literals)} entities in {rounds} rounds")
+    return hashes
+
+
+def diff_entity_hashes(hashes1, hashes2):
+    """Rows of each file whose hash has no counterpart in the other
+
+    The hashes are compared as multisets: when a hash occurs n times in file
+    1 and m times in file 2, the last n - m occurrences in file 1 are
+    removed (or the last m - n in file 2 added). Sorts and binary searches
+    only, so near-linear in the entity count. Returns (removed rows of file
+    1, added rows of file 2), each in row order.
+    """
+    return _unmatched(hashes1, hashes2), _unmatched(hashes2, hashes1)
+
+
+def same_entities(hashes1, hashes2):
+    """Whether two files hold the same multiset of entity hashes, i.e. equal up to renumbering"""
+    if hashes1 is None or hashes2 is None or len(hashes1) != len(hashes2):
+        return False
+    return np.array_equal(np.sort(hashes1), np.sort(hashes2))
+
+
+def _unmatched(hashes, other):
+    """Rows of hashes beyond the number of copies found in other"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    other = np.sort(np.asarray(other, dtype=np.uint64))
+    order = np.argsort(hashes, kind='stable')
+    sorted_hashes = hashes[order]
+    # Occurrence number of each row among the rows with the same hash
+    ranks = np.arange(sorted_hashes.size) - np.searchsorted(sorted_hashes, sorted_hashes, side='left')
+    copies = np.searchsorted(other, sorted_hashes, side='right') - np.searchsorted(other, sorted_hashes, side='left')
+    return np.sort(order[ranks >= copies])
+
+
+def minhash_signature(hashes, num_perm=MINHASH_PERMUTATIONS):
+    """MinHash signature of the set of entity hashes, as num_perm uint32 values
+
+    Slot k holds the smallest of the hashes remixed with the k-th seed, so
+    the fraction of equal slots between two files estimates the Jaccard
+    similarity of their sets of entities. Duplicates do not matter, so they
+    are dropped first; the distinct hashes are then remixed with every seed
+    at once, MINHASH_BLOCK of them at a time.
+    """
+    hashes = np.sort(np.asarray(hashes, dtype=np.uint64))
+    signature = np.full(num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if not hashes.size:
+        return (signature & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    # np.unique is far slower than a sort on large arrays
+    hashes = hashes[np.concatenate([[True], hashes[1:] != hashes[:-1]])]
+    seeds = _mix(np.arange(num_perm, dtype=np.uint64) ^ _MINHASH_SEED)
+    for start in range(0, hashes.size, MINHASH_BLOCK):
+        np.minimum(signature, _mix(hashes[start:start + MINHASH_BLOCK, None] ^ seeds).min(axis=0), out=signature)
+    return (signature & np.uint64(0xFFFFFFFF)).astype(np.uint32)
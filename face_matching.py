@@ -0,0 +1,207 @@
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns of a face signature matrix
+FACE_SIGNATURE_FIELDS = (
+    'surface_type', 'area', 'centroid_x', 'centroid_y', 'centroid_z',
+    'normal_x', 'normal_y', 'normal_z', 'xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax'
+)
+# Reported field of each column
+FIELD_GROUPS = (
+    'surface_type', 'area', 'centroid', 'centroid', 'centroid', 'normal', 'normal', 'normal',
+    'bounding_box', 'bounding_box', 'bounding_box', 'bounding_box', 'bounding_box', 'bounding_box'
+)
+# Names of the GeomAbs_SurfaceType values, in enum order
+SURFACE_TYPES = (
+    'PLANE', 'CYLINDER', 'CONE', 'SPHERE', 'TORUS', 'BEZIER_SURFACE', 'BSPLINE_SURFACE',
+    'SURFACE_OF_REVOLUTION', 'SURFACE_OF_EXTRUSION', 'OFFSET_SURFACE', 'OTHER_SURFACE'
+)
+_CENTROID = slice(2, 5)
+_NORMAL = slice(5, 8)
+_BOUNDS = slice(8, 14)
+
+# Tolerance of the unit normal components
+NORMAL_TOLERANCE = 1e-3
+# Radius, as a fraction of the model size, within which a changed face is looked for
+SEARCH_RADIUS = 0.05
+
+_NEIGHBOUR_CELLS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)])
+
+
+def surface_type_name(code):
+    """Name of a GeomAbs_SurfaceType value"""
+    code = int(code)
+    return SURFACE_TYPES[code] if 0 <= code < len(SURFACE_TYPES) else str(code)
+
+
+def _quantize(signatures, tolerance):
+    """Hash key of every face: its signature rounded to the tolerance
+
+    Area is taken as a length (its square root) so one tolerance applies to
+    every column but the normal, which is unit-free.
+    """
+    scaled = signatures.copy()
+    scaled[:, 1] = np.sqrt(np.maximum(scaled[:, 1], 0)) / tolerance
+    scaled[:, _CENTROID] /= tolerance
+    scaled[:, _NORMAL] /= NORMAL_TOLERANCE
+    scaled[:, _BOUNDS] /= tolerance
+    return np.round(scaled).astype(np.int64)
+
+
+def _key_ids(keys):
+    """Dense id of every key row; equal rows get equal ids
+
+    Rows are folded into one 64-bit hash and the hashes sorted, which is much
+    faster than sorting the rows themselves. Two different faces that share
+    a hash are caught by the exact column comparison afterwards.
+    """
+    hashes = np.zeros(len(keys), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in keys.T.astype(np.uint64):
+            hashes = (hashes ^ column) * np.uint64(0x100000001B3)
+    order = np.argsort(hashes)
+    sorted_hashes = hashes[order]
+    ids = np.empty(len(keys), dtype=np.int64)
+    ids[order] = np.cumsum(np.concatenate([[0], sorted_hashes[1:] != sorted_hashes[:-1]]))
+    return ids
+
+
+def _unused(count, used):
+    """Indices in range(count) that are not in used"""
+    mask = np.ones(count, dtype=bool)
+    mask[used] = False
+    return np.flatnonzero(mask)
+
+
+def _ranks(ids):
+    """Occurrence number of every id among the equal ids before it"""
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(sorted_ids)) + 1])
+    lengths = np.diff(np.concatenate([starts, [ids.size]]))
+    ranks = np.empty_like(ids)
+    ranks[order] = np.arange(ids.size) - np.repeat(starts, lengths)
+    return ranks
+
+
+def _differing_columns(values1, values2, tolerance):
+    """Mask of the columns of each pair that differ beyond the tolerance"""
+    differs = np.zeros(values1.shape, dtype=bool)
+    differs[:, 0] = values1[:, 0] != values2[:, 0]
+    area1, area2 = np.sqrt(np.maximum(values1[:, 1], 0)), np.sqrt(np.maximum(values2[:, 1], 0))
+    differs[:, 1] = np.abs(area1 - area2) > tolerance
+    differs[:, _CENTROID] = np.abs(values1[:, _CENTROID] - values2[:, _CENTROID]) > tolerance
+    differs[:, _NORMAL] = np.abs(values1[:, _NORMAL] - values2[:, _NORMAL]) > NORMAL_TOLERANCE
+    differs[:, _BOUNDS] = np.abs(values1[:, _BOUNDS] - values2[:, _BOUNDS]) > tolerance
+    return differs
+
+
+def _describe(signature):
+    """Signature row as a dict with the surface type by name"""
+    entry = dict(zip(FACE_SIGNATURE_FIELDS, signature.tolist()))
+    entry['surface_type'] = surface_type_name(signature[0])
+    return entry
+
+
+def match_faces(signatures1, signatures2, tolerance=0.01):
+    """Match the faces of two revisions by their signatures
+
+    Faces whose signature rounds to the same key are unchanged and are
+    paired through one sort of the keys, so the bulk of the work is
+    O(n log n). The remaining faces are put in hash buckets by surface type
+    and centroid cell, and each face of file 1 is paired with the closest
+    face of the same type in its neighbouring cells, closest pairs first.
+    Returns the 'removed' and 'added' faces, the 'modified' pairs with the
+    fields that changed and the number of unchanged faces; faces are
+    numbered from 0 in signature row order.
+    """
+    signatures1 = np.asarray(signatures1, dtype=float).reshape(-1, len(FACE_SIGNATURE_FIELDS))
+    signatures2 = np.asarray(signatures2, dtype=float).reshape(-1, len(FACE_SIGNATURE_FIELDS))
+    count1, count2 = len(signatures1), len(signatures2)
+
+    # Unchanged faces: equal keys, the k-th copy in file 1 with the k-th in file 2
+    ids = _key_ids(_quantize(np.vstack([signatures1, signatures2]), tolerance))
+    ids1, ids2 = ids[:count1], ids[count1:]
+    codes1 = ids1 * (count1 + count2 + 1) + _ranks(ids1)
+    codes2 = ids2 * (count1 + count2 + 1) + _ranks(ids2)
+    _, exact1, exact2 = np.intersect1d(codes1, codes2, return_indices=True)
+
+    rest1 = _unused(count1, exact1)
+    rest2 = _unused(count2, exact2)
+    pairs1, pairs2 = _match_nearby(signatures1, signatures2, rest1, rest2)
+
+    pairs1 = np.concatenate([exact1, pairs1]).astype(np.int64)
+    pairs2 = np.concatenate([exact2, pairs2]).astype(np.int64)
+    order = np.argsort(pairs1)
+    pairs1, pairs2 = pairs1[order], pairs2[order]
+
+    # Faces that landed on either side of a rounding boundary are still unchanged
+    differs = _differing_columns(signatures1[pairs1], signatures2[pairs2], tolerance)
+    modified = []
+    for row in np.flatnonzero(differs.any(axis=1)).tolist():
+        modified.append({
+            'face1': int(pairs1[row]),
+            'face2': int(pairs2[row]),
+            'file1': _describe(signatures1[pairs1[row]]),
+            'file2': _describe(signatures2[pairs2[row]]),
+            'changed': sorted({FIELD_GROUPS[column] for column in np.flatnonzero(differs[row]).tolist()})
+        })
+
+    logger.debug(f"Matched {exact1.size} identical and {pairs1.size - exact1.size} nearby faces "
+                 f"of {count1} / {count2}")
+    return {
+        'removed': [{'face1': face, 'file1': _describe(signatures1[face])}
+                    for face in _unused(count1, pairs1).tolist()],
+        'added': [{'face2': face, 'file2': _describe(signatures2[face])}
+                  for face in _unused(count2, pairs2).tolist()],
+        'modified': modified,
+        'unchanged': int(pairs1.size - len(modified))
+    }
+
+
+def _match_nearby(signatures1, signatures2, rest1, rest2):
+    """Pair leftover faces of the same surface type whose centroids are close"""
+    empty = np.zeros(0, dtype=np.int64)
+    if not rest1.size or not rest2.size:
+        return empty, empty
+
+    centroids = np.vstack([signatures1[:, _CENTROID], signatures2[:, _CENTROID]])
+    diagonal = np.linalg.norm(centroids.max(axis=0) - centroids.min(axis=0))
+    radius = max(diagonal * SEARCH_RADIUS, 1e-9)
+
+    # Hash buckets of the file 2 leftovers by (surface type, centroid cell)
+    buckets = {}
+    cells2 = np.floor(signatures2[rest2, _CENTROID] / radius).astype(np.int64)
+    for face, surface_type, cell in zip(rest2.tolist(), signatures2[rest2, 0].tolist(), cells2.tolist()):
+        buckets.setdefault((surface_type, *cell), []).append(face)
+
+    candidates = []
+    cells1 = np.floor(signatures1[rest1, _CENTROID] / radius).astype(np.int64)
+    for face, surface_type, cell in zip(rest1.tolist(), signatures1[rest1, 0].tolist(), cells1.tolist()):
+        for offset in (cell + _NEIGHBOUR_CELLS).tolist():
+            for other in buckets.get((surface_type, *offset), ()):
+                candidates.append((face, other))
+    if not candidates:
+        return empty, empty
+
+    # Cost: centroid distance in search radii, normal turn and log area ratio
+    faces1, faces2 = np.array(candidates, dtype=np.int64).T
+    values1, values2 = signatures1[faces1], signatures2[faces2]
+    distance = np.linalg.norm(values1[:, _CENTROID] - values2[:, _CENTROID], axis=1) / radius
+    turn = 1 - np.sum(values1[:, _NORMAL] * values2[:, _NORMAL], axis=1)
+    area_ratio = np.abs(np.log((values1[:, 1] + 1e-12) / (values2[:, 1] + 1e-12)))
+    costs = distance + turn + area_ratio
+    within = distance <= 1
+
+    used1, used2 = set(), set()
+    pairs1, pairs2 = [], []
+    order = np.flatnonzero(within)[np.argsort(costs[within], kind='stable')]
+    for face1, face2 in zip(faces1[order].tolist(), faces2[order].tolist()):
+        if face1 not in used1 and face2 not in used2:
+            used1.add(face1)
+            used2.add(face2)
+            pairs1.append(face1)
+            pairs2.append(face2)
+    return np.array(pairs1, dtype=np.int64), np.array(pairs2, dtype=np.int64)
@@ -0,0 +1,242 @@
+import numpy as np
+from OCC.Core.GProp import GProp_GProps
+from OCC.Core.BRepGProp import brepgprop
+from OCC.Core.BRepBndLib import brepbndlib
+from OCC.Core.Bnd import Bnd_Box, Bnd_OBB
+from OCC.Core.BRep import BRep_Tool
+from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+from OCC.Core.BRepAdaptor import BRepAdaptor_Surface
+from OCC.Core.BRepLProp import BRepLProp_SLProps
+from OCC.Core.ShapeAnalysis import ShapeAnalysis_Surface
+from OCC.Core.TopAbs import TopAbs_SOLID, TopAbs_FACE, TopAbs_REVERSED
+from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopoDS import topods
+from OCC.Core.TopLoc import TopLoc_Location
+from solid_matching import FINGERPRINT_FIELDS
+from face_matching import FACE_SIGNATURE_FIELDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GeometricProperties:
+    """Volume, area, mass distribution and extents of one shape, computed together
+
+    One volume integration yields the volume, center of mass, inertia tensor
+    and principal moments; area needs its own surface integration. eps is the
+    relative accuracy of the adaptive integration; None uses OCC's fixed-order
+    Gauss integration, which is faster but has no error bound.
+    """
+
+    def __init__(self, volume=0, surface_area=0, center_of_mass=None, inertia=None,
+                 principal_moments=None, principal_axes=None, bounding_box=None,
+                 oriented_bounding_box=None, parts=None):
+        self.volume = volume
+        self.surface_area = surface_area
+        self.center_of_mass = center_of_mass or [0, 0, 0]
+        self.inertia = inertia or [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+        self.principal_moments = principal_moments or [0, 0, 0]
+        self.principal_axes = principal_axes or [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+        self.bounding_box = bounding_box or {'dimensions': [0, 0, 0], 'volume': 0}
+        self.oriented_bounding_box = oriented_bounding_box or {
+            'center': [0, 0, 0], 'axes': [[1, 0, 0], [0, 1, 0], [0, 0, 1]], 'dimensions': [0, 0, 0], 'volume': 0
+        }
+        # Per-part volume and area when measured part by part (streaming mode)
+        self.parts = parts
+
+    @classmethod
+    def from_shape(cls, shape, eps=None, oriented=True):
+        """Compute every property of a shape; oriented=False skips the oriented box search"""
+        volume_props = GProp_GProps()
+        surface_props = GProp_GProps()
+        if eps is None:
+            brepgprop.VolumeProperties(shape, volume_props)
+            brepgprop.SurfaceProperties(shape, surface_props)
+        else:
+            brepgprop.VolumeProperties(shape, volume_props, eps)
+            brepgprop.SurfaceProperties(shape, surface_props, eps)
+
+        com = volume_props.CentreOfMass()
+        matrix = volume_props.MatrixOfInertia()
+        inertia = [[matrix.Value(row, column) for column in range(1, 4)] for row in range(1, 4)]
+
+        # Principal moments are invariant to how the part sits in the file,
+        # so order them to compare across revisions
+        principal = volume_props.PrincipalProperties()
+        axes = [principal.FirstAxisOfInertia(), principal.SecondAxisOfInertia(), principal.ThirdAxisOfInertia()]
+        moments = list(principal.Moments())
+        order = np.argsort(moments)
+        principal_moments = [moments[i] for i in order]
+        principal_axes = [[axes[i].X(), axes[i].Y(), axes[i].Z()] for i in order]
+
+        return cls(
+            volume=volume_props.Mass(),
+            surface_area=surface_props.Mass(),
+            center_of_mass=[com.X(), com.Y(), com.Z()],
+            inertia=inertia,
+            principal_moments=principal_moments,
+            principal_axes=principal_axes,
+            bounding_box=cls._bounding_box(shape),
+            oriented_bounding_box=cls._oriented_bounding_box(shape) if oriented else None
+        )
+
+    @classmethod
+    def extents(cls, shape):
+        """Only the axis-aligned bounding box of a shape, with no integration"""
+        return cls(bounding_box=cls._bounding_box(shape))
+
+    @staticmethod
+    def _bounding_box(shape):
+        """Axis-aligned bounding box corners, dimensions and volume"""
+        bbox = Bnd_Box()
+        brepbndlib.Add(shape, bbox)
+        xmin, ymin, zmin, xmax, ymax, zmax = bbox.Get()
+        dimensions = [abs(xmax - xmin), abs(ymax - ymin), abs(zmax - zmin)]
+        return {
+            'min': [xmin, ymin, zmin],
+            'max': [xmax, ymax, zmax],
+            'dimensions': dimensions,
+            'volume': dimensions[0] * dimensions[1] * dimensions[2]
+        }
+
+    @staticmethod
+    def _oriented_bounding_box(shape):
+        """Tight oriented bounding box, with its sides sorted longest first"""
+        obb = Bnd_OBB()
+        # Use the triangulation when there is one and search for the optimal box
+        brepbndlib.AddOBB(shape, obb, True, True, True)
+        center = obb.Center()
+        sides = [
+            (2 * obb.XHSize(), obb.XDirection()),
+            (2 * obb.YHSize(), obb.YDirection()),
+            (2 * obb.ZHSize(), obb.ZDirection())
+        ]
+        sides.sort(key=lambda side: side[0], reverse=True)
+        dimensions = [length for length, _ in sides]
+        return {
+            'center': [center.X(), center.Y(), center.Z()],
+            'axes': [[direction.X(), direction.Y(), direction.Z()] for _, direction in sides],
+            'dimensions': dimensions,
+            'volume': dimensions[0] * dimensions[1] * dimensions[2]
+        }
+
+    def fingerprint(self):
+        """Return the properties as one row of a solid fingerprint matrix"""
+        return [self.volume, self.surface_area, *self.center_of_mass,
+                *self.principal_moments, *self.bounding_box['dimensions']]
+
+    def to_dict(self):
+        """Return the properties as a plain dict"""
+        return {
+            'volume': self.volume,
+            'surface_area': self.surface_area,
+            'center_of_mass': self.center_of_mass,
+            'inertia': self.inertia,
+            'principal_moments': self.principal_moments,
+            'principal_axes': self.principal_axes,
+            'bounding_box': self.bounding_box,
+            'oriented_bounding_box': self.oriented_bounding_box,
+            'parts': self.parts
+        }
+
+
+def solid_fingerprints(shape, eps=None):
+    """Return the fingerprint matrix of every solid in a shape, one row per solid
+
+    Columns follow solid_matching.FINGERPRINT_FIELDS. Rows are in
+    TopExp_Explorer order, which is the solid numbering used in reports.
+    """
+    rows = []
+    explorer = TopExp_Explorer(shape, TopAbs_SOLID)
+    while explorer.More():
+        try:
+            rows.append(GeometricProperties.from_shape(explorer.Current(), eps, oriented=False).fingerprint())
+        except Exception as e:
+            logger.warning(f"Error measuring solid {len(rows) + 1}: {str(e)}")
+            rows.append(GeometricProperties().fingerprint())
+        explorer.Next()
+    return np.array(rows, dtype=float).reshape(-1, len(FINGERPRINT_FIELDS))
+
+
+def face_signatures(shape):
+    """Return the signature matrix of every face in a shape, one row per face
+
+    Columns follow face_matching.FACE_SIGNATURE_FIELDS: surface type, area,
+    centroid, normal at the centroid and bounding box. Rows are in
+    TopExp_Explorer order, which is the face numbering used in reports.
+    """
+    rows = []
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        try:
+            rows.append(_face_signature(topods.Face(explorer.Current())))
+        except Exception as e:
+            logger.warning(f"Error measuring face {len(rows) + 1}: {str(e)}")
+            rows.append([-1] + [0] * (len(FACE_SIGNATURE_FIELDS) - 1))
+        explorer.Next()
+    return np.array(rows, dtype=float).reshape(-1, len(FACE_SIGNATURE_FIELDS))
+
+
+def _face_signature(face):
+    """Surface type, area, centroid, normal and bounds of one face"""
+    surface = BRepAdaptor_Surface(face, True)
+    props = GProp_GProps()
+    brepgprop.SurfaceProperties(face, props)
+    centroid = props.CentreOfMass()
+
+    # The centroid of a curved face is off the surface; take the normal at
+    # the surface point nearest to it
+    uv = ShapeAnalysis_Surface(BRep_Tool.Surface(face)).ValueOfUV(centroid, 1e-7)
+    normal = [0.0, 0.0, 0.0]
+    local = BRepLProp_SLProps(surface, uv.X(), uv.Y(), 1, 1e-7)
+    if local.IsNormalDefined():
+        direction = local.Normal()
+        sign = -1.0 if face.Orientation() == TopAbs_REVERSED else 1.0
+        normal = [sign * direction.X(), sign * direction.Y(), sign * direction.Z()]
+
+    bbox = Bnd_Box()
+    brepbndlib.AddOptimal(face, bbox, False, False)
+    return [int(surface.GetType()), props.Mass(), centroid.X(), centroid.Y(), centroid.Z(),
+            *normal, *bbox.Get()]
+
+
+def shape_mesh(shape, linear_deflection=0.1, angular_deflection=0.5):
+    """Return the triangulation of a shape as (vertices, triangles) arrays
+
+    Meshes with the same deflection as the STL export, so a shape that was
+    already meshed for the viewer keeps its triangulation. Vertices are an
+    N x 3 float array in model coordinates, triangles an M x 3 array of
+    vertex indices; faces are not stitched, so shared edges repeat vertices.
+    """
+    BRepMesh_IncrementalMesh(shape, linear_deflection, False, angular_deflection, False).Perform()
+    vertices, triangles = [], []
+    offset = 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        face = topods.Face(explorer.Current())
+        location = TopLoc_Location()
+        triangulation = BRep_Tool.Triangulation(face, location)
+        explorer.Next()
+        if triangulation is None:
+            continue
+
+        # One tuple per node and triangle; the placement and the winding are
+        # applied to the whole face at once
+        nodes = np.array([triangulation.Node(i).Coord() for i in range(1, triangulation.NbNodes() + 1)],
+                         dtype=float).reshape(-1, 3)
+        if not location.IsIdentity():
+            transformation = location.Transformation()
+            matrix = np.array([[transformation.Value(row, column) for column in range(1, 5)]
+                               for row in range(1, 4)])
+            nodes = nodes @ matrix[:, :3].T + matrix[:, 3]
+        face_triangles = np.array([triangulation.Triangle(i).Get() for i in range(1, triangulation.NbTriangles() + 1)],
+                                  dtype=np.int64).reshape(-1, 3) + (offset - 1)
+        # Keep the triangles facing out of reversed faces
+        if face.Orientation() == TopAbs_REVERSED:
+            face_triangles = face_triangles[:, [0, 2, 1]]
+        vertices.append(nodes)
+        triangles.append(face_triangles)
+        offset += len(nodes)
+    if not vertices:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+    return np.concatenate(vertices), np.concatenate(triangles)
@@ -1,20 +1,64 @@
 import argparse
+import json
 import os
 import sys
 from step_parser import StepParser
-from comparison_engine import ComparisonEngine
-from report_generator import ReportGenerator
+from comparison_engine import ComparisonEngine, COMPARISON_LEVELS
+from report_generator import ReportGenerator, BatchSummaryGenerator
+from batch_comparison import BaselineComparison, rank_results
+from revision_chain import RevisionChain
+from similarity_index import SimilarityIndex, INDEX_FILE_NAME
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR, file_sha256
 
 def main():
     parser = argparse.ArgumentParser(description='Compare two STEP-AP242 files')
     parser.add_argument('file1', help='Path to the first STEP file')
-    parser.add_argument('file2', help='Path to the second STEP file')
+    parser.add_argument('file2', nargs='?', help='Path to the second STEP file')
     parser.add_argument('--output', '-o', help='Output directory for reports')
     parser.add_argument('--format', '-f', choices=['text', 'json', 'html', 'csv', 'all'],
                         default='text', help='Output format (default: text)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Worker processes for parsing large files (0 = all CPU cores, default: 1)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory of the parse cache shared with the web app')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always parse the files instead of using the parse cache')
+    parser.add_argument('--level', choices=COMPARISON_LEVELS, default='standard',
+                        help='Comparison depth: quick (header, entity counts, bounding box), standard '
+                             '(adds structure, PMI and mass properties) or precise (adds solids, faces '
+                             'and surface deviation); default: standard')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Measure geometry one part at a time to bound memory (default: only for '
+                             'assemblies of more than 500 products)')
+    parser.add_argument('--header-only', action='store_true',
+                        help='Only print the schema, originating system and entity estimate of each file')
+    parser.add_argument('--candidates', nargs='+', metavar='FILE',
+                        help='Compare file1 as a baseline against each of these files and rank them')
+    parser.add_argument('--chain', nargs='+', metavar='FILE',
+                        help='Compare each of these revisions with the one before it, starting from file1')
+    parser.add_argument('--similar', action='store_true',
+                        help='List the previously parsed files most similar to file1')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of files listed by --similar (default: 10)')
     
     args = parser.parse_args()
     
+    if args.header_only:
+        return print_headers([path for path in (args.file1, args.file2) if path], args.format)
+    
+    if args.similar:
+        if args.no_cache:
+            parser.error('--similar needs the similarity index kept in the cache directory')
+        return print_similar(args)
+    
+    if args.candidates or args.chain:
+        if args.file2 or (args.candidates and args.chain):
+            parser.error('--candidates and --chain cannot be combined with file2 or each other')
+        return compare_batch(args) if args.candidates else compare_chain(args)
+    
+    if not args.file2:
+        parser.error('file2 is required unless --header-only, --candidates or --chain is given')
+    
     # Validate input files
     if not os.path.exists(args.file1):
         print(f"Error: File not found: {args.file1}")
@@ -29,46 +73,118 @@ def main():
         os.makedirs(args.output)
     
     try:
-        # Parse STEP files
-        print(f"Parsing file 1: {args.file1}")
-        parser = StepParser()
-        data1 = parser.parse(args.file1)
+        cache = None if args.no_cache else ParseCache(args.cache_dir)
+        similarity_index = None if args.no_cache else open_similarity_index(args)
+        engine = ComparisonEngine(streaming=True if args.streaming else None)
         
-        print(f"Parsing file 2: {args.file2}")
-        parser = StepParser()
-        data2 = parser.parse(args.file2)
-        
-        # Compare the files
-        print("Comparing files...")
-        engine = ComparisonEngine()
-        differences = engine.compare(data1, data2)
+        if file_sha256(args.file1) == file_sha256(args.file2):
+            print("Files are byte-identical, skipping the comparison")
+            differences = engine.identical('byte')
+        else:
+            # A quick comparison uses neither the instance hashes nor the shape tree
+            hashes = args.level != 'quick'
+            # Parse STEP files
+            print(f"Parsing file 1: {args.file1}")
+            parser = StepParser(workers=args.jobs, cache=cache, similarity_index=similarity_index, hashes=hashes)
+            data1 = parser.parse(args.file1)
+            
+            print(f"Parsing file 2: {args.file2}")
+            parser = StepParser(workers=args.jobs, cache=cache, similarity_index=similarity_index, hashes=hashes)
+            data2 = parser.parse(args.file2)
+            
+            if engine.same_model(data1, data2):
+                print("Files hold the same entities up to renumbering, skipping the comparison")
+                differences = engine.identical('semantic')
+            else:
+                # Compare the files
+                print(f"Comparing files ({args.level})...")
+                differences = engine.compare(data1, data2, args.file1, args.file2, level=args.level)
         
         # Generate reports
         print("Generating reports...")
         generator = ReportGenerator(differences, args.file1, args.file2)
+        report = write_reports(generator, args.output, args.format, 'comparison_report')
+        if report:
+            print("\n" + report)
         
-        if args.format in ['text', 'all']:
-            output_path = None
-            if args.output:
-                output_path = os.path.join(args.output, 'comparison_report.txt')
-            report = generator.generate_text_report(output_path)
-            if not args.output:
-                print("\n" + report)
+        print("Comparison completed successfully.")
+        return 0
         
-        if args.format in ['json', 'all']:
-            if args.output:
-                output_path = os.path.join(args.output, 'comparison_report.json')
-                generator.generate_json_report(output_path)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+def compare_batch(args):
+    """Compare a baseline against many candidates, with one report per pair and a ranked summary"""
+    for file_path in [args.file1] + args.candidates:
+        if not os.path.exists(file_path):
+            print(f"Error: File not found: {file_path}")
+            return 1
+    
+    # Create output directory if it doesn't exist
+    if args.output and not os.path.exists(args.output):
+        os.makedirs(args.output)
+    
+    try:
+        cache = None if args.no_cache else ParseCache(args.cache_dir)
+        print(f"Comparing baseline {args.file1} against {len(args.candidates)} candidates...")
+        similarity_index = None if args.no_cache else open_similarity_index(args)
+        results = BaselineComparison(cache=cache, jobs=args.jobs, similarity_index=similarity_index) \
+            .compare(args.file1, args.candidates)
         
-        if args.format in ['html', 'all']:
-            if args.output:
-                output_path = os.path.join(args.output, 'comparison_report.html')
-                generator.generate_html_report(output_path)
+        if args.output:
+            print("Generating reports...")
+            for result in results:
+                if result['differences'] is None:
+                    continue
+                generator = ReportGenerator(result['differences'], args.file1, result['file'])
+                name = os.path.splitext(os.path.basename(result['file']))[0]
+                write_reports(generator, args.output, args.format, f"comparison_report_{name}")
+        
+        # The ranked summary is always printed; HTML has no summary format
+        summary = BatchSummaryGenerator(rank_results(results), args.file1)
+        if args.output:
+            write_reports(summary, args.output, args.format, 'batch_summary', html=False)
+        print("\n" + summary.generate_text_report())
         
-        if args.format in ['csv', 'all']:
+        failed = sum(1 for result in results if result['error'])
+        print(f"Compared {len(results) - failed} of {len(results)} candidates successfully.")
+        return 1 if failed else 0
+        
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+def compare_chain(args):
+    """Compare each revision of a chain with the previous one, with one report per step"""
+    for file_path in [args.file1] + args.chain:
+        if not os.path.exists(file_path):
+            print(f"Error: File not found: {file_path}")
+            return 1
+    
+    # Create output directory if it doesn't exist
+    if args.output and not os.path.exists(args.output):
+        os.makedirs(args.output)
+    
+    try:
+        cache = None if args.no_cache else ParseCache(args.cache_dir)
+        print(f"Comparing a chain of {len(args.chain) + 1} revisions...")
+        similarity_index = None if args.no_cache else open_similarity_index(args)
+        results = RevisionChain(cache=cache, jobs=args.jobs, similarity_index=similarity_index) \
+            .compare([args.file1] + args.chain)
+        
+        for step, result in enumerate(results, 1):
+            summary = result['differences']['summary']
+            changed = result['differences']['structural']['shape_differences']['changed']
+            status = f"{summary['identical']}-identical" if summary['identical'] else \
+                f"{summary['total_differences']} differences, {len(changed)} products with changed shapes"
+            print(f"{os.path.basename(result['previous'])} -> {os.path.basename(result['file'])}: "
+                  f"{summary['similarity_score']:.2f}% ({status})")
+            
             if args.output:
-                output_path = os.path.join(args.output, 'comparison_report.csv')
-                generator.generate_csv_report(output_path)
+                generator = ReportGenerator(result['differences'], result['previous'], result['file'])
+                name = os.path.splitext(os.path.basename(result['file']))[0]
+                write_reports(generator, args.output, args.format, f"chain_report_{step:03d}_{name}")
         
         print("Comparison completed successfully.")
         return 0
@@ -77,5 +193,83 @@ def main():
         print(f"Error: {str(e)}")
         return 1
 
+def write_reports(generator, output_dir, output_format, name, html=True):
+    """Write the requested report formats to output_dir; returns the text report when there is no output_dir"""
+    if not output_dir:
+        return generator.generate_text_report() if output_format in ['text', 'all'] else None
+    
+    if output_format in ['text', 'all']:
+        generator.generate_text_report(os.path.join(output_dir, f"{name}.txt"))
+    
+    if output_format in ['json', 'all']:
+        generator.generate_json_report(os.path.join(output_dir, f"{name}.json"))
+    
+    if output_format in ['html', 'all'] and html:
+        generator.generate_html_report(os.path.join(output_dir, f"{name}.html"))
+    
+    if output_format in ['csv', 'all']:
+        generator.generate_csv_report(os.path.join(output_dir, f"{name}.csv"))
+    return None
+
+def open_similarity_index(args):
+    """Open the similarity index kept in the cache directory"""
+    return SimilarityIndex(os.path.join(args.cache_dir, INDEX_FILE_NAME))
+
+def print_similar(args):
+    """Print the previously parsed files most similar to a file, parsing and indexing it if needed"""
+    if not os.path.exists(args.file1):
+        print(f"Error: File not found: {args.file1}")
+        return 1
+    
+    try:
+        similarity_index = open_similarity_index(args)
+        file_hash = file_sha256(args.file1)
+        if file_hash not in similarity_index:
+            print(f"Parsing file: {args.file1}")
+            parser = StepParser(workers=args.jobs, cache=ParseCache(args.cache_dir), similarity_index=similarity_index)
+            parser.parse(args.file1, file_hash)
+        matches = similarity_index.query(file_hash, args.top)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+    
+    if args.format == 'json':
+        print(json.dumps(matches, indent=2))
+        return 0
+    
+    print(f"=== Files most similar to {args.file1} ({len(similarity_index)} indexed) ===")
+    if not matches:
+        print("No similar file found.")
+    for rank, match in enumerate(matches, 1):
+        print(f"{rank:>3}. {match['similarity']:6.2f}%  {match['name']}  "
+              f"(entities {match['entity_similarity']:.2f}, types {match['type_similarity']:.2f})")
+    return 0
+
+def print_headers(file_paths, output_format):
+    """Print the header summary of each file for triage before a full comparison"""
+    parser = StepParser()
+    headers = {}
+    for file_path in file_paths:
+        try:
+            headers[file_path] = parser.read_header(file_path)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            return 1
+    
+    if output_format == 'json':
+        print(json.dumps(headers, indent=2))
+        return 0
+    
+    for file_path, header in headers.items():
+        estimate = header['estimated_entities']
+        print(f"=== {file_path} ===")
+        print(f"Schema: {', '.join(header['schemas']) or '-'} ({header['application_protocol'] or 'unknown'})")
+        print(f"Originating system: {header['originating_system'] or '-'}")
+        print(f"Preprocessor: {header['preprocessor_version'] or '-'}")
+        print(f"Name: {header['name'] or '-'} ({header['time_stamp'] or '-'})")
+        print(f"File size: {header['file_size'] / (1024 * 1024):.2f} MB")
+        print(f"Entities: {'~' if header['estimate_sampled'] else ''}{estimate}")
+    return 0
+
 if __name__ == "__main__":
     sys.exit(main()) 
\ No newline at end of file
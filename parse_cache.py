@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import logging
+from step_tokenizer import EntityIndex
+from compressed_step import open_decompressed
+
+logger = logging.getLogger(__name__)
+
+# Shared by the CLI and the web app (whose cache folder is step_comparison/cache)
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'step_comparison', 'cache', 'parse')
+
+_INDEX_PREFIX = 'index.'
+_ARRAY_PREFIX = 'array.'
+_JSON_KEY = 'json'
+
+
+def file_sha256(file_path):
+    """Calculate the SHA-256 hash of a file's content
+
+    Compressed files are hashed by their decompressed text, so a revision has
+    the same key whether it was stored as .stp, .stp.gz or .stpZ.
+    """
+    hash_sha256 = hashlib.sha256()
+    with open_decompressed(file_path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+
+class ParseCache:
+    """On-disk cache of StepParser results keyed by file content hash and parser version
+
+    Each entry is a single uncompressed .npz file: the entity index and any
+    other NumPy arrays are stored as raw arrays and the plain dict sections
+    (entities, relationships, ...) as one JSON document, so loading costs a
+    few reads rather than a parse.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, file_hash, version):
+        return os.path.join(self.cache_dir, f"{file_hash}.v{version}.npz")
+
+    def load(self, file_hash, version):
+        """Return the cached parse result, or None on a miss"""
+        path = self._path(file_hash, version)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                arrays = {name: archive[name] for name in archive.files}
+
+            data = json.loads(arrays.pop(_JSON_KEY).tobytes().decode('utf-8'))
+            index_arrays = {}
+            for name, array in arrays.items():
+                if name.startswith(_INDEX_PREFIX):
+                    index_arrays[name[len(_INDEX_PREFIX):]] = array
+                elif name.startswith(_ARRAY_PREFIX):
+                    data[name[len(_ARRAY_PREFIX):]] = array
+            if index_arrays:
+                data['index'] = EntityIndex.from_arrays(index_arrays)
+
+            logger.info(f"Parse cache hit for {file_hash}")
+            return data
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable parse cache entry {path}: {str(e)}")
+            return None
+
+    def store(self, file_hash, version, data):
+        """Store a parse result; failures are logged and otherwise ignored"""
+        arrays = {}
+        sections = {}
+        for key, value in data.items():
+            if isinstance(value, EntityIndex):
+                for name, array in value.to_arrays().items():
+                    arrays[_INDEX_PREFIX + name] = array
+            elif isinstance(value, np.ndarray):
+                arrays[_ARRAY_PREFIX + key] = value
+            else:
+                sections[key] = value
+        arrays[_JSON_KEY] = np.frombuffer(json.dumps(sections).encode('utf-8'), dtype=np.uint8)
+
+        path = self._path(file_hash, version)
+        tmp_path = None
+        try:
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            # mkstemp creates owner-only files; the CLI and web app may run as different users
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not write parse cache entry {path}: {str(e)}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,223 @@
+import logging
+from collections import Counter
+from step_tokenizer import RecordReader, EntityRef
+
+logger = logging.getLogger(__name__)
+
+# GEOMETRIC_TOLERANCE and its AP242 subtypes
+TOLERANCE_CHARACTERISTICS = (
+    'ANGULARITY_TOLERANCE', 'CIRCULAR_RUNOUT_TOLERANCE', 'COAXIALITY_TOLERANCE',
+    'CONCENTRICITY_TOLERANCE', 'CYLINDRICITY_TOLERANCE', 'FLATNESS_TOLERANCE',
+    'LINE_PROFILE_TOLERANCE', 'PARALLELISM_TOLERANCE', 'PERPENDICULARITY_TOLERANCE',
+    'POSITION_TOLERANCE', 'ROUNDNESS_TOLERANCE', 'STRAIGHTNESS_TOLERANCE',
+    'SURFACE_PROFILE_TOLERANCE', 'SYMMETRY_TOLERANCE', 'TOTAL_RUNOUT_TOLERANCE'
+)
+TOLERANCE_TYPES = TOLERANCE_CHARACTERISTICS + (
+    'GEOMETRIC_TOLERANCE', 'GEOMETRIC_TOLERANCE_WITH_DATUM_REFERENCE',
+    'GEOMETRIC_TOLERANCE_WITH_DEFINED_UNIT', 'GEOMETRIC_TOLERANCE_WITH_DEFINED_AREA_UNIT',
+    'GEOMETRIC_TOLERANCE_WITH_MAXIMUM_TOLERANCE', 'GEOMETRIC_TOLERANCE_WITH_MODIFIERS',
+    'MODIFIED_GEOMETRIC_TOLERANCE', 'UNEQUALLY_DISPOSED_GEOMETRIC_TOLERANCE'
+)
+SIZE_TYPES = ('DIMENSIONAL_SIZE', 'ANGULAR_SIZE', 'DIMENSIONAL_SIZE_WITH_PATH',
+              'DIMENSIONAL_SIZE_WITH_DATUM_FEATURE')
+LOCATION_TYPES = ('DIMENSIONAL_LOCATION', 'ANGULAR_LOCATION', 'DIMENSIONAL_LOCATION_WITH_PATH',
+                  'DIRECTED_DIMENSIONAL_LOCATION')
+DATUM_CONTAINERS = ('DATUM_SYSTEM', 'DATUM_REFERENCE', 'DATUM_REFERENCE_COMPARTMENT',
+                    'DATUM_REFERENCE_ELEMENT', 'COMMON_DATUM_LIST')
+
+
+class PmiExtractor:
+    """Extract semantic PMI (GD&T, datums, dimensions) from the raw entity records
+
+    Works off the EntityIndex: only records of PMI types and the few records
+    they reference are parsed, so no second pass over the file is needed.
+    The result maps a stable, renumbering-independent key to a plain dict.
+    """
+
+    def __init__(self, index, buffer):
+        self.index = index
+        self.records = RecordReader(index, buffer)
+
+    def extract(self):
+        """Return the normalized pmi_data dict"""
+        pmi_data = {}
+        self._repeats = Counter()
+
+        for row in self.index.rows_of_type(*TOLERANCE_TYPES).tolist():
+            self._add(pmi_data, self._extract_tolerance, row)
+
+        for row in self.index.rows_of_type('DATUM').tolist():
+            self._add(pmi_data, self._extract_datum, row)
+
+        # Dimension values and tolerances point at the dimension, not the
+        # other way round, so map them by dimension row first
+        representations = {}
+        for row in self.index.rows_of_type('DIMENSIONAL_CHARACTERISTIC_REPRESENTATION').tolist():
+            params = self.records.attributes(row, 'DIMENSIONAL_CHARACTERISTIC_REPRESENTATION')
+            if params and len(params) >= 2:
+                representations[self.records.row(params[0])] = params[1]
+
+        tolerances = {}
+        for row in self.index.rows_of_type('PLUS_MINUS_TOLERANCE').tolist():
+            params = self.records.attributes(row, 'PLUS_MINUS_TOLERANCE')
+            if params and len(params) >= 2:
+                tolerances[self.records.row(params[1])] = params[0]
+
+        for row in self.index.rows_of_type(*SIZE_TYPES + LOCATION_TYPES).tolist():
+            self._add(pmi_data, self._extract_dimension, row, representations.get(row), tolerances.get(row))
+
+        return pmi_data
+
+    def _add(self, pmi_data, extract, row, *args):
+        """Add one entry under a unique key, skipping records that cannot be resolved"""
+        try:
+            key, entry = extract(row, *args)
+        except Exception as e:
+            logger.debug(f"Skipping PMI record #{self.index.ids[row]}: {str(e)}")
+            return
+
+        # Several features may share a name; number the repeats in file order
+        self._repeats[key] += 1
+        if self._repeats[key] > 1:
+            key = f"{key} ({self._repeats[key]})"
+        pmi_data[key] = entry
+
+    def _extract_tolerance(self, row):
+        """Build the entry of a geometric tolerance"""
+        type_name, params = self.records.parse(row)
+        partials = type_name.split('+')
+        characteristic = next((name for name in partials if name in TOLERANCE_CHARACTERISTICS), partials[0])
+
+        # name, description, magnitude, toleranced_shape_aspect
+        attributes = self.records.attributes(row, 'GEOMETRIC_TOLERANCE')
+        value, unit = self.records.measure(attributes[2])
+
+        datums = []
+        if isinstance(params, dict):
+            datum_system = params.get('GEOMETRIC_TOLERANCE_WITH_DATUM_REFERENCE')
+            datum_system = datum_system[0] if datum_system else None
+        else:
+            datum_system = attributes[4] if len(attributes) > 4 and isinstance(attributes[4], list) else None
+        if datum_system:
+            datums = self._datum_labels(datum_system)
+
+        modifiers = []
+        if isinstance(params, dict) and params.get('GEOMETRIC_TOLERANCE_WITH_MODIFIERS'):
+            modifiers = sorted(str(modifier) for modifier in params['GEOMETRIC_TOLERANCE_WITH_MODIFIERS'][0])
+
+        target = self._shape_aspect_label(attributes[3])
+        entry = {
+            'category': 'geometric_tolerance',
+            'type': characteristic,
+            'name': attributes[0],
+            'value': value,
+            'unit': unit,
+            'datums': datums,
+            'modifiers': modifiers,
+            'target': target
+        }
+        return f"tolerance:{characteristic}:{attributes[0]}:{target}", entry
+
+    def _extract_datum(self, row):
+        """Build the entry of a datum"""
+        # name, description, of_shape, product_definitional, identification
+        attributes = self.records.attributes(row, 'DATUM')
+        label = attributes[4] if len(attributes) > 4 else attributes[0]
+        entry = {
+            'category': 'datum',
+            'label': label,
+            'name': attributes[0],
+            'description': attributes[1]
+        }
+        return f"datum:{label}", entry
+
+    def _extract_dimension(self, row, representation, tolerance):
+        """Build the entry of a size or location dimension with its value and tolerance"""
+        type_name, params = self.records.parse(row)
+        type_name = next((name for name in type_name.split('+') if name in SIZE_TYPES + LOCATION_TYPES),
+                         type_name)
+
+        if type_name in SIZE_TYPES:
+            # applies_to, name
+            attributes = self.records.attributes(row, 'DIMENSIONAL_SIZE')
+            name = attributes[1]
+            target = self._shape_aspect_label(attributes[0])
+        else:
+            # name, description, relating_shape_aspect, related_shape_aspect
+            attributes = self.records.attributes(row, 'SHAPE_ASPECT_RELATIONSHIP') or \
+                self.records.attributes(row, 'DIMENSIONAL_LOCATION')
+            name = attributes[0]
+            target = f"{self._shape_aspect_label(attributes[2])} -> {self._shape_aspect_label(attributes[3])}"
+
+        entry = {
+            'category': 'dimension',
+            'type': type_name,
+            'name': name,
+            'target': target,
+            'value': None,
+            'unit': None
+        }
+
+        if representation is not None:
+            # SHAPE_DIMENSION_REPRESENTATION(name, items, context_of_items)
+            _, rep_params = self.records.resolve(representation)
+            items = rep_params[1] if isinstance(rep_params, list) and len(rep_params) > 1 else []
+            for item in items:
+                value, unit = self.records.measure(item)
+                label = self.records.item_name(item)
+                if label in ('upper limit', 'lower limit'):
+                    entry[label.replace(' ', '_')] = value
+                elif entry['value'] is None:
+                    entry['value'] = value
+                    entry['unit'] = unit
+
+        if tolerance is not None:
+            entry['tolerance'] = self._tolerance_range(tolerance)
+
+        return f"dimension:{type_name}:{name}:{target}", entry
+
+    def _tolerance_range(self, reference):
+        """Resolve the range of a PLUS_MINUS_TOLERANCE"""
+        type_name, params = self.records.resolve(reference)
+        if type_name == 'TOLERANCE_VALUE':
+            # lower_bound, upper_bound
+            return {'lower': self.records.measure(params[0])[0], 'upper': self.records.measure(params[1])[0]}
+        if type_name == 'LIMITS_AND_FITS':
+            # form_variance, zone_variance, grade, source
+            return {'fit': f"{params[1]}{params[2]}"}
+        return {}
+
+    def _shape_aspect_label(self, reference):
+        """Describe a toleranced shape aspect by its name, or its type when unnamed"""
+        type_name, params = self.records.resolve(reference)
+        if type_name is None:
+            return ''
+        if isinstance(params, dict):
+            params = params.get('SHAPE_ASPECT') or next(iter(params.values()))
+        if params and isinstance(params[0], str) and params[0] and not isinstance(params[0], EntityRef):
+            return params[0]
+        return type_name
+
+    def _datum_labels(self, references, depth=0):
+        """Collect the datum identification letters reachable from a datum system"""
+        labels = []
+        if depth > 4:
+            return labels
+
+        for reference in references if isinstance(references, list) else [references]:
+            if isinstance(reference, list):
+                labels.extend(self._datum_labels(reference, depth + 1))
+                continue
+            row = self.records.row(reference)
+            type_name, params = self.records.parse(row)
+            if type_name is None:
+                continue
+            if 'DATUM' in type_name.split('+'):
+                attributes = self.records.attributes(row, 'DATUM')
+                labels.append(attributes[4] if len(attributes) > 4 else attributes[0])
+            elif any(name in DATUM_CONTAINERS for name in type_name.split('+')):
+                values = [value for partial in params.values() for value in partial] \
+                    if isinstance(params, dict) else params
+                labels.extend(self._datum_labels(
+                    [value for value in values if isinstance(value, (EntityRef, list))], depth + 1))
+        return labels
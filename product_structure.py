@@ -0,0 +1,221 @@
+import logging
+from collections import Counter
+import numpy as np
+from step_tokenizer import RecordReader
+
+logger = logging.getLogger(__name__)
+
+# Millimetres per metre-based SI length unit, by prefix
+SI_PREFIX_MILLIMETRES = {None: 1000.0, 'KILO': 1e6, 'HECTO': 1e5, 'DECA': 1e4, 'DECI': 100.0, 'CENTI': 10.0,
+                         'MILLI': 1.0, 'MICRO': 1e-3, 'NANO': 1e-6}
+
+
+class ProductStructureExtractor:
+    """Build the assembly tree (products, definitions, usage occurrences, placements)
+
+    Follows PRODUCT_DEFINITION -> PRODUCT_DEFINITION_FORMATION -> PRODUCT for
+    every definition and NEXT_ASSEMBLY_USAGE_OCCURRENCE for every parent/child
+    link. Placements come from the CONTEXT_DEPENDENT_SHAPE_REPRESENTATION that
+    points at an occurrence, through its REPRESENTATION_RELATIONSHIP_WITH_
+    TRANSFORMATION and ITEM_DEFINED_TRANSFORMATION. No shape is transferred.
+
+    Placements are converted to millimetres, as OCC converts the shapes, from
+    the length unit of the representation each placement belongs to.
+    Placements whose unit cannot be converted are kept in file units and
+    counted in 'unscaled_placements'.
+    """
+
+    def __init__(self, index, buffer):
+        self.index = index
+        self.records = RecordReader(index, buffer)
+        # Millimetres per length unit by representation row (None = unknown unit)
+        self._scales = {}
+        # Occurrence placements left in file units
+        self.unscaled_placements = 0
+
+    def extract(self):
+        """Return the product structure as a JSON-serializable dict"""
+        products = {}
+        for row in self.index.rows_of_type('PRODUCT').tolist():
+            # id, name, description, frame_of_reference
+            params = self.records.attributes(row, 'PRODUCT')
+            products[params[0]] = {'name': params[1], 'definitions': []}
+
+        definitions = self.definitions()
+        for row, (part_number, definition_id) in definitions.items():
+            products[part_number]['definitions'].append(definition_id)
+
+        occurrences = {}
+        repeats = Counter()
+        children = set()
+        for usage in self.usages(definitions):
+            parent, child = definitions[usage['parent_row']][0], definitions[usage['child_row']][0]
+            children.add(child)
+
+            key = f"{parent}/{child}:{usage['id']}"
+            # Exporters do not always number occurrences uniquely
+            repeats[key] += 1
+            if repeats[key] > 1:
+                key = f"{key} ({repeats[key]})"
+            occurrences[key] = {
+                'category': 'occurrence',
+                'id': usage['id'],
+                'name': usage['name'],
+                'parent': parent,
+                'child': child,
+                'transform': usage['transform']
+            }
+
+        return {
+            'products': products,
+            'occurrences': occurrences,
+            'roots': sorted(part_number for part_number in products if part_number not in children),
+            'unscaled_placements': self.unscaled_placements
+        }
+
+    def definitions(self):
+        """Map each product definition row to its (part number, definition id)"""
+        part_numbers = {}
+        for row in self.index.rows_of_type('PRODUCT').tolist():
+            part_numbers[row] = self.records.attributes(row, 'PRODUCT')[0]
+
+        definitions = {}
+        for row in self.index.rows_of_type('PRODUCT_DEFINITION').tolist():
+            try:
+                # id, description, formation, frame_of_reference
+                params = self.records.attributes(row, 'PRODUCT_DEFINITION')
+                formation = self.records.attributes(self.records.row(params[2]), 'PRODUCT_DEFINITION_FORMATION')
+                part_number = part_numbers.get(self.records.row(formation[2]))
+                if part_number is not None:
+                    definitions[row] = (part_number, params[0])
+            except Exception as e:
+                logger.debug(f"Skipping product definition #{self.index.ids[row]}: {str(e)}")
+        return definitions
+
+    def usages(self, definitions):
+        """Every usage occurrence between two of the definitions, with its 4x4 placement in the parent
+
+        Each usage holds 'id', 'name', the 'parent_row' and 'child_row' of
+        the product definitions, and 'transform' (None if not placed).
+        """
+        transforms = self._occurrence_transforms()
+        usages = []
+        for row in self.index.rows_of_type('NEXT_ASSEMBLY_USAGE_OCCURRENCE').tolist():
+            try:
+                # id, name, description, relating_product_definition,
+                # related_product_definition, reference_designator
+                params = self.records.attributes(row, 'NEXT_ASSEMBLY_USAGE_OCCURRENCE')
+                parent, child = self.records.row(params[3]), self.records.row(params[4])
+                if parent not in definitions or child not in definitions:
+                    continue
+                usages.append({
+                    'id': params[0],
+                    'name': params[1],
+                    'parent_row': parent,
+                    'child_row': child,
+                    'transform': transforms.get(row)
+                })
+            except Exception as e:
+                logger.debug(f"Skipping usage occurrence #{self.index.ids[row]}: {str(e)}")
+        return usages
+
+    def _occurrence_transforms(self):
+        """Map each usage occurrence row to its 4x4 placement in the parent"""
+        transforms = {}
+        self.unscaled_placements = 0
+        for row in self.index.rows_of_type('CONTEXT_DEPENDENT_SHAPE_REPRESENTATION').tolist():
+            try:
+                # representation_relation, represented_product_relation
+                relation, product_relation = self.records.attributes(row, 'CONTEXT_DEPENDENT_SHAPE_REPRESENTATION')
+                # PRODUCT_DEFINITION_SHAPE(name, description, definition)
+                _, shape = self.records.resolve(product_relation)
+                occurrence = self.records.row(shape[2])
+
+                relation_row = self.records.row(relation)
+                transformation = self.records.attributes(relation_row, 'REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION')
+                # ITEM_DEFINED_TRANSFORMATION(name, description, transform_item_1, transform_item_2)
+                type_name, params = self.records.resolve(transformation[-1])
+                if type_name != 'ITEM_DEFINED_TRANSFORMATION':
+                    continue
+
+                # name, description, rep_1 (the child's), rep_2 (the parent's)
+                representations = self.records.attributes(relation_row, 'REPRESENTATION_RELATIONSHIP')
+                scales = [self._length_scale(representation) for representation in representations[2:4]]
+                if None in scales:
+                    self.unscaled_placements += 1
+
+                # Map the child's frame (item 1) onto its placement in the parent (item 2)
+                matrix = self._placement(params[3], scales[1]) @ np.linalg.inv(self._placement(params[2], scales[0]))
+                transforms[occurrence] = np.round(matrix, 9).tolist()
+            except Exception as e:
+                logger.debug(f"Skipping shape representation #{self.index.ids[row]}: {str(e)}")
+        return transforms
+
+    def _placement(self, reference, scale=None):
+        """Return the 4x4 matrix of an AXIS2_PLACEMENT_3D, its location times scale"""
+        # name, location, axis, ref_direction
+        _, params = self.records.resolve(reference)
+        location = np.array(self.records.resolve(params[1])[1][1], dtype=float) * (scale or 1.0)
+        axis = self._direction(params[2], (0.0, 0.0, 1.0))
+        ref_direction = self._direction(params[3], (1.0, 0.0, 0.0))
+
+        # x is the reference direction projected into the plane normal to z
+        x_axis = ref_direction - np.dot(ref_direction, axis) * axis
+        if np.linalg.norm(x_axis) < 1e-12:
+            x_axis = np.array([1.0, 0.0, 0.0]) if abs(axis[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+            x_axis = x_axis - np.dot(x_axis, axis) * axis
+        x_axis = x_axis / np.linalg.norm(x_axis)
+
+        matrix = np.eye(4)
+        matrix[:3, 0] = x_axis
+        matrix[:3, 1] = np.cross(axis, x_axis)
+        matrix[:3, 2] = axis
+        matrix[:3, 3] = location
+        return matrix
+
+    def _direction(self, reference, default):
+        """Return a normalized DIRECTION, or the default when it is omitted"""
+        _, params = self.records.resolve(reference)
+        vector = np.array(params[1] if params else default, dtype=float)
+        return vector / np.linalg.norm(vector)
+
+    def _length_scale(self, representation):
+        """Millimetres per length unit of a representation, 1.0 if it has none, None if it is unknown"""
+        row = self.records.row(representation)
+        if row not in self._scales:
+            scale = 1.0
+            try:
+                # name, items, context_of_items
+                context = self.records.attributes(row, 'REPRESENTATION')[2]
+                _, params = self.records.resolve(context)
+                units = params.get('GLOBAL_UNIT_ASSIGNED_CONTEXT', [[]])[0] if isinstance(params, dict) else []
+                for unit in units:
+                    _, unit_params = self.records.resolve(unit)
+                    if isinstance(unit_params, dict) and 'LENGTH_UNIT' in unit_params:
+                        scale = self._unit_scale(unit)
+                        break
+            except Exception as e:
+                logger.debug(f"Could not read the length unit of representation #{self.index.ids[row]}: {str(e)}")
+                scale = None
+            self._scales[row] = scale
+        return self._scales[row]
+
+    def _unit_scale(self, reference, depth=0):
+        """Millimetres per length unit of an SI or conversion-based unit, None if it is unknown"""
+        _, params = self.records.resolve(reference)
+        if not isinstance(params, dict):
+            return None
+        if 'SI_UNIT' in params:
+            prefix, name = params['SI_UNIT']
+            return SI_PREFIX_MILLIMETRES.get(prefix) if name == 'METRE' else None
+        if 'CONVERSION_BASED_UNIT' in params and depth < 4:
+            # name, conversion_factor: a length measure in another unit, e.g. 25.4 mm per inch
+            factor = params['CONVERSION_BASED_UNIT'][1]
+            value, _ = self.records.measure(factor)
+            _, measure = self.records.resolve(factor)
+            if isinstance(measure, dict):
+                measure = measure.get('MEASURE_WITH_UNIT')
+            scale = self._unit_scale(measure[1], depth + 1) if measure and len(measure) > 1 else None
+            if value is not None and scale is not None:
+                return float(value) * scale
+        return None
@@ -8,6 +8,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Face differences listed in a report; the rest are summarized as a count
+MAX_FACE_ROWS = 200
+
 class ReportGenerator:
     def __init__(self, differences, file1_name, file2_name):
         self.differences = differences
@@ -24,8 +27,31 @@ class ReportGenerator:
         report.append(f"File 1: {self.file1_name}")
         report.append(f"File 2: {self.file2_name}")
         report.append(f"Generated: {self.timestamp}")
+        level = self.differences.get('summary', {}).get('level')
+        if level:
+            report.append(f"Comparison Level: {level}")
+        incomplete = self._describe_incomplete()
+        if incomplete:
+            report.append(f"Incomplete: {incomplete}")
         report.append("\n")
         
+        # Identical files skip every comparison, so there is nothing else to list
+        identity = self.differences.get('summary', {}).get('identical')
+        if identity:
+            report.append(self._describe_identity(identity))
+            if output_path:
+                with open(output_path, 'w') as f:
+                    f.write('\n'.join(report))
+            return '\n'.join(report)
+        
+        # HEADER differences
+        header_diffs = self.differences.get('header', {})
+        if header_diffs:
+            report.append("--- Header Comparison ---")
+            for field, diff in header_diffs.items():
+                report.append(f"  - {field}: File 1 ({diff['file1']}), File 2 ({diff['file2']})")
+            report.append("")
+        
         # Add structural differences
         report.append("--- Structural Comparison ---")
         
@@ -49,16 +75,162 @@ class ReportGenerator:
                 report.append(f"      - {entity}: File 1 (Count: {diff['file1']}), "
                              f"File 2 (Count: {diff['file2']})  ({diff['change']} in File 2)")
         
+        # Instance differences
+        inst_diffs = self.differences['structural'].get('instance_differences', {})
+        if inst_diffs.get('only_in_file1') or inst_diffs.get('only_in_file2'):
+            report.append("\nEntity Instance Differences (renumbering ignored):")
+            report.append(f"  - Unchanged instances: {inst_diffs['unchanged']}")
+            
+            if inst_diffs['only_in_file1']:
+                report.append("  - Removed from File 1:")
+                for entity, count in inst_diffs['only_in_file1'].items():
+                    report.append(f"      - {entity} (Count: {count})")
+            
+            if inst_diffs['only_in_file2']:
+                report.append("  - Added in File 2:")
+                for entity, count in inst_diffs['only_in_file2'].items():
+                    report.append(f"      - {entity} (Count: {count})")
+        
+        # Product shape differences
+        shape_diffs = self.differences['structural'].get('shape_differences', {})
+        if shape_diffs.get('changed') or shape_diffs.get('only_in_file1') or shape_diffs.get('only_in_file2'):
+            report.append("\nProduct Shape Differences (by shape representation hash):")
+            report.append(f"  - Unchanged products: {shape_diffs['unchanged']}")
+            for label, key in (('Changed', 'changed'), ('Only in File 1', 'only_in_file1'),
+                               ('Only in File 2', 'only_in_file2')):
+                if shape_diffs[key]:
+                    report.append(f"  - {label}: {', '.join(shape_diffs[key])}")
+        
         # Relationship differences
-        # ... similar implementation for relationships
+        rel_diffs = self.differences['structural']['relationship_differences']
+        report.append("\nRelationship Differences (Source -> Target references):")
+        
+        if rel_diffs['only_in_file1']:
+            report.append("  - Only in File 1:")
+            for relationship, count in rel_diffs['only_in_file1'].items():
+                report.append(f"      - {relationship} (Count: {count})")
+        
+        if rel_diffs['only_in_file2']:
+            report.append("  - Only in File 2:")
+            for relationship, count in rel_diffs['only_in_file2'].items():
+                report.append(f"      - {relationship} (Count: {count})")
+        
+        if rel_diffs['count_differences']:
+            report.append("  - Count Difference:")
+            for relationship, diff in rel_diffs['count_differences'].items():
+                report.append(f"      - {relationship}: File 1 (Count: {diff['file1']}), "
+                             f"File 2 (Count: {diff['file2']})  ({diff['change']} in File 2)")
+        
+        # Assembly differences
+        asm_diffs = self.differences['structural']['assembly_differences']
+        report.append("\nAssembly Structure Differences (Parent/Child:Occurrence):")
+        
+        if asm_diffs['only_in_file1']:
+            report.append("  - Only in File 1:")
+            for key, entry in asm_diffs['only_in_file1'].items():
+                report.append(f"      - {key}: {self._describe_entry(entry)}")
+        
+        if asm_diffs['only_in_file2']:
+            report.append("  - Only in File 2:")
+            for key, entry in asm_diffs['only_in_file2'].items():
+                report.append(f"      - {key}: {self._describe_entry(entry)}")
+        
+        if asm_diffs['value_differences']:
+            report.append("  - Changed Occurrences:")
+            for key, diff in asm_diffs['value_differences'].items():
+                report.append(f"      - {key}: File 1 ({self._describe_entry(diff['file1'])}), "
+                             f"File 2 ({self._describe_entry(diff['file2'])})")
+        
+        # Surface deviation
+        deviation = self.differences.get('geometric', {}).get('deviation', {})
+        if deviation.get('hausdorff'):
+            report.append("\nSurface Deviation (max / mean / RMS):")
+            for label, key in (('File 1 to File 2', 'file1_to_file2'), ('File 2 to File 1', 'file2_to_file1')):
+                stats = deviation[key]
+                report.append(f"  - {label}: {self._format_number(stats['max'], 3)} / "
+                             f"{self._format_number(stats['mean'], 3)} / {self._format_number(stats['rms'], 3)} mm")
+            report.append(f"  - Hausdorff Distance: {self._format_number(deviation['hausdorff'], 3)} mm")
+        
+        # Solid differences
+        solids = self.differences.get('geometric', {}).get('solids', {})
+        if solids.get('removed') or solids.get('added') or solids.get('modified'):
+            report.append("\nSolid Differences (Solid in File 1 / File 2):")
+            for solid in solids['removed']:
+                report.append(f"  - Only in File 1: Solid {solid['solid1'] + 1}: {self._describe_solid(solid['file1'])}")
+            for solid in solids['added']:
+                report.append(f"  - Only in File 2: Solid {solid['solid2'] + 1}: {self._describe_solid(solid['file2'])}")
+            for solid in solids['modified']:
+                report.append(f"  - Changed: Solid {solid['solid1'] + 1} / {solid['solid2'] + 1} "
+                             f"({', '.join(solid['changed'])}): File 1 ({self._describe_solid(solid['file1'])}), "
+                             f"File 2 ({self._describe_solid(solid['file2'])})")
+        
+        # Part differences, when the geometry was measured part by part
+        parts = self.differences.get('geometric', {}).get('parts', {})
+        if parts.get('changed') or parts.get('only_in_file1') or parts.get('only_in_file2'):
+            report.append("\nPart Differences (volume / area of one instance x instances):")
+            report.append(f"  - Unchanged parts: {parts['unchanged']}")
+            for part in parts['changed']:
+                report.append(f"  - Changed: {part['part']}: File 1 ({self._describe_part(part['file1'])}), "
+                             f"File 2 ({self._describe_part(part['file2'])})")
+            for label, key in (('Only in File 1', 'only_in_file1'), ('Only in File 2', 'only_in_file2')):
+                if parts[key]:
+                    report.append(f"  - {label}: {', '.join(parts[key])}")
+        
+        # Face differences
+        face_rows = self._face_rows(self.differences.get('geometric', {}).get('faces', {}))
+        if face_rows:
+            report.append("\nFace Differences (Face in File 1 / File 2):")
+            for status, face in face_rows[:MAX_FACE_ROWS]:
+                if status == 'removed':
+                    report.append(f"  - Only in File 1: Face {face['face1'] + 1}: {self._describe_face(face['file1'])}")
+                elif status == 'added':
+                    report.append(f"  - Only in File 2: Face {face['face2'] + 1}: {self._describe_face(face['file2'])}")
+                else:
+                    report.append(f"  - Changed: Face {face['face1'] + 1} / {face['face2'] + 1} "
+                                 f"({', '.join(face['changed'])}): File 1 ({self._describe_face(face['file1'])}), "
+                                 f"File 2 ({self._describe_face(face['file2'])})")
+            if len(face_rows) > MAX_FACE_ROWS:
+                report.append(f"  - ... {len(face_rows) - MAX_FACE_ROWS} more")
         
         # PMI differences
         report.append("\n--- PMI Comparison ---")
-        # ... implementation for PMI differences
+        pmi_diffs = self.differences['pmi']
+        
+        if pmi_diffs['only_in_file1']:
+            report.append("  - Only in File 1:")
+            for key, entry in pmi_diffs['only_in_file1'].items():
+                report.append(f"      - {key}: {self._describe_entry(entry)}")
+        
+        if pmi_diffs['only_in_file2']:
+            report.append("  - Only in File 2:")
+            for key, entry in pmi_diffs['only_in_file2'].items():
+                report.append(f"      - {key}: {self._describe_entry(entry)}")
+        
+        if pmi_diffs['value_differences']:
+            report.append("  - Value Differences:")
+            for key, diff in pmi_diffs['value_differences'].items():
+                report.append(f"      - {key}: File 1 ({self._describe_entry(diff['file1'])}), "
+                             f"File 2 ({self._describe_entry(diff['file2'])})")
         
         # Attribute differences
         report.append("\n--- Attribute Comparison ---")
-        # ... implementation for attribute differences
+        attr_diffs = self.differences['attributes']
+        
+        if attr_diffs['only_in_file1']:
+            report.append("  - Only in File 1:")
+            for key, entry in attr_diffs['only_in_file1'].items():
+                report.append(f"      - {key}: {self._describe_entry(entry)}")
+        
+        if attr_diffs['only_in_file2']:
+            report.append("  - Only in File 2:")
+            for key, entry in attr_diffs['only_in_file2'].items():
+                report.append(f"      - {key}: {self._describe_entry(entry)}")
+        
+        if attr_diffs['value_differences']:
+            report.append("  - Value Differences:")
+            for key, diff in attr_diffs['value_differences'].items():
+                report.append(f"      - {key}: File 1 ({self._describe_entry(diff['file1'])}), "
+                             f"File 2 ({self._describe_entry(diff['file2'])})")
         
         # Summary
         report.append("\n--- Summary ---")
@@ -92,6 +264,80 @@ class ReportGenerator:
     def _format_number(self, number, precision=2):
         """Format a number with the specified precision"""
         return f"{number:.{precision}f}"
+    
+    def _describe_solid(self, fingerprint):
+        """One-line summary of a solid fingerprint"""
+        center = ", ".join(self._format_number(fingerprint[axis]) for axis in ('com_x', 'com_y', 'com_z'))
+        return f"Volume {self._format_number(fingerprint['volume'])} mm³ at [{center}]"
+    
+    def _face_rows(self, faces):
+        """(status, face) pairs of the face differences, removed first"""
+        return ([('removed', face) for face in faces.get('removed', [])] +
+                [('added', face) for face in faces.get('added', [])] +
+                [('modified', face) for face in faces.get('modified', [])])
+    
+    def _describe_face(self, signature):
+        """One-line summary of a face signature"""
+        center = ", ".join(self._format_number(signature[axis]) for axis in ('centroid_x', 'centroid_y', 'centroid_z'))
+        return f"{signature['surface_type']}, area {self._format_number(signature['area'])} mm² at [{center}]"
+    
+    def _describe_identity(self, identity):
+        """Sentence explaining why two files were reported identical without a comparison"""
+        if identity == 'byte':
+            return "The files are byte-identical; no comparison was needed."
+        return ("The files describe the same model: they differ only in the HEADER section "
+                "and the numbering of their entity instances.")
+    
+    def _describe_part(self, part):
+        """One-line summary of a part measured on its own"""
+        return (f"{self._format_number(part['volume'])} mm³ / {self._format_number(part['surface_area'])} mm² "
+                f"x {part['instances']}")
+    
+    def _describe_incomplete(self):
+        """Comparators that timed out or failed, on one line, or '' if there are none"""
+        parts = []
+        for name, status in self.differences.get('comparators', {}).items():
+            if status['status'] == 'timed_out':
+                parts.append(f"{name} (over its {status['budget']} s budget)")
+            elif status['status'] == 'failed':
+                parts.append(f"{name} (failed: {status['error']})")
+        return ', '.join(parts)
+    
+    def _describe_entry(self, entry):
+        """Summarize a PMI or attribute entry on one line, e.g. '0.05 MILLIMETRE |A|B|'"""
+        category = entry.get('category')
+        if category == 'product':
+            return f"{entry['name']} (Part Number: {entry['part_number']}, Revisions: {', '.join(entry['revisions']) or '-'})"
+        if category == 'color':
+            return entry['color']
+        if category == 'color_usage':
+            return ', '.join(f"{color} x{count}" for color, count in entry['counts'].items())
+        if category == 'layer':
+            return f"{entry['item_count']} items"
+        if category == 'occurrence':
+            transform = entry.get('transform')
+            if not transform:
+                return f"{entry['name'] or entry['child']} (no placement)"
+            translation = ', '.join(self._format_number(row[3]) for row in transform[:3])
+            return f"{entry['name'] or entry['child']} at [{translation}]"
+        if category == 'material':
+            return f"Applied to: {', '.join(entry['applied_to']) or '-'}"
+        
+        parts = []
+        if entry.get('value') is not None:
+            parts.append(f"{entry['value']} {entry.get('unit') or ''}".strip())
+        tolerance = entry.get('tolerance')
+        if tolerance and 'fit' in tolerance:
+            parts.append(tolerance['fit'])
+        elif tolerance:
+            parts.append(f"{tolerance.get('lower')}/+{tolerance.get('upper')}")
+        if entry.get('datums'):
+            parts.append('|' + '|'.join(entry['datums']) + '|')
+        if entry.get('modifiers'):
+            parts.append(' '.join(entry['modifiers']))
+        if category == 'datum':
+            parts.append(f"Datum {entry['label']}")
+        return ' '.join(parts) or entry.get('type', '')
 
     def generate_html_report(self, output_path=None):
         """Generate an HTML report of the differences"""
@@ -138,6 +384,9 @@ class ReportGenerator:
         html.append(f'        <p><strong>File 1:</strong> {self.file1_name}</p>')
         html.append(f'        <p><strong>File 2:</strong> {self.file2_name}</p>')
         html.append(f'        <p><strong>Generated:</strong> {self.timestamp}</p>')
+        level = self.differences['summary'].get('level')
+        if level:
+            html.append(f'        <p><strong>Comparison Level:</strong> {level}</p>')
         html.append('    </div>')
         
         # Add similarity score
@@ -147,6 +396,15 @@ class ReportGenerator:
         html.append(f'        Similarity Score: {self._format_number(similarity_score)}%')
         html.append('    </div>')
         
+        identity = self.differences['summary'].get('identical')
+        if identity:
+            html.append(f'    <p class="summary">{self._describe_identity(identity)}</p>')
+            return self._finish_html_report(html, output_path)
+        
+        incomplete = self._describe_incomplete()
+        if incomplete:
+            html.append(f'    <p class="summary"><strong>Incomplete:</strong> {incomplete}</p>')
+        
         # Add geometric comparison
         html.append('    <div class="section">')
         html.append('        <h2>Geometric Comparison</h2>')
@@ -192,15 +450,131 @@ class ReportGenerator:
         html.append(f'                <div class="metric-value">File 2: {self._format_number(bbox_data["file2"]["dimensions"][0])} × {self._format_number(bbox_data["file2"]["dimensions"][1])} × {self._format_number(bbox_data["file2"]["dimensions"][2])} mm</div>')
         html.append(f'                <div class="metric-diff">Volume Difference: {self._format_number(bbox_data["difference"])} mm³ ({self._format_number(bbox_data["percentage"])}%)</div>')
         html.append('            </div>')
-        
+
         html.append('        </div>')
-        
+
+        # Principal Moments and Oriented Bounding Box
+        html.append('        <div class="metric-row">')
+
+        # Principal Moments
+        moments_data = self.differences['geometric'].get('principal_moments')
+        if moments_data:
+            html.append('            <div class="metric-card">')
+            html.append('                <div class="metric-label">Principal Moments of Inertia</div>')
+            html.append(f'                <div class="metric-value">File 1: [{", ".join(self._format_number(m) for m in moments_data["file1"])}]</div>')
+            html.append(f'                <div class="metric-value">File 2: [{", ".join(self._format_number(m) for m in moments_data["file2"])}]</div>')
+            html.append(f'                <div class="metric-diff">Difference: {self._format_number(moments_data["difference"])} mm⁵ ({self._format_number(moments_data["percentage"])}%)</div>')
+            html.append('            </div>')
+
+        # Oriented Bounding Box
+        obb_data = self.differences['geometric'].get('oriented_bounding_box')
+        if obb_data:
+            html.append('            <div class="metric-card">')
+            html.append('                <div class="metric-label">Oriented Bounding Box</div>')
+            html.append(f'                <div class="metric-value">File 1: {" × ".join(self._format_number(d) for d in obb_data["file1"]["dimensions"])} mm</div>')
+            html.append(f'                <div class="metric-value">File 2: {" × ".join(self._format_number(d) for d in obb_data["file2"]["dimensions"])} mm</div>')
+            html.append(f'                <div class="metric-diff">Volume Difference: {self._format_number(obb_data["difference"])} mm³ ({self._format_number(obb_data["percentage"])}%)</div>')
+            html.append('            </div>')
+
+        html.append('        </div>')
+
+        # Surface deviation, each direction and the larger maximum
+        deviation_data = self.differences['geometric'].get('deviation')
+        if deviation_data:
+            html.append('        <div class="metric-row">')
+            for label, key in (('File 1 to File 2', 'file1_to_file2'), ('File 2 to File 1', 'file2_to_file1')):
+                stats = deviation_data[key]
+                html.append('            <div class="metric-card">')
+                html.append(f'                <div class="metric-label">Surface Deviation, {label}</div>')
+                html.append(f'                <div class="metric-value">Max: {self._format_number(stats["max"], 3)} mm</div>')
+                html.append(f'                <div class="metric-diff">Mean: {self._format_number(stats["mean"], 3)} mm, RMS: {self._format_number(stats["rms"], 3)} mm</div>')
+                html.append('            </div>')
+            html.append('            <div class="metric-card">')
+            html.append('                <div class="metric-label">Hausdorff Distance</div>')
+            html.append(f'                <div class="metric-value">{self._format_number(deviation_data["hausdorff"], 3)} mm</div>')
+            html.append('            </div>')
+            html.append('        </div>')
+
+        # Solid differences
+        html.append('        <h3>Solid Differences</h3>')
+        solids = self.differences['geometric'].get('solids', {})
+
+        if solids.get('removed') or solids.get('added') or solids.get('modified'):
+            html.append('        <table>')
+            html.append('            <tr><th>Solid</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+
+            for solid in solids['removed']:
+                html.append(f'            <tr class="removed"><td>{solid["solid1"] + 1} / -</td><td>{self._describe_solid(solid["file1"])}</td><td>-</td><td>Only in File 1</td></tr>')
+
+            for solid in solids['added']:
+                html.append(f'            <tr class="added"><td>- / {solid["solid2"] + 1}</td><td>-</td><td>{self._describe_solid(solid["file2"])}</td><td>Only in File 2</td></tr>')
+
+            for solid in solids['modified']:
+                html.append(f'            <tr class="changed"><td>{solid["solid1"] + 1} / {solid["solid2"] + 1}</td><td>{self._describe_solid(solid["file1"])}</td><td>{self._describe_solid(solid["file2"])}</td><td>Changed: {", ".join(solid["changed"])}</td></tr>')
+
+            html.append('        </table>')
+        else:
+            html.append('        <p>No solid differences found.</p>')
+
+        # Part differences, when the geometry was measured part by part
+        parts = self.differences['geometric'].get('parts', {})
+        if parts.get('changed') or parts.get('only_in_file1') or parts.get('only_in_file2'):
+            html.append('        <h3>Part Differences</h3>')
+            html.append(f'        <p>Parts measured one at a time: volume / area of one instance x instances. '
+                        f'Unchanged parts: {parts["unchanged"]}</p>')
+            html.append('        <table>')
+            html.append('            <tr><th>Part</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+            for part in parts['changed']:
+                html.append(f'            <tr class="changed"><td>{part["part"]}</td><td>{self._describe_part(part["file1"])}</td>'
+                            f'<td>{self._describe_part(part["file2"])}</td><td>Changed</td></tr>')
+            for name in parts['only_in_file1']:
+                html.append(f'            <tr class="removed"><td>{name}</td><td>-</td><td>-</td><td>Only in File 1</td></tr>')
+            for name in parts['only_in_file2']:
+                html.append(f'            <tr class="added"><td>{name}</td><td>-</td><td>-</td><td>Only in File 2</td></tr>')
+            html.append('        </table>')
+
+        # Face differences
+        html.append('        <h3>Face Differences</h3>')
+        faces = self.differences['geometric'].get('faces', {})
+        face_rows = self._face_rows(faces)
+
+        if face_rows:
+            html.append('        <table>')
+            html.append('            <tr><th>Face</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+            status_classes = {'removed': 'removed', 'added': 'added', 'modified': 'changed'}
+            for status, face in face_rows[:MAX_FACE_ROWS]:
+                file1 = self._describe_face(face['file1']) if 'file1' in face else '-'
+                file2 = self._describe_face(face['file2']) if 'file2' in face else '-'
+                label = f'{face["face1"] + 1 if "face1" in face else "-"} / {face["face2"] + 1 if "face2" in face else "-"}'
+                if status == 'removed':
+                    description = 'Only in File 1'
+                elif status == 'added':
+                    description = 'Only in File 2'
+                else:
+                    description = f'Changed: {", ".join(face["changed"])}'
+                html.append(f'            <tr class="{status_classes[status]}"><td>{label}</td><td>{file1}</td><td>{file2}</td><td>{description}</td></tr>')
+            html.append('        </table>')
+            if len(face_rows) > MAX_FACE_ROWS:
+                html.append(f'        <p>{len(face_rows) - MAX_FACE_ROWS} more face differences not shown.</p>')
+        else:
+            html.append('        <p>No face differences found.</p>')
+
         html.append('    </div>')
         
         # Add structural differences
         html.append('    <div class="section">')
         html.append('        <h2>Structural Comparison</h2>')
-        
+
+        # HEADER differences
+        header_diffs = self.differences.get('header', {})
+        if header_diffs:
+            html.append('        <h3>Header Differences</h3>')
+            html.append('        <table>')
+            html.append('            <tr><th>Field</th><th>File 1</th><th>File 2</th></tr>')
+            for field, diff in header_diffs.items():
+                html.append(f'            <tr class="changed"><td>{field}</td><td>{diff["file1"]}</td><td>{diff["file2"]}</td></tr>')
+            html.append('        </table>')
+
         # Entity differences
         html.append('        <h3>Entity Type Differences</h3>')
         entity_diffs = self.differences['structural']['entity_differences']
@@ -225,22 +599,136 @@ class ReportGenerator:
         else:
             html.append('        <p>No entity differences found.</p>')
         
+        # Instance differences
+        inst_diffs = self.differences['structural'].get('instance_differences', {})
+        if inst_diffs.get('only_in_file1') or inst_diffs.get('only_in_file2'):
+            html.append('        <h3>Entity Instance Differences</h3>')
+            html.append(f'        <p>Instances compared by content, ignoring their #id numbering. '
+                        f'Unchanged instances: {inst_diffs["unchanged"]}</p>')
+            html.append('        <table>')
+            html.append('            <tr><th>Entity Type</th><th>Removed</th><th>Added</th></tr>')
+            for entity in sorted(set(inst_diffs['only_in_file1']) | set(inst_diffs['only_in_file2'])):
+                removed = inst_diffs['only_in_file1'].get(entity, 0)
+                added = inst_diffs['only_in_file2'].get(entity, 0)
+                row_class = 'changed' if removed and added else 'removed' if removed else 'added'
+                html.append(f'            <tr class="{row_class}"><td>{entity}</td><td>{removed}</td><td>{added}</td></tr>')
+            html.append('        </table>')
+        
+        # Product shape differences
+        shape_diffs = self.differences['structural'].get('shape_differences', {})
+        if shape_diffs.get('changed') or shape_diffs.get('only_in_file1') or shape_diffs.get('only_in_file2'):
+            html.append('        <h3>Product Shape Differences</h3>')
+            html.append(f'        <p>Products compared by the hash of their shape representations. '
+                        f'Unchanged products: {shape_diffs["unchanged"]}</p>')
+            html.append('        <table>')
+            html.append('            <tr><th>Product</th><th>Status</th></tr>')
+            for key, row_class, status in (('changed', 'changed', 'Shape changed'),
+                                           ('only_in_file1', 'removed', 'Only in File 1'),
+                                           ('only_in_file2', 'added', 'Only in File 2')):
+                for part_number in shape_diffs[key]:
+                    html.append(f'            <tr class="{row_class}"><td>{part_number}</td><td>{status}</td></tr>')
+            html.append('        </table>')
+        
         # Relationship differences
         html.append('        <h3>Relationship Differences</h3>')
-        # ... similar implementation for relationships
+        rel_diffs = self.differences['structural']['relationship_differences']
+        
+        if rel_diffs['only_in_file1'] or rel_diffs['only_in_file2'] or rel_diffs['count_differences']:
+            html.append('        <table>')
+            html.append('            <tr><th>Relationship</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+            
+            # Relationships only in file 1
+            for relationship, count in rel_diffs['only_in_file1'].items():
+                html.append(f'            <tr class="removed"><td>{relationship}</td><td>{count}</td><td>-</td><td>Only in File 1</td></tr>')
+            
+            # Relationships only in file 2
+            for relationship, count in rel_diffs['only_in_file2'].items():
+                html.append(f'            <tr class="added"><td>{relationship}</td><td>-</td><td>{count}</td><td>Only in File 2</td></tr>')
+            
+            # Relationships with count differences
+            for relationship, diff in rel_diffs['count_differences'].items():
+                html.append(f'            <tr class="changed"><td>{relationship}</td><td>{diff["file1"]}</td><td>{diff["file2"]}</td><td>{diff["change"]} in File 2</td></tr>')
+            
+            html.append('        </table>')
+        else:
+            html.append('        <p>No relationship differences found.</p>')
+        
+        # Assembly differences
+        html.append('        <h3>Assembly Structure Differences</h3>')
+        asm_diffs = self.differences['structural']['assembly_differences']
+        
+        if asm_diffs['only_in_file1'] or asm_diffs['only_in_file2'] or asm_diffs['value_differences']:
+            html.append('        <table>')
+            html.append('            <tr><th>Occurrence</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+            
+            # Occurrences only in file 1
+            for key, entry in asm_diffs['only_in_file1'].items():
+                html.append(f'            <tr class="removed"><td>{key}</td><td>{self._describe_entry(entry)}</td><td>-</td><td>Only in File 1</td></tr>')
+            
+            # Occurrences only in file 2
+            for key, entry in asm_diffs['only_in_file2'].items():
+                html.append(f'            <tr class="added"><td>{key}</td><td>-</td><td>{self._describe_entry(entry)}</td><td>Only in File 2</td></tr>')
+            
+            # Occurrences that moved or were renamed
+            for key, diff in asm_diffs['value_differences'].items():
+                html.append(f'            <tr class="changed"><td>{key}</td><td>{self._describe_entry(diff["file1"])}</td><td>{self._describe_entry(diff["file2"])}</td><td>Changed: {", ".join(diff["changed"])}</td></tr>')
+            
+            html.append('        </table>')
+        else:
+            html.append('        <p>No assembly structure differences found.</p>')
         
         html.append('    </div>')
         
         # PMI differences
         html.append('    <div class="section">')
         html.append('        <h2>PMI Comparison</h2>')
-        # ... implementation for PMI differences
+        pmi_diffs = self.differences['pmi']
+        
+        if pmi_diffs['only_in_file1'] or pmi_diffs['only_in_file2'] or pmi_diffs['value_differences']:
+            html.append('        <table>')
+            html.append('            <tr><th>PMI</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+            
+            # PMI only in file 1
+            for key, entry in pmi_diffs['only_in_file1'].items():
+                html.append(f'            <tr class="removed"><td>{key}</td><td>{self._describe_entry(entry)}</td><td>-</td><td>Only in File 1</td></tr>')
+            
+            # PMI only in file 2
+            for key, entry in pmi_diffs['only_in_file2'].items():
+                html.append(f'            <tr class="added"><td>{key}</td><td>-</td><td>{self._describe_entry(entry)}</td><td>Only in File 2</td></tr>')
+            
+            # PMI with changed values
+            for key, diff in pmi_diffs['value_differences'].items():
+                html.append(f'            <tr class="changed"><td>{key}</td><td>{self._describe_entry(diff["file1"])}</td><td>{self._describe_entry(diff["file2"])}</td><td>Changed: {", ".join(diff["changed"])}</td></tr>')
+            
+            html.append('        </table>')
+        else:
+            html.append('        <p>No PMI differences found.</p>')
         html.append('    </div>')
         
         # Attribute differences
         html.append('    <div class="section">')
         html.append('        <h2>Attribute Comparison</h2>')
-        # ... implementation for attribute differences
+        attr_diffs = self.differences['attributes']
+        
+        if attr_diffs['only_in_file1'] or attr_diffs['only_in_file2'] or attr_diffs['value_differences']:
+            html.append('        <table>')
+            html.append('            <tr><th>Attribute</th><th>File 1</th><th>File 2</th><th>Status</th></tr>')
+            
+            # Attributes only in file 1
+            for key, entry in attr_diffs['only_in_file1'].items():
+                html.append(f'            <tr class="removed"><td>{key}</td><td>{self._describe_entry(entry)}</td><td>-</td><td>Only in File 1</td></tr>')
+            
+            # Attributes only in file 2
+            for key, entry in attr_diffs['only_in_file2'].items():
+                html.append(f'            <tr class="added"><td>{key}</td><td>-</td><td>{self._describe_entry(entry)}</td><td>Only in File 2</td></tr>')
+            
+            # Attributes with changed values
+            for key, diff in attr_diffs['value_differences'].items():
+                html.append(f'            <tr class="changed"><td>{key}</td><td>{self._describe_entry(diff["file1"])}</td><td>{self._describe_entry(diff["file2"])}</td><td>Changed: {", ".join(diff["changed"])}</td></tr>')
+            
+            html.append('        </table>')
+        else:
+            html.append('        <p>No attribute differences found.</p>')
         html.append('    </div>')
         
         # Summary
@@ -279,6 +767,10 @@ class ReportGenerator:
         
         html.append('    </div>')
         
+        return self._finish_html_report(html, output_path)
+    
+    def _finish_html_report(self, html, output_path):
+        """Close the HTML document, write it out and return its embeddable content"""
         # Close HTML tags
         html.append('</body>')
         html.append('</html>')
@@ -325,8 +817,12 @@ class ReportGenerator:
             elements.append(Paragraph(f"Similarity Score: {self._format_number(similarity_score)}%", styles['Heading2']))
             elements.append(Spacer(1, 12))
             
-            # Add geometric comparison
-            elements.append(Paragraph("Geometric Comparison", styles['Heading2']))
+            identity = self.differences['summary'].get('identical')
+            if identity:
+                elements.append(Paragraph(self._describe_identity(identity), styles['Normal']))
+            else:
+                # Add geometric comparison
+                elements.append(Paragraph("Geometric Comparison", styles['Heading2']))
             
             # Build the document
             doc.build(elements)
@@ -478,4 +974,79 @@ class ReportGenerator:
             
         except Exception as e:
             logger.error(f"Error generating CSV report: {str(e)}")
-            return None 
\ No newline at end of file
+            return None 
+
+class BatchSummaryGenerator:
+    """Ranked summary of one baseline compared against many candidates"""
+    
+    COLUMNS = ['rank', 'file', 'similarity_score', 'total_differences', 'structural_differences',
+               'geometric_differences', 'pmi_differences', 'attribute_differences', 'hausdorff',
+               'identical', 'error']
+    
+    def __init__(self, ranked, baseline_name):
+        self.ranked = ranked
+        self.baseline_name = os.path.basename(baseline_name)
+        self.timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    
+    def generate_text_report(self, output_path=None):
+        """Generate a text table of the candidates, most similar first"""
+        report = []
+        report.append("=== STEP-AP242 Baseline Comparison Summary ===")
+        report.append(f"Baseline: {self.baseline_name}")
+        report.append(f"Candidates: {len(self.ranked)}")
+        report.append(f"Generated: {self.timestamp}")
+        report.append("")
+        report.append(f"{'Rank':>4}  {'Similarity':>10}  {'Diffs':>5}  {'Struct':>6}  {'Geo':>4}  "
+                      f"{'PMI':>4}  {'Attr':>4}  {'Hausdorff':>10}  File")
+        
+        for entry in self.ranked:
+            name = os.path.basename(entry['file'])
+            if entry['error']:
+                report.append(f"{entry['rank']:>4}  {'-':>10}  {'':>5}  {'':>6}  {'':>4}  {'':>4}  {'':>4}  "
+                              f"{'':>10}  {name} (error: {entry['error']})")
+                continue
+            if entry['identical']:
+                name += f" ({entry['identical']}-identical)"
+            hausdorff = self._format_number(entry['hausdorff']) if entry['hausdorff'] else '-'
+            report.append(f"{entry['rank']:>4}  {self._format_number(entry['similarity_score']) + '%':>10}  "
+                          f"{entry['total_differences']:>5}  {entry['structural_differences']:>6}  "
+                          f"{entry['geometric_differences']:>4}  {entry['pmi_differences']:>4}  "
+                          f"{entry['attribute_differences']:>4}  {hausdorff:>10}  {name}")
+        
+        # Write to file if output path is provided
+        if output_path:
+            with open(output_path, 'w') as f:
+                f.write('\n'.join(report))
+        
+        return '\n'.join(report)
+    
+    def generate_json_report(self, output_path=None):
+        """Generate a JSON document of the ranked candidates"""
+        report = {
+            'metadata': {
+                'baseline': self.baseline_name,
+                'timestamp': self.timestamp
+            },
+            'candidates': self.ranked
+        }
+        
+        # Write to file if output path is provided
+        if output_path:
+            with open(output_path, 'w') as f:
+                json.dump(report, f, indent=2)
+        
+        return report
+    
+    def generate_csv_report(self, output_path=None):
+        """Generate a CSV table of the ranked candidates"""
+        rows = [self.COLUMNS] + [[entry[column] for column in self.COLUMNS] for entry in self.ranked]
+        if output_path:
+            with open(output_path, 'w', newline='') as csvfile:
+                csv.writer(csvfile).writerows(rows)
+            logger.info(f"CSV summary generated at {output_path}")
+            return output_path
+        return rows
+    
+    def _format_number(self, number, precision=2):
+        """Format a number with the specified precision"""
+        return f"{number:.{precision}f}"
@@ -0,0 +1,177 @@
+import os
+import numpy as np
+from step_parser import StepParser
+from comparison_engine import ComparisonEngine, measure_step_file, without_mesh
+from geometric_properties import GeometricProperties
+from streaming_geometry import StreamingGeometry
+from parse_cache import ParseCache, file_sha256
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the measurements change so stale cache entries are ignored
+MEASUREMENT_VERSION = 1
+
+
+class RevisionChain:
+    """Diffs each revision of a chain against the one before it, reusing what did not change
+
+    Each parse result carries a tree of content hashes (revision, geometry,
+    per-product shape), so a pair is only walked as deep as its hashes
+    differ: equal revision hashes are reported identical, equal geometry
+    hashes reuse one measurement with no surface deviation, and only the
+    products whose shape hash changed are listed. Measurements are cached
+    by geometry hash, so a revision measured as the newer side of one pair
+    is not measured again as the older side of the next, nor by a later run.
+
+    Assemblies are measured part by part instead, with each part's
+    measurement cached by its product shape hash: a revision that changes a
+    few products transfers only those and sums the rest from earlier
+    revisions. Their comparison lists the changed parts but has no solid,
+    face or surface deviation results, which need whole shapes. Assemblies
+    with a placement in a length unit that cannot be converted to
+    millimetres are measured whole, since their parts would be misplaced.
+    """
+
+    def __init__(self, cache=None, eps=None, face_tolerance=0.01, jobs=1, similarity_index=None):
+        # Optional ParseCache shared across runs; measurements are kept next to it
+        self.cache = cache
+        self.measurements = ParseCache(os.path.join(cache.cache_dir, 'measurements')) if cache else None
+        # Optional SimilarityIndex that every parsed file is added to
+        self.similarity_index = similarity_index
+        # Relative accuracy of the mass property integration (None = OCC default)
+        self.eps = eps
+        # Length below which face signatures count as equal (mm)
+        self.face_tolerance = face_tolerance
+        # Number of processes used to scan large files (0 = all CPU cores)
+        self.jobs = jobs
+        # Part measurements by product shape hash, shared by every revision
+        self.parts = _PartMeasurements(self.measurements, eps)
+
+    def compare(self, revision_files):
+        """Compare every revision with the previous one; returns one result per pair, in order
+
+        Each result holds the 'previous' and current 'file' and their
+        'differences'.
+        """
+        results = []
+        previous = self._analyze(revision_files[0])
+        for revision_file in revision_files[1:]:
+            current = self._analyze(revision_file)
+            results.append({
+                'previous': previous['file'],
+                'file': revision_file,
+                'differences': self._compare_pair(previous, current)
+            })
+            # Only the newer revision's measurement is needed by the next pair
+            previous = current
+        return results
+
+    def _analyze(self, revision_file):
+        """Hash and parse one revision; it is measured later, only if needed"""
+        file_hash = file_sha256(revision_file)
+        data = StepParser(workers=self.jobs, cache=self.cache,
+                          similarity_index=self.similarity_index).parse(revision_file, file_hash)
+        return {'file': revision_file, 'file_hash': file_hash, 'data': data, 'measurement': None,
+                'part_measurement': None}
+
+    def _compare_pair(self, previous, current):
+        """Diff two consecutive revisions, descending only into what changed"""
+        engine = ComparisonEngine(eps=self.eps, face_tolerance=self.face_tolerance)
+        if previous['file_hash'] == current['file_hash']:
+            self._reuse_measurements(previous, current)
+            return engine.identical('byte')
+        if engine.same_model(previous['data'], current['data']):
+            self._reuse_measurements(previous, current)
+            return engine.identical('semantic')
+
+        tree1 = previous['data'].get('revision_tree', {})
+        tree2 = current['data'].get('revision_tree', {})
+        by_part = self._by_part(previous['data']) and self._by_part(current['data'])
+        measure = self._part_measurement if by_part else self._measurement
+        if tree1.get('geometry') is not None and tree1.get('geometry') == tree2.get('geometry'):
+            logger.info(f"Geometry of {current['file']} is unchanged, reusing the previous measurement")
+            measurement = without_mesh(measure(previous))
+            self._reuse_measurements(previous, current)
+            measurements = (measurement, measurement)
+        else:
+            measurements = (measure(previous), measure(current))
+        return engine.compare(previous['data'], current['data'], measurements=measurements, level='precise')
+
+    def _by_part(self, data):
+        """Whether a parsed revision is an assembly whose placed parts can be summed"""
+        if len(data.get('revision_tree', {}).get('products', {})) < 2:
+            return False
+        # Placements kept in file units would not match the parts OCC transfers in mm
+        return data.get('product_structure', {}).get('unscaled_placements', 0) == 0
+    
+    def _reuse_measurements(self, previous, current):
+        """Hand the previous revision's measurements on to an unchanged current one"""
+        current['measurement'] = previous['measurement']
+        current['part_measurement'] = previous['part_measurement']
+
+    def _part_measurement(self, revision):
+        """Measurement of an assembly summed over its parts, transferring only parts not measured before"""
+        if revision['part_measurement'] is None:
+            products = revision['data'].get('revision_tree', {}).get('products', {})
+            try:
+                properties = StreamingGeometry(self.eps).measure(revision['file'], revision['data'].get('index'),
+                                                              part_hashes=products, part_cache=self.parts)
+            except Exception as e:
+                logger.error(f"Error measuring the parts of {revision['file']}: {str(e)}")
+                properties = None
+            revision['part_measurement'] = (properties, None, None, None)
+        return revision['part_measurement']
+
+    def _measurement(self, revision):
+        """Measurement tuple of a revision, from memory, the measurement cache or OCC"""
+        if revision['measurement'] is not None:
+            return revision['measurement']
+
+        key = f"{revision['data'].get('revision_tree', {}).get('geometry', revision['file_hash'])}-{self.eps}"
+        cached = self.measurements.load(key, MEASUREMENT_VERSION) if self.measurements else None
+        if cached is not None:
+            revision['measurement'] = (GeometricProperties(**cached['properties']), cached['solids'],
+                                       cached['faces'], (cached['vertices'], cached['triangles']))
+            return revision['measurement']
+
+        result = measure_step_file(revision['file'], self.eps)
+        if result is None:
+            revision['measurement'] = (None, None, None, None)
+            return revision['measurement']
+        properties, solids, faces, (vertices, triangles) = result
+        if self.measurements:
+            self.measurements.store(key, MEASUREMENT_VERSION, {
+                'properties': properties,
+                'solids': np.asarray(solids),
+                'faces': np.asarray(faces),
+                'vertices': np.asarray(vertices),
+                'triangles': np.asarray(triangles)
+            })
+        revision['measurement'] = (GeometricProperties(**properties), solids, faces, (vertices, triangles))
+        return revision['measurement']
+
+
+class _PartMeasurements:
+    """GeometricProperties of single parts by shape hash, in memory and in the measurement cache"""
+
+    def __init__(self, cache, eps):
+        self.cache = cache
+        self.eps = eps
+        self.parts = {}
+
+    def _key(self, shape_hash):
+        return f"part-{shape_hash}-{self.eps}"
+
+    def get(self, shape_hash):
+        """The measurement of a part shape, or None if it was never measured"""
+        if shape_hash not in self.parts and self.cache:
+            cached = self.cache.load(self._key(shape_hash), MEASUREMENT_VERSION)
+            if cached is not None:
+                self.parts[shape_hash] = GeometricProperties(**cached)
+        return self.parts.get(shape_hash)
+
+    def __setitem__(self, shape_hash, properties):
+        self.parts[shape_hash] = properties
+        if self.cache:
+            self.cache.store(self._key(shape_hash), MEASUREMENT_VERSION, properties.to_dict())
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import numpy as np
+from step_tokenizer import RecordReader
+
+logger = logging.getLogger(__name__)
+
+# Links from a product to the shape representations that describe it
+_PRODUCT_TO_SHAPE = (
+    ('PRODUCT_DEFINITION_FORMATION', 'PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE'),
+    ('PRODUCT_DEFINITION', 'PRODUCT_DEFINITION_WITH_ASSOCIATED_DOCUMENTS'),
+    ('PRODUCT_DEFINITION_SHAPE',),
+    ('SHAPE_DEFINITION_REPRESENTATION',)
+)
+# Rounds of SHAPE_REPRESENTATION_RELATIONSHIP links followed from a product's representation
+MAX_LINK_DEPTH = 4
+
+
+def tree_hash(hashes):
+    """Hex digest of a multiset of uint64 hashes, independent of their order"""
+    hashes = np.sort(np.asarray(hashes, dtype=np.uint64))
+    return hashlib.blake2b(hashes.tobytes(), digest_size=8).hexdigest()
+
+
+class RevisionTreeBuilder:
+    """Group entity content hashes into a Merkle tree: revision, geometry, products
+
+    Entity hashes already cover everything an entity references, so the hash
+    of a shape representation stands for its whole B-rep. On top of them:
+
+    - 'products': per part number, the hash of the shape representations of
+      the product, following SHAPE_DEFINITION_REPRESENTATION and plain
+      SHAPE_REPRESENTATION_RELATIONSHIP links (not assembly placements)
+    - 'geometry': the hash of every shape representation and representation
+      relationship, placements included; equal when no shape changed
+    - 'root': the hash of every entity; equal when nothing but the HEADER or
+      the numbering changed
+    """
+
+    def __init__(self, index, buffer, entity_hashes):
+        self.index = index
+        self.records = RecordReader(index, buffer)
+        self.hashes = entity_hashes
+        graph = index.references
+        self.targets = graph.indices.astype(np.int64) if graph is not None else np.empty(0, dtype=np.int64)
+        self.sources = graph.sources() if graph is not None else np.empty(0, dtype=np.int64)
+        resolved = self.targets >= 0
+        self.targets, self.sources = self.targets[resolved], self.sources[resolved]
+
+    def build(self):
+        """Return the tree's hashes as a JSON-serializable dict"""
+        return {
+            'root': tree_hash(self.hashes),
+            'geometry': tree_hash(self.hashes[self._shape_rows()]),
+            'products': self._product_hashes()
+        }
+
+    def _shape_mask(self):
+        """Boolean array over type codes marking shape representations and their relationships"""
+        return np.array([any('SHAPE_REPRESENTATION' in part for part in type_name.split('+'))
+                         for type_name in self.index.type_names], dtype=bool)
+
+    def _shape_rows(self):
+        """Rows of every shape representation and representation relationship"""
+        if not len(self.index):
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero(self._shape_mask()[self.index.type_codes])
+
+    def _product_hashes(self):
+        """Hash of the shape representations of each product, by part number"""
+        product_rows = self.index.rows_of_type('PRODUCT')
+        if not product_rows.size:
+            return {}
+
+        # Walk PRODUCT <- formation <- definition <- shape <- SDR, labelling
+        # every row with the product it came from
+        rows, labels = product_rows, np.arange(product_rows.size)
+        for type_names in _PRODUCT_TO_SHAPE:
+            rows, labels = self._referrers(rows, labels, self.index.type_mask(*type_names))
+
+        representation_mask = self._shape_mask() & ~self.index.type_mask('SHAPE_REPRESENTATION_RELATIONSHIP',
+                                                                          'CONTEXT_DEPENDENT_SHAPE_REPRESENTATION')
+        link_mask = self.index.type_mask('SHAPE_REPRESENTATION_RELATIONSHIP') & \
+            ~self.index.type_mask('REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION')
+        representations, owners = self._referenced(rows, labels, representation_mask)
+        found = _unique_pairs(owners, representations)
+        for _ in range(MAX_LINK_DEPTH):
+            links, link_owners = self._referrers(found[1], found[0], link_mask)
+            linked, linked_owners = self._referenced(links, link_owners, representation_mask)
+            grown = _unique_pairs(np.concatenate([found[0], linked_owners]),
+                                  np.concatenate([found[1], linked]))
+            if grown[0].size == found[0].size:
+                break
+            found = grown
+
+        # Pairs are sorted by owner, so each product's representations are one run
+        owners, representations = found
+        bounds = np.searchsorted(owners, np.arange(product_rows.size + 1))
+        hashes = {}
+        for label, row in enumerate(product_rows.tolist()):
+            try:
+                part_number = self.records.attributes(row, 'PRODUCT')[0]
+            except Exception as e:
+                logger.debug(f"Skipping product #{self.index.ids[row]}: {str(e)}")
+                continue
+            hashes[part_number] = tree_hash(self.hashes[representations[bounds[label]:bounds[label + 1]]])
+        return hashes
+
+    def _referrers(self, rows, labels, type_mask):
+        """Rows of the marked types that reference one of rows, with each label of that row"""
+        edges = type_mask[self.index.type_codes[self.sources]]
+        return _join(rows, labels, self.targets[edges], self.sources[edges])
+
+    def _referenced(self, rows, labels, type_mask):
+        """Rows of the marked types referenced by one of rows, with each label of that row"""
+        edges = type_mask[self.index.type_codes[self.targets]]
+        return _join(rows, labels, self.sources[edges], self.targets[edges])
+
+
+def _join(keys, labels, edge_keys, edge_values):
+    """(edge value, label) for every edge whose key is one of keys, once per label of that key"""
+    keys, labels = np.asarray(keys, dtype=np.int64), np.asarray(labels, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    keys, labels = keys[order], labels[order]
+    low = np.searchsorted(keys, edge_keys, side='left')
+    counts = np.searchsorted(keys, edge_keys, side='right') - low
+    positions = np.repeat(low - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+    return np.repeat(edge_values, counts), labels[positions]
+
+
+def _unique_pairs(first, second):
+    """Unique (first, second) pairs of two aligned integer arrays, sorted"""
+    first, second = np.asarray(first, dtype=np.int64), np.asarray(second, dtype=np.int64)
+    if not first.size:
+        return first, second
+    order = np.lexsort((second, first))
+    first, second = first[order], second[order]
+    keep = np.concatenate([[True], (first[1:] != first[:-1]) | (second[1:] != second[:-1])])
+    return first[keep], second[keep]
@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+from OCC.Core.STEPControl import STEPControl_Reader
+from OCC.Core.IFSelect import IFSelect_RetDone
+from compressed_step import spilled_step_file
+from parse_cache import file_sha256
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Budget for cached shapes, measured in bytes of the STEP text they came from,
+# so only a rough bound on their memory
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class ShapeProvider:
+    """Reads and transfers each STEP file through OCC once and shares the shape
+
+    Shapes are cached by file content hash, so meshing, geometric comparison
+    and topology extraction of the same revision reuse one transfer, within a
+    job and across jobs. OCC does not report a shape's memory use, so each
+    entry is charged the size of its Part 21 text, and the least recently
+    used shapes are evicted once the total exceeds max_bytes. The budget is
+    therefore approximate: a transferred shape can take several times the
+    size of its text, more for finely tessellated or heavily instanced
+    assemblies.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._shapes = OrderedDict()
+        self._total_bytes = 0
+        # Content hash by (path, mtime, size), guarded by _lock like the rest
+        self._hashes = {}
+        self._lock = threading.Lock()
+        # One lock per file hash while its shape is cached or being transferred
+        self._file_locks = {}
+
+    def get_shape(self, step_file, file_hash=None):
+        """Return the transferred shape of a STEP file, or None if it cannot be read"""
+        file_hash = file_hash or self._file_hash(step_file)
+        with self._lock:
+            file_lock = self._file_locks.setdefault(file_hash, threading.Lock())
+
+        # Concurrent requests for the same file wait for a single transfer
+        with file_lock:
+            with self._lock:
+                if file_hash in self._shapes:
+                    self._shapes.move_to_end(file_hash)
+                    logger.info(f"Shape cache hit for {file_hash}")
+                    return self._shapes[file_hash][0]
+
+            shape, size = self._transfer(step_file)
+            if shape is not None:
+                self._store(file_hash, shape, size)
+            else:
+                with self._lock:
+                    self._file_locks.pop(file_hash, None)
+            return shape
+
+    def cached_shape(self, step_file, file_hash=None):
+        """Return the shape of a STEP file if it is cached, without transferring it"""
+        file_hash = file_hash or self._file_hash(step_file)
+        with self._lock:
+            entry = self._shapes.get(file_hash)
+            if entry is None:
+                return None
+            self._shapes.move_to_end(file_hash)
+            return entry[0]
+
+    def clear(self):
+        """Drop every cached shape"""
+        with self._lock:
+            self._shapes.clear()
+            self._file_locks.clear()
+            self._total_bytes = 0
+
+    def _file_hash(self, step_file):
+        """Content hash of a file, remembered while the file is unchanged"""
+        stat = os.stat(step_file)
+        key = (os.path.realpath(step_file), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            file_hash = self._hashes.get(key)
+        if file_hash is None:
+            # Hash outside the lock; two threads may both hash a new file
+            file_hash = file_sha256(step_file)
+            with self._lock:
+                self._hashes[key] = file_hash
+        return file_hash
+
+    def _transfer(self, step_file):
+        """Read and transfer a STEP file; returns (shape, size of its Part 21 text)"""
+        try:
+            logger.info(f"Transferring STEP file: {step_file}")
+            step_reader = STEPControl_Reader()
+            # OCC needs a real path, so compressed files are spilled to disk here only
+            with spilled_step_file(step_file) as plain_path:
+                size = os.path.getsize(plain_path)
+                status = step_reader.ReadFile(plain_path)
+
+            if status != IFSelect_RetDone:
+                logger.error(f"Failed to read STEP file: {step_file}")
+                return None, 0
+
+            step_reader.TransferRoots()
+            return step_reader.OneShape(), size
+        except Exception as e:
+            logger.error(f"Error loading STEP file: {str(e)}")
+            return None, 0
+
+    def _store(self, file_hash, shape, size):
+        """Cache a shape and evict the least recently used ones over budget"""
+        with self._lock:
+            self._shapes[file_hash] = (shape, size)
+            self._total_bytes += size
+            # Always keep the newest shape, even if it alone exceeds the budget
+            while self._total_bytes > self.max_bytes and len(self._shapes) > 1:
+                evicted_hash, (_, evicted_size) = self._shapes.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self._file_locks.pop(evicted_hash, None)
+                logger.info(f"Evicted shape {evicted_hash} from the shape cache")
+
+
+# Shared by the web app's meshing and the comparison engine
+shape_provider = ShapeProvider()
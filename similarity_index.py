@@ -0,0 +1,155 @@
+import os
+import json
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+from entity_hashing import minhash_signature, MINHASH_PERMUTATIONS, HASH_VERSION
+import logging
+
+logger = logging.getLogger(__name__)
+
+# LSH bands of the MinHash signature; files sharing any band become candidates.
+# 32 bands of 4 rows find pairs above a Jaccard similarity of about 0.4
+LSH_BANDS = 32
+# Weight of the entity set similarity against the entity type histogram similarity
+SET_WEIGHT = 0.5
+# File name of the index, kept in the parse cache directory
+INDEX_FILE_NAME = 'similarity.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_hash TEXT PRIMARY KEY,
+    name TEXT,
+    entity_count INTEGER,
+    signature BLOB,
+    histogram TEXT
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band_key INTEGER,
+    file_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS bands_by_key ON bands (band_key);
+"""
+
+
+class SimilarityIndex:
+    """Persistent MinHash/LSH index of every parsed file, for nearest-revision lookups
+
+    Each file is stored once per content hash with a MinHash signature of
+    its renumbering-invariant entity hashes and its entity type histogram.
+    The signature is cut into LSH bands, indexed in SQLite, so a lookup
+    reads only the files sharing a band with the query rather than the
+    whole corpus. Candidates are scored on the 0-100 scale of the
+    comparison summary: the weighted mean of the estimated Jaccard
+    similarity of the entity sets and the weighted Jaccard similarity of
+    the type histograms.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as connection:
+            # Signatures of older entity hashes never match new ones; start over
+            if connection.execute('PRAGMA user_version').fetchone()[0] != HASH_VERSION:
+                connection.executescript('DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS bands;')
+                connection.execute(f'PRAGMA user_version = {HASH_VERSION}')
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection per call, so threads and processes can share the file"""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add(self, file_hash, name, data):
+        """Index a parse result under its file content hash; known files only update their name"""
+        with self._connect() as connection:
+            if connection.execute('SELECT 1 FROM files WHERE file_hash = ?', (file_hash,)).fetchone():
+                connection.execute('UPDATE files SET name = ? WHERE file_hash = ?', (name, file_hash))
+                return
+
+            hashes = data.get('entity_hashes')
+            if hashes is None:
+                return
+            signature = minhash_signature(hashes)
+            inserted = connection.execute('INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?)',
+                                          (file_hash, name, len(hashes), signature.tobytes(),
+                                           json.dumps(data.get('entities', {}))))
+            if not inserted.rowcount:
+                # Indexed by another process in the meantime
+                return
+            connection.executemany('INSERT INTO bands VALUES (?, ?)',
+                                   [(key, file_hash) for key in _band_keys(signature)])
+        logger.debug(f"Indexed {name} ({file_hash}) for similarity search")
+
+    def query(self, file_hash, k=10):
+        """Return the k indexed files most similar to an indexed file, most similar first
+
+        Each match holds 'file_hash', 'name', 'similarity' (0-100), and the
+        'entity_similarity' and 'type_similarity' it combines (0-1).
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT signature, histogram FROM files WHERE file_hash = ?',
+                                     (file_hash,)).fetchone()
+            if row is None:
+                return []
+            signature = np.frombuffer(row[0], dtype=np.uint32)
+            histogram = json.loads(row[1])
+
+            keys = _band_keys(signature)
+            candidates = connection.execute(
+                f"SELECT DISTINCT file_hash FROM bands WHERE band_key IN ({','.join('?' * len(keys))}) "
+                "AND file_hash != ?", (*keys, file_hash)).fetchall()
+            matches = []
+            # SQLite limits the number of bound parameters per statement
+            candidates = [candidate for (candidate,) in candidates]
+            for start in range(0, len(candidates), 500):
+                batch = candidates[start:start + 500]
+                matches.extend(connection.execute(
+                    f"SELECT file_hash, name, signature, histogram FROM files "
+                    f"WHERE file_hash IN ({','.join('?' * len(batch))})", batch).fetchall())
+
+        results = []
+        for other_hash, name, other_signature, other_histogram in matches:
+            other_signature = np.frombuffer(other_signature, dtype=np.uint32)
+            entity_similarity = float(np.mean(signature == other_signature))
+            type_similarity = _histogram_similarity(histogram, json.loads(other_histogram))
+            results.append({
+                'file_hash': other_hash,
+                'name': name,
+                'similarity': 100 * (SET_WEIGHT * entity_similarity + (1 - SET_WEIGHT) * type_similarity),
+                'entity_similarity': entity_similarity,
+                'type_similarity': type_similarity
+            })
+        results.sort(key=lambda result: result['similarity'], reverse=True)
+        return results[:k]
+
+    def __contains__(self, file_hash):
+        with self._connect() as connection:
+            return connection.execute('SELECT 1 FROM files WHERE file_hash = ?', (file_hash,)).fetchone() is not None
+    
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+
+def _band_keys(signature):
+    """One signed 64-bit key per LSH band, tagged with the band number"""
+    bands = np.asarray(signature, dtype=np.uint32).reshape(LSH_BANDS, MINHASH_PERMUTATIONS // LSH_BANDS)
+    return [int.from_bytes(hashlib.blake2b(bytes([band]) + values.tobytes(), digest_size=8).digest(),
+                           'little', signed=True)
+            for band, values in enumerate(bands)]
+
+
+def _histogram_similarity(histogram1, histogram2):
+    """Weighted Jaccard similarity of two entity type histograms"""
+    types = set(histogram1) | set(histogram2)
+    largest = sum(max(histogram1.get(name, 0), histogram2.get(name, 0)) for name in types)
+    if not largest:
+        return 1.0
+    return sum(min(histogram1.get(name, 0), histogram2.get(name, 0)) for name in types) / largest
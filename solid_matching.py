@@ -0,0 +1,196 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns of a solid fingerprint matrix
+FINGERPRINT_FIELDS = (
+    'volume', 'surface_area', 'com_x', 'com_y', 'com_z',
+    'moment_1', 'moment_2', 'moment_3', 'extent_x', 'extent_y', 'extent_z'
+)
+# Reported field of each column
+FIELD_GROUPS = (
+    'volume', 'surface_area', 'center_of_mass', 'center_of_mass', 'center_of_mass',
+    'principal_moments', 'principal_moments', 'principal_moments',
+    'bounding_box', 'bounding_box', 'bounding_box'
+)
+_POSITION = slice(2, 5)
+# Power that turns each size column into a length (volume, area, moments, extents)
+_LENGTH_POWERS = np.array([1 / 3, 1 / 2, 1 / 5, 1 / 5, 1 / 5, 1, 1, 1])
+_SIZE_COLUMNS = [0, 1, 5, 6, 7, 8, 9, 10]
+
+# Candidates per solid, the largest match cost accepted and the cost below
+# which mutual nearest neighbours are paired without an assignment
+NEIGHBOURS = 8
+MAX_MATCH_COST = 0.5
+EXACT_MATCH_COST = 1e-3
+# Larger groups of candidates are paired greedily by cost
+MAX_ASSIGNMENT_SIZE = 2000
+_NO_MATCH_COST = 1e6
+
+
+def _match_features(fingerprints, scale):
+    """Map fingerprints to a space where distance measures how different two solids are
+
+    The center of mass is taken relative to the model size and every size
+    column as the log of a length, so a body that moved 10 % of the model or
+    grew 10 % is about 0.1 away regardless of units.
+    """
+    sizes = np.maximum(fingerprints[:, _SIZE_COLUMNS], 0) ** _LENGTH_POWERS
+    floor = scale * 1e-9
+    return np.hstack([fingerprints[:, _POSITION] / scale, np.log(sizes + floor)])
+
+
+def _model_scale(fingerprints1, fingerprints2):
+    """Diagonal of the box around every solid's center of mass, or 1 when degenerate"""
+    centers = np.vstack([fingerprints1[:, _POSITION], fingerprints2[:, _POSITION]])
+    extents = np.vstack([fingerprints1[:, 8:], fingerprints2[:, 8:]])
+    diagonal = np.linalg.norm(centers.max(axis=0) - centers.min(axis=0))
+    return max(diagonal, float(extents.max()), 1e-12) if centers.size else 1.0
+
+
+def match_solids(fingerprints1, fingerprints2, tolerance=1e-6):
+    """Match the solids of two revisions by their fingerprints
+
+    Solids are compared in the match feature space through k-d trees: mutual
+    nearest neighbours at about zero distance are paired right away and the
+    remaining solids by optimal assignment over their nearest candidates, so
+    thousands of bodies cost about as much as their fingerprints. Returns the
+    'removed' and 'added' solids, the 'modified' pairs with the fields that
+    changed and the number of unchanged solids; solids are numbered from 0 in
+    fingerprint row order.
+    """
+    fingerprints1 = np.asarray(fingerprints1, dtype=float).reshape(-1, len(FINGERPRINT_FIELDS))
+    fingerprints2 = np.asarray(fingerprints2, dtype=float).reshape(-1, len(FINGERPRINT_FIELDS))
+    count1, count2 = len(fingerprints1), len(fingerprints2)
+    if not count1 or not count2:
+        pairs1 = pairs2 = np.zeros(0, dtype=np.int64)
+        return _result(fingerprints1, fingerprints2, pairs1, pairs2, 1.0, tolerance)
+
+    scale = _model_scale(fingerprints1, fingerprints2)
+    features1 = _match_features(fingerprints1, scale)
+    features2 = _match_features(fingerprints2, scale)
+
+    # Unchanged solids are each other's nearest neighbour at about zero cost;
+    # pairing them first leaves only the changed solids to assign
+    _, nearest1 = cKDTree(features2).query(features1, distance_upper_bound=EXACT_MATCH_COST)
+    _, nearest2 = cKDTree(features1).query(features2, distance_upper_bound=EXACT_MATCH_COST)
+    exact = np.flatnonzero(nearest1 < count2)
+    exact = exact[nearest2[nearest1[exact]] == exact]
+    pairs1, pairs2 = [exact], [nearest1[exact]]
+
+    rest1 = np.setdiff1d(np.arange(count1), exact)
+    rest2 = np.setdiff1d(np.arange(count2), nearest1[exact])
+    if rest1.size and rest2.size:
+        rest_pairs1, rest_pairs2 = _assign(features1[rest1], features2[rest2])
+        pairs1.append(rest1[rest_pairs1])
+        pairs2.append(rest2[rest_pairs2])
+
+    pairs1 = np.concatenate(pairs1)
+    pairs2 = np.concatenate(pairs2)
+    order = np.argsort(pairs1)
+    pairs1, pairs2 = pairs1[order], pairs2[order]
+
+    logger.debug(f"Matched {pairs1.size} of {count1} / {count2} solids")
+    return _result(fingerprints1, fingerprints2, pairs1, pairs2, scale, tolerance)
+
+
+def _result(fingerprints1, fingerprints2, pairs1, pairs2, scale, tolerance):
+    """Split matched pairs into modified and unchanged and list the unmatched solids"""
+    # A matched pair is modified when any column differs beyond the tolerance
+    values1, values2 = fingerprints1[pairs1], fingerprints2[pairs2]
+    limits = tolerance * np.maximum(np.abs(values1), np.abs(values2))
+    limits[:, _POSITION] = tolerance * scale
+    differs = np.abs(values1 - values2) > limits
+    modified_rows = np.flatnonzero(differs.any(axis=1))
+
+    modified = []
+    for row in modified_rows.tolist():
+        modified.append({
+            'solid1': int(pairs1[row]),
+            'solid2': int(pairs2[row]),
+            'file1': dict(zip(FINGERPRINT_FIELDS, values1[row].tolist())),
+            'file2': dict(zip(FINGERPRINT_FIELDS, values2[row].tolist())),
+            'changed': sorted({FIELD_GROUPS[column] for column in np.flatnonzero(differs[row]).tolist()})
+        })
+
+    return {
+        'removed': [{'solid1': solid, 'file1': dict(zip(FINGERPRINT_FIELDS, fingerprints1[solid].tolist()))}
+                    for solid in np.setdiff1d(np.arange(len(fingerprints1)), pairs1).tolist()],
+        'added': [{'solid2': solid, 'file2': dict(zip(FINGERPRINT_FIELDS, fingerprints2[solid].tolist()))}
+                  for solid in np.setdiff1d(np.arange(len(fingerprints2)), pairs2).tolist()],
+        'modified': modified,
+        'unchanged': int(pairs1.size - len(modified))
+    }
+
+
+def _assign(features1, features2):
+    """Pair solids by minimum total cost among each one's nearest candidates"""
+    count1, count2 = len(features1), len(features2)
+    k = min(NEIGHBOURS, count2)
+    costs, neighbours = cKDTree(features2).query(features1, k=k, distance_upper_bound=MAX_MATCH_COST)
+    costs, neighbours = costs.reshape(count1, k), neighbours.reshape(count1, k)
+    found = neighbours < count2
+    rows = np.repeat(np.arange(count1), k)[found.ravel()]
+    columns = neighbours[found]
+    costs = costs[found]
+
+    # Solids that share no candidate cannot affect each other's assignment
+    graph = coo_matrix((np.ones(rows.size), (rows, count1 + columns)), shape=(count1 + count2,) * 2)
+    _, labels = connected_components(graph, directed=False)
+    order = np.argsort(labels[rows], kind='stable')
+    rows, columns, costs = rows[order], columns[order], costs[order]
+    groups = np.flatnonzero(np.diff(labels[rows])) + 1
+
+    # Most solids have a single candidate that has no other; pair those directly
+    sizes = np.diff(np.concatenate([[0], groups, [rows.size]]))
+    single = np.repeat(sizes == 1, sizes)
+    pairs1, pairs2 = [rows[single]], [columns[single]]
+    starts = np.concatenate([[0], groups])[sizes > 1]
+    for start, size in zip(starts.tolist(), sizes[sizes > 1].tolist()):
+        group = slice(start, start + size)
+        group_pairs = _assign_group(rows[group], columns[group], costs[group])
+        pairs1.append(group_pairs[0])
+        pairs2.append(group_pairs[1])
+    return np.concatenate(pairs1), np.concatenate(pairs2)
+
+
+def _assign_group(rows, columns, costs):
+    """Optimal assignment of one group of candidate pairs"""
+    solids1, local_rows = np.unique(rows, return_inverse=True)
+    solids2, local_columns = np.unique(columns, return_inverse=True)
+    size1, size2 = solids1.size, solids2.size
+    if size1 + size2 > MAX_ASSIGNMENT_SIZE:
+        return _assign_greedy(rows, columns, costs)
+
+    # Every solid may also stay unmatched at half the largest accepted
+    # cost, so a pair is only formed when it is cheaper than leaving both
+    # solids out, and a removed solid cannot push its neighbours around
+    matrix = np.full((size1 + size2, size2 + size1), _NO_MATCH_COST)
+    matrix[local_rows, local_columns] = costs
+    matrix[np.arange(size1), size2 + np.arange(size1)] = MAX_MATCH_COST / 2
+    matrix[size1 + np.arange(size2), np.arange(size2)] = MAX_MATCH_COST / 2
+    matrix[size1:, size2:] = 0
+    assigned_rows, assigned_columns = linear_sum_assignment(matrix)
+    kept = (assigned_rows < size1) & (assigned_columns < size2)
+    assigned_rows, assigned_columns = assigned_rows[kept], assigned_columns[kept]
+    kept = matrix[assigned_rows, assigned_columns] < _NO_MATCH_COST
+    return solids1[assigned_rows[kept]], solids2[assigned_columns[kept]]
+
+
+def _assign_greedy(rows, columns, costs):
+    """Pair the cheapest candidates first; used where an assignment would be too large"""
+    used1, used2 = set(), set()
+    pairs1, pairs2 = [], []
+    order = np.argsort(costs, kind='stable')
+    for row, column in zip(rows[order].tolist(), columns[order].tolist()):
+        if row not in used1 and column not in used2:
+            used1.add(row)
+            used2.add(column)
+            pairs1.append(row)
+            pairs2.append(column)
+    return np.array(pairs1, dtype=np.int64), np.array(pairs2, dtype=np.int64)
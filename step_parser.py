@@ -9,54 +9,150 @@ from OCC.Extend import DataExchange
 from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_EDGE, TopAbs_VERTEX, TopAbs_SOLID, TopAbs_SHELL, TopAbs_WIRE
 from OCC.Core.TopExp import TopExp_Explorer
 from OCC.Core.TopoDS import topods
+from step_tokenizer import StepTokenizer
+from pmi_extractor import PmiExtractor
+from attribute_extractor import AttributeExtractor
+from product_structure import ProductStructureExtractor
+from entity_hashing import entity_hashes
+from revision_tree import RevisionTreeBuilder
+from parse_cache import file_sha256
+from compressed_step import compression_of
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the parse result changes so stale cache entries are ignored
+PARSER_VERSION = 9
+
 class StepParser:
-    def __init__(self):
+    def __init__(self, workers=1, cache=None, similarity_index=None, hashes=True):
+        # Number of processes used to scan large files (0 = all CPU cores)
+        self.workers = workers
+        # Optional ParseCache shared across runs
+        self.cache = cache
+        # Optional SimilarityIndex that every parsed file is added to
+        self.similarity_index = similarity_index
+        # Compute the entity hashes and revision tree; a cached or indexed
+        # result always has them, so they are computed once per file
+        self.hashes = hashes or cache is not None or similarity_index is not None
+        self.header = {}
         self.entities = {}
         self.relationships = {}
         self.pmi_data = {}
         self.attributes = {}
+        self.product_structure = {}
+        self.entity_hashes = None
+        self.revision_tree = {}
+        self.index = None
         
-    def parse(self, file_path):
-        """Parse a STEP-AP242 file and extract its data structure"""
+    def parse(self, file_path, file_hash=None, name=None):
+        """Parse a STEP-AP242 file and extract its data structure
+
+        name is the file name recorded in the similarity index (default: the
+        base name of file_path).
+        """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"STEP file not found: {file_path}")
+        
+        hashed = self.cache is not None or self.similarity_index is not None
+        name = name or os.path.basename(file_path)
+        if hashed and (file_hash or not compression_of(file_path)):
+            # A revision we have already seen costs a hash and a cache read
+            file_hash = file_hash or file_sha256(file_path)
+            cached = self._load_cached(file_hash)
+            if cached is not None:
+                return self._index_similarity(cached, file_hash, name)
             
         try:
-            # Simple approach: just count entity types by parsing the file as text
-            entity_counts = {}
-            
-            with open(file_path, 'r') as f:
-                for line in f:
-                    if line.startswith('#') and '=' in line:
-                        parts = line.split('=')
-                        if len(parts) >= 2:
-                            entity_part = parts[1].strip()
-                            entity_type = entity_part.split('(')[0].strip()
-                            
-                            if entity_type in entity_counts:
-                                entity_counts[entity_type] += 1
-                            else:
-                                entity_counts[entity_type] = 1
-            
-            self.entities = entity_counts
+            # Scan the memory-mapped file on ';' record boundaries, keeping the
+            # offset and type of every entity so later stages can jump to it
+            with StepTokenizer(file_path) as tokenizer:
+                if hashed and file_hash is None:
+                    # Compressed files are hashed while they are decompressed
+                    file_hash = tokenizer.sha256
+                    cached = self._load_cached(file_hash)
+                    if cached is not None:
+                        return self._index_similarity(cached, file_hash, name)
+                
+                self.header = tokenizer.read_header()
+                self.index = tokenizer.build_index(workers=self.workers)
+                # Semantic PMI is read from the records themselves, so files
+                # whose XDE import drops GD&T still compare correctly
+                self.pmi_data = self._extract_pmi(self.index, tokenizer.buffer)
+                self.attributes = self._extract_attributes(self.index, tokenizer.buffer)
+                # Assembly tree from the product records, without a shape transfer
+                self.product_structure = self._extract_product_structure(self.index, tokenizer.buffer)
+                if self.hashes:
+                    # Content hashes that survive renumbering, for an instance-level diff
+                    self.entity_hashes = self._hash_entities(self.index, tokenizer.buffer)
+                    # Per-product shape hashes, so a revision chain skips unchanged geometry
+                    self.revision_tree = self._build_revision_tree(self.index, tokenizer.buffer, self.entity_hashes)
             
-            # For now, just return empty data for relationships, PMI, and attributes
-            self.relationships = {}
-            self.pmi_data = {}
-            self.attributes = {}
+            self.entities = self.index.type_counts()
+            self.relationships = self._extract_relationships(self.index)
             
-            return {
-                'entities': self.entities,
-                'relationships': self.relationships,
-                'pmi_data': self.pmi_data,
-                'attributes': self.attributes
-            }
+            result = self._result()
         except Exception as e:
             raise RuntimeError(f"Error parsing STEP file: {str(e)}")
+        
+        if self.cache:
+            self.cache.store(file_hash, PARSER_VERSION, result)
+        return self._index_similarity(result, file_hash, name)
+    
+    def read_header(self, file_path):
+        """Read the HEADER section and a sampled entity estimate without parsing the DATA section"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"STEP file not found: {file_path}")
+        
+        try:
+            with StepTokenizer(file_path) as tokenizer:
+                return tokenizer.read_header()
+        except Exception as e:
+            raise RuntimeError(f"Error reading STEP header: {str(e)}")
+    
+    def _load_cached(self, file_hash):
+        """Restore and return a cached parse result, or None on a miss"""
+        if not self.cache:
+            return None
+        cached = self.cache.load(file_hash, PARSER_VERSION)
+        if cached is not None:
+            self._load_result(cached)
+        return cached
+    
+    def _index_similarity(self, result, file_hash, name):
+        """Add a parse result to the similarity index, if there is one, and return it"""
+        if self.similarity_index is not None:
+            try:
+                self.similarity_index.add(file_hash, name, result)
+            except Exception as e:
+                logger.warning(f"Could not add {name} to the similarity index: {str(e)}")
+        return result
+    
+    def _result(self):
+        """Collect the extracted data into the parse result"""
+        return {
+            'header': self.header,
+            'entities': self.entities,
+            'relationships': self.relationships,
+            'pmi_data': self.pmi_data,
+            'attributes': self.attributes,
+            'product_structure': self.product_structure,
+            'entity_hashes': self.entity_hashes,
+            'revision_tree': self.revision_tree,
+            'index': self.index
+        }
+    
+    def _load_result(self, data):
+        """Restore the extracted data from a cached parse result"""
+        self.header = data['header']
+        self.entities = data['entities']
+        self.relationships = data['relationships']
+        self.pmi_data = data['pmi_data']
+        self.attributes = data['attributes']
+        self.product_structure = data['product_structure']
+        self.entity_hashes = data['entity_hashes']
+        self.revision_tree = data['revision_tree']
+        self.index = data['index']
     
     def _extract_entities(self, shape, shape_tool):
         """Extract entity types and counts from the STEP file"""
@@ -116,17 +212,29 @@ class StepParser:
         
         self.entities = entity_counts
         
-    def _extract_relationships(self, shape_tool):
-        """Extract relationships between entities"""
-        # Implementation details for extracting relationships
-        pass
+    def _extract_relationships(self, index):
+        """Extract relationship counts per 'SOURCE_TYPE -> TARGET_TYPE' reference pair"""
+        # The reference graph was collected by the tokenizer in the same pass
+        return index.edge_type_counts()
         
-    def _extract_pmi(self, doc):
+    def _extract_pmi(self, index, buffer):
         """Extract Product and Manufacturing Information"""
-        # Implementation for extracting GD&T, dimensions, and annotations
-        pass
+        # GD&T, datums and dimensions keyed so they can be diffed across revisions
+        return PmiExtractor(index, buffer).extract()
         
-    def _extract_attributes(self, shape_tool, color_tool):
+    def _extract_attributes(self, index, buffer):
         """Extract other attributes from entities"""
-        # Implementation for extracting attributes like names, materials, etc.
-        pass 
\ No newline at end of file
+        # Product names and part numbers, colors, layers and materials
+        return AttributeExtractor(index, buffer).extract()
+        
+    def _extract_product_structure(self, index, buffer):
+        """Extract products, usage occurrences and their placements"""
+        return ProductStructureExtractor(index, buffer).extract() 
+        
+    def _hash_entities(self, index, buffer):
+        """Compute the renumbering-invariant content hash of every entity"""
+        return entity_hashes(index, buffer)
+        
+    def _build_revision_tree(self, index, buffer, entity_hashes):
+        """Group the entity hashes into revision, geometry and per-product hashes"""
+        return RevisionTreeBuilder(index, buffer, entity_hashes).build()
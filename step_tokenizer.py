@@ -0,0 +1,960 @@
+import mmap
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from compressed_step import compression_of, read_decompressed
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes scanned per vectorized window; a window always ends on a record boundary
+WINDOW_SIZE = 8 * 1024 * 1024
+# Files smaller than this are not worth the cost of starting worker processes
+MIN_PARALLEL_SIZE = 4 * WINDOW_SIZE
+# Byte ranges handed out per worker, so one slow range does not stall the pool
+CHUNKS_PER_WORKER = 4
+# read_header gives up looking for the end of the HEADER section after this
+HEADER_LIMIT = 16 * 1024 * 1024
+# Evenly spaced DATA samples used to estimate the entity count
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+
+_QUOTE, _HASH, _LPAREN, _EQUALS, _SEMICOLON = (ord(c) for c in "'#(=;")
+
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b' \t\r\n\f\v')] = True
+_DIGITS = np.zeros(256, dtype=bool)
+_DIGITS[list(b'0123456789')] = True
+_NAME_CHARS = _DIGITS.copy()
+_NAME_CHARS[list(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_!')] = True
+
+# A single ISO 10303-21 statement: optional leading whitespace/comments, an
+# optional entity instance head (#id = [ '(' ] TYPE) and everything up to the
+# terminating ';'. String literals and comments are skipped as units so a ';'
+# inside them never ends the record. Every alternative is deterministic (a
+# comment always closes at the first '*/', the body is an unrolled loop) so a
+# record cut short by the scan limit fails cleanly instead of backtracking into
+# a shorter, bogus match.
+_COMMENT = rb"/\*[^*]*\*+(?:[^/*][^*]*\*+)*/"
+_RECORD_RE = re.compile(
+    rb"(?:\s|" + _COMMENT + rb")*"
+    rb"(?:#(\d+)\s*=\s*(\()?\s*(!?[A-Za-z_][A-Za-z0-9_]*))?"
+    rb"[^;'/]*(?:(?:'[^']*'|" + _COMMENT + rb"|/(?!\*))[^;'/]*)*;"
+)
+
+_HEAD_RE = re.compile(rb"#(\d+)\s*=\s*(\()?\s*(!?[A-Za-z_][A-Za-z0-9_]*)")
+
+_REFERENCE_RE = re.compile(rb"#(\d+)")
+
+# Tokens of a record's parameter list; whitespace and comments are skipped
+_PARAMETER_TOKEN_RE = re.compile(
+    rb"\s+|" + _COMMENT + rb"|"
+    rb"('(?:[^']|'')*')|"
+    rb"(#\d+)|"
+    rb"(\.[A-Za-z0-9_]+\.)|"
+    rb"([+-]?(?:\d+\.?\d*|\.\d+)(?:[Ee][+-]?\d+)?)|"
+    rb"(\"[0-9A-Fa-f]*\")|"
+    rb"(!?[A-Za-z_][A-Za-z0-9_]*)|"
+    rb"([(),$*])"
+)
+_UNICODE_ESCAPE_RE = re.compile(r"\\X2\\((?:[0-9A-F]{4})*)\\X0\\|\\X4\\((?:[0-9A-F]{8})*)\\X0\\|\\X\\([0-9A-F]{2})")
+
+# End of the HEADER section, including an edition 3 DATA('name', (schema)) section
+_DATA_SECTION_RE = re.compile(rb"ENDSEC\s*;\s*DATA\s*(?:\([^;]*\))?\s*;")
+
+# Where a parallel chunk may start: a ';' followed by the next instance head,
+# possibly behind comments
+_CHUNK_BOUNDARY_RE = re.compile(rb";(?:\s|" + _COMMENT + rb")*(?=#\d+\s*=)")
+
+# Tokens needed to recover the partial type names of a complex instance
+_STRING_OR_COMMENT_RE = re.compile(rb"'[^']*'|" + _COMMENT)
+_COMPLEX_TOKEN_RE = re.compile(rb"!?[A-Za-z_][A-Za-z0-9_]*|\(|\)")
+
+
+def application_protocol(schemas):
+    """Name the application protocol (AP203, AP214, AP242) of FILE_SCHEMA identifiers"""
+    for schema in schemas:
+        schema = str(schema).upper()
+        if 'AP242' in schema:
+            return 'AP242'
+        if 'AUTOMOTIVE_DESIGN' in schema or 'AP214' in schema:
+            return 'AP214'
+        if 'CONFIG_CONTROL_DESIGN' in schema or 'AP203' in schema:
+            return 'AP203'
+    return schemas[0] if schemas else None
+
+
+def complex_type_name(record):
+    """Return the '+'-joined partial type names of a complex entity record"""
+    body = record[record.index(b'=') + 1:]
+    body = _STRING_OR_COMMENT_RE.sub(b"''", body)
+
+    names = []
+    depth = 0
+    for token in _COMPLEX_TOKEN_RE.findall(body):
+        if token == b'(':
+            depth += 1
+        elif token == b')':
+            depth -= 1
+        elif depth == 1:
+            names.append(token.decode('ascii'))
+
+    return '+'.join(names)
+
+
+def record_references(record):
+    """Return the ids of every entity referenced by a record, in order"""
+    body = record[record.index(b'=') + 1:]
+    body = _STRING_OR_COMMENT_RE.sub(b"''", body)
+    return [int(reference) for reference in _REFERENCE_RE.findall(body)]
+
+
+class EntityRef(int):
+    """Reference to another entity instance (#n)"""
+
+    def __repr__(self):
+        return f"#{int(self)}"
+
+
+class Enumeration(str):
+    """Enumeration or logical value such as .T. or .MILLI., without the dots"""
+
+
+# A typed parameter such as LENGTH_MEASURE(0.05); params is its parameter list
+TypedParameter = namedtuple('TypedParameter', ['type_name', 'params'])
+
+
+def _decode_string(token):
+    """Decode a Part 21 string literal, including \\X\\, \\X2\\ and \\X4\\ escapes"""
+    text = token[1:-1].replace(b"''", b"'").decode('latin-1')
+    if '\\X' not in text:
+        return text
+
+    def replace(match):
+        if match.group(1) is not None:
+            return bytes.fromhex(match.group(1)).decode('utf-16-be')
+        if match.group(2) is not None:
+            return bytes.fromhex(match.group(2)).decode('utf-32-be')
+        return bytes.fromhex(match.group(3)).decode('latin-1')
+
+    return _UNICODE_ESCAPE_RE.sub(replace, text)
+
+
+def _parse_parameters(tokens, position):
+    """Parse a parenthesized parameter list starting after its '('; returns (params, position)"""
+    params = []
+    while position < len(tokens):
+        kind, token = tokens[position]
+        position += 1
+        if kind == 'punct':
+            if token == b')':
+                return params, position
+            if token == b'(':
+                value, position = _parse_parameters(tokens, position)
+                params.append(value)
+            elif token == b'$':
+                params.append(None)
+            elif token == b'*':
+                params.append('*')
+        elif kind == 'keyword':
+            # Typed parameter; its '(' follows
+            value, position = _parse_parameters(tokens, position + 1)
+            params.append(TypedParameter(token.decode('ascii'), value))
+        else:
+            params.append(token)
+    return params, position
+
+
+def parse_record(record):
+    """Parse an entity record into (type_name, params)
+
+    Strings are decoded, references become EntityRef, enumerations become
+    Enumeration, '$' is None and typed values are TypedParameter. For a
+    complex instance the type name is '+'-joined and params maps each partial
+    type name to its own parameter list.
+    """
+    tokens = _tokenize(record, record.index(b'=') + 1)
+    if tokens and tokens[0][0] == 'keyword':
+        params, _ = _parse_parameters(tokens, 2)
+        return tokens[0][1].decode('ascii'), params
+
+    partials, _ = _parse_parameters(tokens, 1)
+    partials = [partial for partial in partials if isinstance(partial, TypedParameter)]
+    return '+'.join(partial.type_name for partial in partials), {partial.type_name: partial.params for partial in partials}
+
+
+def _tokenize(data, position=0):
+    """Split Part 21 text into ('value' | 'keyword' | 'punct', token) pairs"""
+    tokens = []
+    for match in _PARAMETER_TOKEN_RE.finditer(data, position):
+        string, reference, enumeration, number, binary, keyword, punct = match.groups()
+        if string is not None:
+            tokens.append(('value', _decode_string(string)))
+        elif reference is not None:
+            tokens.append(('value', EntityRef(reference[1:])))
+        elif enumeration is not None:
+            tokens.append(('value', Enumeration(enumeration[1:-1].decode('ascii'))))
+        elif number is not None:
+            is_real = b'.' in number or b'E' in number or b'e' in number
+            tokens.append(('value', float(number) if is_real else int(number)))
+        elif binary is not None:
+            tokens.append(('value', binary[1:-1].decode('ascii')))
+        elif keyword is not None:
+            tokens.append(('keyword', keyword))
+        elif punct is not None:
+            tokens.append(('punct', punct))
+    return tokens
+
+
+def _unique(values):
+    """Sorted unique values of an integer array, without np.unique's extra bookkeeping"""
+    values = np.sort(values)
+    if values.size:
+        values = values[np.concatenate(([True], values[1:] != values[:-1]))]
+    return values
+
+
+def _rows(arr, starts, width):
+    """Copy a fixed-width run of bytes starting at each position into an (n, width) matrix"""
+    if arr.size < width or int(starts.max()) + width > arr.size:
+        arr = np.concatenate((arr, np.zeros(width, dtype=np.uint8)))
+    return sliding_window_view(arr, width)[starts]
+
+
+def _skip_whitespace(arr, positions):
+    """Advance each position past any whitespace bytes"""
+    positions = positions.copy()
+    pending = np.flatnonzero(_WHITESPACE[arr[positions]])
+    while pending.size:
+        positions[pending] += 1
+        pending = pending[_WHITESPACE[arr[positions[pending]]]]
+    return positions
+
+
+def _parse_integers(arr, starts, max_digits=19):
+    """Decode the run of decimal digits at each position; returns (values, digit counts)"""
+    digits = _rows(arr, starts, max_digits) - ord('0')
+    is_digit = digits <= 9
+    counts = np.where(is_digit.all(axis=1), max_digits, np.argmin(is_digit, axis=1))
+
+    values = np.zeros(starts.size, dtype=np.int64)
+    columns = np.ascontiguousarray(digits.T)
+    for column in range(int(counts.max())):
+        values = np.where(counts > column, values * 10 + columns[column], values)
+    return values, counts
+
+
+def _next_position(positions, targets):
+    """For each target, the first of the sorted positions at or after it (clamped)"""
+    if not positions.size:
+        return np.full_like(targets, -1)
+    return positions[np.minimum(np.searchsorted(positions, targets), positions.size - 1)]
+
+
+def _intern_names(names, lengths):
+    """Group equal byte strings; returns (unique names, inverse codes)"""
+    width = -(-max(int(lengths.max()), 1) // 8) * 8
+    if names.shape[1] < width:
+        names = np.pad(names, ((0, 0), (0, width - names.shape[1])))
+    matrix = names[:, :width] * (np.arange(width) < lengths[:, None])
+
+    # Hash eight bytes at a time; sorting integers is far cheaper than an
+    # argsort over byte strings, and the vocabulary is only a few hundred names
+    words = matrix.view(np.uint64)
+    hashes = words[:, 0].copy()
+    for column in range(1, words.shape[1]):
+        hashes = hashes * np.uint64(0x100000001B3) + words[:, column]
+    sorted_hashes = np.sort(hashes)
+    is_first = np.empty(sorted_hashes.size, dtype=bool)
+    is_first[0] = True
+    np.not_equal(sorted_hashes[1:], sorted_hashes[:-1], out=is_first[1:])
+    codes = np.searchsorted(sorted_hashes[is_first], hashes)
+    first = np.empty(int(is_first.sum()), dtype=np.intp)
+    first[codes] = np.arange(codes.size)
+
+    if not (words == words[first[codes]]).all():
+        # Hash collision: fall back to grouping the raw bytes
+        _, first, codes = np.unique(matrix.view(f'S{width}')[:, 0], return_index=True, return_inverse=True)
+        codes = codes.reshape(-1)
+
+    unique_names = [matrix[row, :length].tobytes().decode('ascii')
+                    for row, length in zip(first.tolist(), lengths[first].tolist())]
+    return unique_names, codes.astype(np.int32)
+
+
+def _scan_range(file_path, start, end, window_size):
+    """Worker entry point: scan one byte range of a file into RecordBatches"""
+    with StepTokenizer(file_path, window_size) as tokenizer:
+        return list(tokenizer.iter_batches(start, end))
+
+
+class RecordBatch:
+    """Entity instance heads found in one window of the file"""
+
+    def __init__(self, ids, offsets, lengths, type_codes, type_names, ref_counts, ref_ids):
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = lengths
+        # Codes index into type_names, which is local to this batch
+        self.type_codes = type_codes
+        self.type_names = type_names
+        # Number of '#n' references in each record and the referenced ids,
+        # concatenated in record order
+        self.ref_counts = ref_counts
+        self.ref_ids = ref_ids
+
+
+class ReferenceGraph:
+    """Entity reference graph in CSR form over EntityIndex rows
+
+    The references of row i are indices[indptr[i]:indptr[i + 1]], in the order
+    they appear in the record; references to ids missing from the file are -1.
+    """
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @property
+    def nbytes(self):
+        """Memory held by the CSR arrays"""
+        return self.indptr.nbytes + self.indices.nbytes
+
+    def targets(self, row):
+        """Return the rows referenced by a row"""
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def sources(self):
+        """Return the source row of every edge, aligned with indices"""
+        return np.repeat(np.arange(self.indptr.size - 1), np.diff(self.indptr))
+
+    def edge_type_counts(self, type_codes, type_names):
+        """Count edges per 'SOURCE_TYPE -> TARGET_TYPE' pair"""
+        resolved = self.indices >= 0
+        source_codes = np.repeat(type_codes, np.diff(self.indptr))[resolved].astype(np.int64)
+        target_codes = type_codes[self.indices[resolved]].astype(np.int64)
+        pairs, counts = np.unique(source_codes * len(type_names) + target_codes, return_counts=True)
+
+        edge_counts = {}
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            source, target = divmod(pair, len(type_names))
+            edge_counts[f"{type_names[source]} -> {type_names[target]}"] = count
+        return edge_counts
+
+    def reach(self, rows, type_codes, target_mask, through_mask, max_depth=8):
+        """Find the target-type rows reachable from each of the given rows
+
+        All rows are expanded together one reference level per step, only
+        continuing through rows whose type is marked in through_mask. Returns
+        aligned (origin, target) arrays of unique pairs.
+        """
+        origins = np.asarray(rows, dtype=np.int64)
+        current = origins
+        found_origins = []
+        found_targets = []
+        for _ in range(max_depth):
+            if not current.size:
+                break
+            starts = self.indptr[current]
+            counts = self.indptr[current + 1] - starts
+            total = int(counts.sum())
+            if not total:
+                break
+            # Positions of every outgoing edge of the current frontier
+            edges = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+            targets = self.indices[edges].astype(np.int64)
+            origins = np.repeat(origins, counts)
+            resolved = targets >= 0
+            targets, origins = targets[resolved], origins[resolved]
+
+            codes = type_codes[targets]
+            hit = target_mask[codes]
+            found_origins.append(origins[hit])
+            found_targets.append(targets[hit])
+
+            # Keep walking through intermediate rows, once per origin
+            step = through_mask[codes] & ~hit
+            pairs = _unique(origins[step] * (self.indptr.size - 1) + targets[step])
+            origins, current = np.divmod(pairs, self.indptr.size - 1)
+
+        if not found_origins:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pairs = _unique(np.concatenate(found_origins) * (self.indptr.size - 1) + np.concatenate(found_targets))
+        return np.divmod(pairs, self.indptr.size - 1)
+
+
+class EntityIndex:
+    """Compact per-entity index: id, byte offset, record length and type code
+
+    Rows are in file order. Type codes index into type_names, which is sorted
+    so the index does not depend on how the file was split into windows.
+    """
+
+    def __init__(self, ids, offsets, lengths, type_codes, type_names, references=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = lengths
+        self.type_codes = type_codes
+        self.type_names = type_names
+        self.references = references
+        self._codes = {type_name: code for code, type_name in enumerate(type_names)}
+
+        # Exporters number entities densely from #1, so a direct lookup table
+        # is usually affordable and far faster than binary search
+        self._lookup = None
+        self._order = None
+        self._sorted_ids = ids
+        max_id = int(ids.max()) if ids.size else 0
+        if max_id <= 4 * ids.size + 1024:
+            self._lookup = np.full(max_id + 1, -1, dtype=np.int32)
+            self._lookup[ids[ids >= 0]] = np.arange(ids.size, dtype=np.int32)[ids >= 0]
+        elif ids.size > 1 and not (ids[1:] > ids[:-1]).all():
+            self._order = np.argsort(ids, kind='stable')
+            self._sorted_ids = ids[self._order]
+
+    @classmethod
+    def from_batches(cls, batches):
+        """Merge per-window RecordBatches into one index"""
+        batches = list(batches)
+        used_names = set()
+        for batch in batches:
+            used = np.bincount(batch.type_codes, minlength=len(batch.type_names)) > 0
+            used_names.update(name for name, is_used in zip(batch.type_names, used) if is_used)
+
+        type_names = sorted(used_names)
+        codes = {type_name: code for code, type_name in enumerate(type_names)}
+
+        ids, offsets, lengths, type_codes = [], [], [], []
+        ref_counts, ref_ids = [np.zeros(1, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for batch in batches:
+            remap = np.array([codes.get(name, -1) for name in batch.type_names], dtype=np.int32)
+            ids.append(batch.ids)
+            offsets.append(batch.offsets)
+            lengths.append(batch.lengths.astype(np.int32))
+            type_codes.append(remap[batch.type_codes])
+            ref_counts.append(batch.ref_counts)
+            ref_ids.append(batch.ref_ids)
+
+        if not batches:
+            index = cls(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int32),
+                        np.empty(0, np.int32), type_names)
+        else:
+            index = cls(np.concatenate(ids), np.concatenate(offsets), np.concatenate(lengths),
+                        np.concatenate(type_codes), type_names)
+
+        indptr = np.cumsum(np.concatenate(ref_counts))
+        indices = index.rows_for_ids(np.concatenate(ref_ids)).astype(np.int32)
+        index.references = ReferenceGraph(indptr, indices)
+        return index
+
+    def __len__(self):
+        return self.ids.size
+
+    def to_arrays(self):
+        """Return the index as a dict of NumPy arrays for serialization"""
+        arrays = {
+            'ids': self.ids,
+            'offsets': self.offsets,
+            'lengths': self.lengths,
+            'type_codes': self.type_codes,
+            'type_names': np.array(self.type_names, dtype=str)
+        }
+        if self.references is not None:
+            arrays['ref_indptr'] = self.references.indptr
+            arrays['ref_indices'] = self.references.indices
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild an index from the arrays produced by to_arrays"""
+        references = None
+        if 'ref_indptr' in arrays:
+            references = ReferenceGraph(arrays['ref_indptr'], arrays['ref_indices'])
+        return cls(arrays['ids'], arrays['offsets'], arrays['lengths'], arrays['type_codes'],
+                   arrays['type_names'].tolist(), references)
+
+    @property
+    def nbytes(self):
+        """Memory held by the index arrays"""
+        nbytes = self.ids.nbytes + self.offsets.nbytes + self.lengths.nbytes + self.type_codes.nbytes
+        if self.references is not None:
+            nbytes += self.references.nbytes
+        return nbytes
+
+    def type_code(self, type_name):
+        """Return the code of a type name, or -1 if no entity has that type"""
+        return self._codes.get(type_name, -1)
+
+    def type_counts(self):
+        """Count entities per type name"""
+        counts = np.bincount(self.type_codes, minlength=len(self.type_names))
+        return {type_name: count for type_name, count in zip(self.type_names, counts.tolist()) if count}
+
+    def edge_type_counts(self):
+        """Count references per 'SOURCE_TYPE -> TARGET_TYPE' pair"""
+        if self.references is None:
+            return {}
+        return self.references.edge_type_counts(self.type_codes, self.type_names)
+
+    def type_mask(self, *type_names):
+        """Return a boolean array over type codes marking the given types
+
+        Complex types are marked when any of their partial types is given.
+        """
+        wanted = set(type_names)
+        return np.array([type_name in wanted or ('+' in type_name and bool(wanted.intersection(type_name.split('+'))))
+                         for type_name in self.type_names], dtype=bool)
+
+    def rows_of_type(self, *type_names):
+        """Return the rows of every entity that is an instance of one of the given types"""
+        codes = np.flatnonzero(self.type_mask(*type_names))
+        if not codes.size:
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero(np.isin(self.type_codes, codes))
+
+    def rows_for_ids(self, entity_ids):
+        """Map entity ids to rows; ids that are not in the file map to -1"""
+        entity_ids = np.asarray(entity_ids, dtype=np.int64)
+        if self._lookup is not None:
+            in_range = (entity_ids >= 0) & (entity_ids < self._lookup.size)
+            return np.where(in_range, self._lookup[np.where(in_range, entity_ids, 0)], -1).astype(np.intp)
+        if not self._sorted_ids.size:
+            return np.full(entity_ids.shape, -1, dtype=np.intp)
+        positions = np.minimum(np.searchsorted(self._sorted_ids, entity_ids), self._sorted_ids.size - 1)
+        found = self._sorted_ids[positions] == entity_ids
+        rows = positions if self._order is None else self._order[positions]
+        return np.where(found, rows, -1)
+
+    def record(self, buffer, row):
+        """Return the raw bytes of the record at a row"""
+        offset = int(self.offsets[row])
+        return buffer[offset:offset + int(self.lengths[row])]
+
+
+class RecordReader:
+    """Parses individual records on demand through an EntityIndex, caching each row"""
+
+    def __init__(self, index, buffer):
+        self.index = index
+        self.buffer = buffer
+        self._parsed = {}
+
+    def row(self, reference):
+        """Return the index row of a referenced entity, or -1 if it is missing"""
+        if not isinstance(reference, EntityRef):
+            return -1
+        return int(self.index.rows_for_ids([reference])[0])
+
+    def parse(self, row):
+        """Return (type_name, params) of the record at a row, or (None, None)"""
+        if row < 0:
+            return None, None
+        if row not in self._parsed:
+            self._parsed[row] = parse_record(self.index.record(self.buffer, row))
+        return self._parsed[row]
+
+    def resolve(self, reference):
+        """Return (type_name, params) of a referenced entity, or (None, None)"""
+        return self.parse(self.row(reference))
+
+    def attributes(self, row, type_name):
+        """Return the parameters an instance holds for one of its types
+
+        Simple instances list every attribute, supertypes first, so the whole
+        list is returned; complex instances hold one list per partial type.
+        """
+        _, params = self.parse(row)
+        if isinstance(params, dict):
+            return params.get(type_name)
+        return params
+
+    def measure(self, reference):
+        """Resolve a measure-with-unit record into (value, unit)"""
+        row = self.row(reference)
+        type_name, params = self.parse(row)
+        if type_name is None:
+            return None, None
+
+        if isinstance(params, dict):
+            params = params.get('MEASURE_WITH_UNIT')
+        elif type_name == 'MEASURE_REPRESENTATION_ITEM':
+            # name, value_component, unit_component
+            params = params[1:]
+        elif not type_name.endswith('MEASURE_WITH_UNIT'):
+            return None, None
+        if not params:
+            return None, None
+
+        value = params[0]
+        if isinstance(value, TypedParameter):
+            value = value.params[0] if value.params else None
+        return value, self.unit(params[1]) if len(params) > 1 else None
+
+    def unit(self, reference):
+        """Resolve a unit record into a name such as MILLIMETRE or INCH"""
+        type_name, params = self.resolve(reference)
+        if not isinstance(params, dict):
+            return type_name
+        if 'SI_UNIT' in params:
+            prefix, name = params['SI_UNIT']
+            return f"{prefix or ''}{name}"
+        if 'CONVERSION_BASED_UNIT' in params:
+            return params['CONVERSION_BASED_UNIT'][0]
+        return type_name
+
+    def item_name(self, reference):
+        """Return the representation item name of a measure item, such as 'nominal value'"""
+        row = self.row(reference)
+        type_name, params = self.parse(row)
+        if isinstance(params, dict):
+            params = params.get('REPRESENTATION_ITEM')
+        elif type_name != 'MEASURE_REPRESENTATION_ITEM':
+            return None
+        return params[0] if params else None
+
+
+class StepTokenizer:
+    """Byte-level tokenizer scanning a memory-mapped STEP file on record boundaries"""
+
+    def __init__(self, file_path, window_size=WINDOW_SIZE):
+        self.file_path = file_path
+        self.window_size = window_size
+        self.buffer = None
+        # SHA-256 of the decompressed text, computed while reading compressed files
+        self.sha256 = None
+        self.compressed = False
+        self._file = None
+
+    def open(self):
+        """Memory-map the file for read-only access"""
+        if compression_of(self.file_path):
+            # .stp.gz / .stpZ are decompressed into anonymous memory, never to disk
+            self.compressed = True
+            self.buffer, self.sha256 = read_decompressed(self.file_path)
+            return self
+
+        self._file = open(self.file_path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            # mmap refuses empty files
+            self.buffer = b''
+            return self
+
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.buffer, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            # Let the kernel read ahead and drop pages behind the scan
+            self.buffer.madvise(mmap.MADV_SEQUENTIAL)
+        return self
+
+    def close(self):
+        """Release the memory map and the underlying file handle"""
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def iter_batches(self, start=0, end=None):
+        """Yield a RecordBatch per window between start and end"""
+        end = len(self.buffer) if end is None else end
+        window_size = self.window_size
+
+        while start < end:
+            limit = min(start + window_size, end)
+            batch = None
+            window_end = None
+
+            comment = self.buffer.find(b'/*', start, limit)
+            if comment == -1:
+                batch, window_end = self._scan_window(start, limit, end)
+            elif comment > start:
+                # Vectorize up to the last record boundary before the comment
+                batch, window_end = self._scan_window(start, comment, end)
+            if window_end is None and comment != -1:
+                # Comments may hide quotes and semicolons; step over the
+                # records around this one with the exact scanner
+                comment_end = self.buffer.find(b'*/', comment + 2, end)
+                stop = limit if comment_end == -1 else comment_end + 2
+                batch, window_end = self._scan_window_exact(start, limit, end, stop)
+
+            if window_end is None:
+                # A single record is longer than the window
+                window_size *= 2
+                continue
+
+            window_size = self.window_size
+            start = window_end
+            if batch is not None:
+                yield batch
+
+    def build_index(self, start=0, end=None, workers=1):
+        """Build the EntityIndex in a single scan, optionally across worker processes
+
+        With workers > 1 the range is split on record boundaries, each chunk
+        is scanned in a process pool and the batches are merged in file order,
+        which gives exactly the index a serial scan would. workers <= 0 uses
+        every CPU core.
+        """
+        end = len(self.buffer) if end is None else end
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        if workers == 1 or end - start < MIN_PARALLEL_SIZE or self.compressed:
+            # Workers map the file themselves, which a compressed file does not allow
+            return EntityIndex.from_batches(self.iter_batches(start, end))
+
+        ranges = self.split_ranges(start, end, workers * CHUNKS_PER_WORKER)
+        logger.debug(f"Scanning {self.file_path} in {len(ranges)} chunks on {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = pool.map(_scan_range, [self.file_path] * len(ranges),
+                              [chunk_start for chunk_start, _ in ranges],
+                              [chunk_end for _, chunk_end in ranges],
+                              [self.window_size] * len(ranges))
+            batches = [batch for chunk in chunks for batch in chunk]
+        return EntityIndex.from_batches(batches)
+
+    def split_ranges(self, start, end, parts):
+        """Split [start, end) into about `parts` byte ranges that begin at instance heads
+
+        A ';' followed by an instance head can also sit inside a string
+        literal or a comment, so each candidate boundary is checked from the
+        previous one, which is known to be between records.
+        """
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        boundaries = [start]
+        step = max((end - start) // parts, 1)
+        for guess in range(start + step, end, step):
+            if guess <= boundaries[-1]:
+                continue
+            match = _CHUNK_BOUNDARY_RE.search(self.buffer, guess, end)
+            while match is not None and self._inside_literal(data, boundaries[-1], match.start()):
+                match = _CHUNK_BOUNDARY_RE.search(self.buffer, match.end(), end)
+            if match is None:
+                break
+            boundaries.append(match.end())
+        boundaries.append(end)
+        return [(chunk_start, chunk_end) for chunk_start, chunk_end in zip(boundaries, boundaries[1:])
+                if chunk_end > chunk_start]
+
+    def _inside_literal(self, data, known, position):
+        """Whether position falls in a string or comment, given that `known` does not
+
+        Quotes are counted in bulk up to each comment, which may hide quotes
+        of its own; '' escapes toggle twice and keep the parity.
+        """
+        in_string = False
+        while True:
+            comment = self.buffer.find(b'/*', known, position)
+            stop = position if comment == -1 else comment
+            in_string ^= bool(np.count_nonzero(data[known:stop] == _QUOTE) & 1)
+            if comment == -1:
+                return in_string
+            if in_string:
+                # '/*' is text of the string
+                known = comment + 2
+                continue
+            comment_end = self.buffer.find(b'*/', comment + 2, position)
+            if comment_end == -1:
+                return True
+            known = comment_end + 2
+
+    def read_header(self, sample_count=SAMPLE_COUNT, sample_size=SAMPLE_SIZE):
+        """Read the HEADER section and estimate the DATA instance count from samples
+
+        Only the header and sample_count windows of sample_size bytes are
+        touched, so the cost does not grow with the file size.
+        """
+        buffer = self.buffer
+        size = len(buffer)
+        match = _DATA_SECTION_RE.search(buffer, 0, min(size, HEADER_LIMIT))
+        header_end = match.start() if match else min(size, HEADER_LIMIT)
+        # Keep the ';' ending the DATA keyword so the first instance is counted
+        data_start = match.end() - 1 if match else header_end
+
+        records = {}
+        tokens = _tokenize(buffer[:header_end])
+        position = 0
+        while position < len(tokens):
+            kind, token = tokens[position]
+            if kind == 'keyword' and tokens[position + 1:position + 2] == [('punct', b'(')]:
+                records[token.decode('ascii')], position = _parse_parameters(tokens, position + 2)
+            else:
+                position += 1
+
+        # FILE_DESCRIPTION(description, implementation_level)
+        description = (records.get('FILE_DESCRIPTION') or []) + [None] * 2
+        # FILE_NAME(name, time_stamp, author, organization, preprocessor_version,
+        # originating_system, authorization)
+        file_name = (records.get('FILE_NAME') or []) + [None] * 7
+        # FILE_SCHEMA(schema_identifiers)
+        schemas = (records.get('FILE_SCHEMA') or [[]])[0] or []
+
+        data_size = max(size - data_start, 0)
+        sampled = data_size > sample_count * sample_size
+        if not sampled:
+            estimate = len(_CHUNK_BOUNDARY_RE.findall(buffer, data_start, size))
+        else:
+            step = (data_size - sample_size) // (sample_count - 1)
+            found = sum(len(_CHUNK_BOUNDARY_RE.findall(buffer, data_start + i * step, data_start + i * step + sample_size))
+                        for i in range(sample_count))
+            estimate = int(round(found * data_size / (sample_count * sample_size)))
+
+        return {
+            'file_size': size,
+            'description': description[0] or [],
+            'implementation_level': description[1],
+            'name': file_name[0],
+            'time_stamp': file_name[1],
+            'author': file_name[2] or [],
+            'organization': file_name[3] or [],
+            'preprocessor_version': file_name[4],
+            'originating_system': file_name[5],
+            'authorization': file_name[6],
+            'schemas': list(schemas),
+            'application_protocol': application_protocol(schemas),
+            'data_offset': data_start,
+            'estimated_entities': estimate,
+            'estimate_sampled': sampled
+        }
+
+    def _scan_window(self, start, limit, end):
+        """Vectorized scan of a comment-free window; returns (batch, window_end)"""
+        buffer = self.buffer
+        arr = np.frombuffer(buffer, dtype=np.uint8, count=min(limit + 1, len(buffer)) - start, offset=start)
+        window = arr[:limit - start]
+
+        # A ';' terminates a record only outside string literals, i.e. when an
+        # even number of quotes precede it ('' escapes toggle twice)
+        quotes = np.flatnonzero(window == _QUOTE)
+        ends = np.flatnonzero(window == _SEMICOLON)
+        ends = ends[(np.searchsorted(quotes, ends) & 1) == 0] + 1
+        if not ends.size:
+            return None, (end if limit == end else None)
+        window_end = start + int(ends[-1]) if limit < end else limit
+
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1]
+        offsets = _skip_whitespace(arr, starts)
+        is_entity = arr[offsets] == _HASH
+        offsets = offsets[is_entity]
+        ends = ends[is_entity]
+        if not offsets.size:
+            return None, window_end
+
+        # Head layout: '#' digits '=' TYPE '(' -- anything else is irregular
+        equals = _next_position(np.flatnonzero(window == _EQUALS), offsets)
+        ids, id_lengths = _parse_integers(arr, offsets + 1)
+        regular = (equals == offsets + 1 + id_lengths) & (equals < ends)
+
+        name_starts = _skip_whitespace(arr, np.where(regular, equals + 1, offsets))
+        name_ends = _next_position(np.flatnonzero(window == _LPAREN), name_starts)
+        regular &= (name_ends > name_starts) & (name_ends < ends)
+        regular &= _NAME_CHARS[arr[name_starts]] & _NAME_CHARS[arr[name_ends - 1]]
+        name_lengths = np.where(regular, name_ends - name_starts, 0)
+
+        names = _rows(arr, name_starts, max(int(name_lengths.max()), 1))
+        type_names, type_codes = _intern_names(names, name_lengths)
+
+        offsets = offsets + start
+        lengths = ends + start - offsets
+        irregular = np.flatnonzero(~regular)
+        if irregular.size:
+            # Complex instances, whitespace inside heads and malformed records
+            keep = np.ones(offsets.size, dtype=bool)
+            for row in irregular.tolist():
+                offset = int(offsets[row])
+                entity_id, type_name = self._record_head(offset, int(lengths[row]))
+                if type_name is None:
+                    keep[row] = False
+                    continue
+                if type_name not in type_names:
+                    type_names.append(type_name)
+                ids[row] = entity_id
+                type_codes[row] = type_names.index(type_name)
+            ids, offsets, lengths, type_codes = ids[keep], offsets[keep], lengths[keep], type_codes[keep]
+
+        # References: every '#' outside a string that is not a record's own head
+        hashes = np.flatnonzero(window == _HASH)
+        hashes = hashes[(np.searchsorted(quotes, hashes) & 1) == 0]
+        record_starts = offsets - start
+        owners = np.searchsorted(record_starts, hashes, side='right') - 1
+        clamped = np.maximum(owners, 0)
+        is_reference = (owners >= 0) & (hashes > record_starts[clamped]) & (hashes < record_starts[clamped] + lengths[clamped])
+        hashes, owners = hashes[is_reference], owners[is_reference]
+
+        ref_ids = np.empty(0, dtype=np.int64)
+        if hashes.size:
+            ref_ids, digit_counts = _parse_integers(arr, hashes + 1)
+            ref_ids, owners = ref_ids[digit_counts > 0], owners[digit_counts > 0]
+        ref_counts = np.bincount(owners, minlength=offsets.size)
+
+        batch = RecordBatch(ids, offsets, lengths, type_codes, type_names, ref_counts, ref_ids)
+        return batch, window_end
+
+    def _record_head(self, offset, length):
+        """Decode (entity_id, type_name) of a single record; type_name is None if malformed"""
+        record = self.buffer[offset:offset + length]
+        match = _HEAD_RE.match(record)
+        if match is None:
+            return None, None
+        if match.group(2):
+            return int(match.group(1)), complex_type_name(record)
+        return int(match.group(1)), match.group(3).decode('ascii')
+
+    def _scan_window_exact(self, start, limit, end, stop):
+        """Record-by-record regex scan from start until stop; returns (batch, window_end)"""
+        buffer = self.buffer
+        ids, offsets, lengths, type_codes = [], [], [], []
+        ref_counts, ref_ids = [], []
+        type_names = []
+        codes = {}
+
+        position = start
+        while position < stop:
+            match = _RECORD_RE.match(buffer, position, limit)
+            if match is None:
+                break
+            position = match.end()
+
+            entity_id, complex_marker, type_name = match.groups()
+            if entity_id is None:
+                continue
+
+            offset = match.start(1) - 1
+            if complex_marker:
+                type_name = complex_type_name(buffer[offset:position])
+            else:
+                type_name = type_name.decode('ascii')
+            if type_name not in codes:
+                codes[type_name] = len(type_names)
+                type_names.append(type_name)
+
+            references = record_references(buffer[offset:position])
+            ids.append(int(entity_id))
+            offsets.append(offset)
+            lengths.append(position - offset)
+            type_codes.append(codes[type_name])
+            ref_counts.append(len(references))
+            ref_ids.extend(references)
+
+        if position == start:
+            return None, (end if limit == end else None)
+        # Stopping early (past the comment) or mid-file keeps the exact boundary;
+        # only unterminated trailing bytes at the very end are dropped
+        window_end = position if position >= stop or limit < end else limit
+
+        batch = None
+        if ids:
+            batch = RecordBatch(np.array(ids, dtype=np.int64), np.array(offsets, dtype=np.int64),
+                                np.array(lengths, dtype=np.int64), np.array(type_codes, dtype=np.int32),
+                                type_names, np.array(ref_counts, dtype=np.int64), np.array(ref_ids, dtype=np.int64))
+        return batch, window_end
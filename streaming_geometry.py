@@ -0,0 +1,335 @@
+import struct
+from collections import Counter, defaultdict
+import numpy as np
+from OCC.Core.STEPControl import STEPControl_Reader
+from OCC.Core.IFSelect import IFSelect_RetDone
+from compressed_step import spilled_step_file
+from geometric_properties import GeometricProperties, shape_mesh
+from product_structure import ProductStructureExtractor
+from step_tokenizer import StepTokenizer
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Products in a file above which its geometry is measured part by part
+STREAMING_MIN_PRODUCTS = 500
+# Assembly levels followed down from a root, against cyclic usage links
+MAX_ASSEMBLY_DEPTH = 64
+
+# One triangle of a binary STL file: normal, three corners, attribute bytes
+_STL_TRIANGLE = np.dtype([('normal', '<f4', 3), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+
+def large_assembly(data):
+    """Whether a parse result has more than STREAMING_MIN_PRODUCTS products, so it is handled part by part"""
+    return len(data.get('product_structure', {}).get('products', {})) > STREAMING_MIN_PRODUCTS
+
+
+def part_instances(index, buffer):
+    """Every leaf part of the assembly tree with its placements in the root frame
+
+    Returns (product definition row, part number, list of 4x4 transforms)
+    per leaf part, in row order. A part used n times has n transforms, so
+    it is transferred once and counted n times. Usages without a placement
+    keep the parent frame. Translations are in millimetres, like the part
+    shapes OCC transfers.
+    """
+    extractor = ProductStructureExtractor(index, buffer)
+    definitions = extractor.definitions()
+    children = defaultdict(list)
+    used = set()
+    for usage in extractor.usages(definitions):
+        transform = np.eye(4) if usage['transform'] is None else np.array(usage['transform'], dtype=float)
+        children[usage['parent_row']].append((usage['child_row'], transform))
+        used.add(usage['child_row'])
+
+    instances = defaultdict(list)
+    stack = [(row, np.eye(4), 0) for row in definitions if row not in used]
+    while stack:
+        row, placement, depth = stack.pop()
+        if row not in children:
+            instances[row].append(placement)
+        elif depth >= MAX_ASSEMBLY_DEPTH:
+            logger.warning(f"Assembly deeper than {MAX_ASSEMBLY_DEPTH} levels below #{index.ids[row]}, skipping it")
+        else:
+            for child, transform in children[row]:
+                stack.append((child, placement @ transform, depth + 1))
+    return [(row, definitions[row][0], instances[row]) for row in sorted(instances)]
+
+
+class AssemblyProperties:
+    """Running totals of volume, area, mass distribution and extents over placed parts
+
+    Volumes and areas add up; the center of mass is the volume-weighted
+    mean of the placed part centers, and each part's inertia tensor is
+    rotated into place and moved to the origin with the parallel axis
+    theorem before it is summed. The box is the union of the placed corners
+    of each part's box, so a rotated part makes it a little loose.
+    """
+
+    def __init__(self):
+        self.volume = 0.0
+        self.surface_area = 0.0
+        # Volume-weighted sum of the placed part centers
+        self.first_moment = np.zeros(3)
+        # Inertia tensor about the origin of the root frame
+        self.origin_inertia = np.zeros((3, 3))
+        self.lower = np.full(3, np.inf)
+        self.upper = np.full(3, -np.inf)
+        # Per part: instance count and the volume and area of one instance
+        self.parts = {}
+
+    def add(self, name, properties, transforms):
+        """Add a part measured in its own frame, once per 4x4 placement"""
+        volume = properties.volume
+        center = np.array(properties.center_of_mass, dtype=float)
+        inertia = np.array(properties.inertia, dtype=float)
+        box = properties.bounding_box
+        corners = None
+        if 'min' in box:
+            corners = np.array([[x, y, z] for x in (box['min'][0], box['max'][0])
+                                for y in (box['min'][1], box['max'][1])
+                                for z in (box['min'][2], box['max'][2])])
+
+        for transform in transforms:
+            rotation, translation = transform[:3, :3], transform[:3, 3]
+            placed = rotation @ center + translation
+            self.volume += volume
+            self.surface_area += properties.surface_area
+            self.first_moment += volume * placed
+            self.origin_inertia += (rotation @ inertia @ rotation.T +
+                                    volume * (placed @ placed * np.eye(3) - np.outer(placed, placed)))
+            if corners is not None:
+                placed_corners = corners @ rotation.T + translation
+                self.lower = np.minimum(self.lower, placed_corners.min(axis=0))
+                self.upper = np.maximum(self.upper, placed_corners.max(axis=0))
+
+        # Exporters may reuse a part number for several definitions
+        key, repeat = name, 1
+        while key in self.parts:
+            repeat += 1
+            key = f"{name} ({repeat})"
+        self.parts[key] = {'instances': len(transforms), 'volume': volume, 'surface_area': properties.surface_area}
+
+    def properties(self):
+        """The totals as a GeometricProperties, without an oriented box"""
+        center = self.first_moment / self.volume if self.volume > 0 else np.zeros(3)
+        inertia = self.origin_inertia - self.volume * (center @ center * np.eye(3) - np.outer(center, center))
+        moments, axes = np.linalg.eigh(inertia)
+        bounding_box = None
+        if np.isfinite(self.lower).all():
+            dimensions = (self.upper - self.lower).tolist()
+            bounding_box = {
+                'min': self.lower.tolist(),
+                'max': self.upper.tolist(),
+                'dimensions': dimensions,
+                'volume': dimensions[0] * dimensions[1] * dimensions[2]
+            }
+        return GeometricProperties(
+            volume=self.volume,
+            surface_area=self.surface_area,
+            center_of_mass=center.tolist(),
+            inertia=inertia.tolist(),
+            principal_moments=moments.tolist(),
+            principal_axes=axes.T.tolist(),
+            bounding_box=bounding_box,
+            parts=self.parts
+        )
+
+
+class StreamingGeometry:
+    """Measures a STEP file one part at a time, so peak memory tracks the largest part
+
+    The file is read into an OCC model once, but instead of TransferRoots()
+    each leaf part of the assembly is transferred on its own (TransferOne on
+    its PRODUCT_DEFINITION), measured in its own frame and released before
+    the next one. The totals are accumulated over the part placements taken
+    from the parsed assembly tree. Files without products are streamed one
+    transfer root at a time. Only the property bundle is measured: solids,
+    faces and meshes need the whole shape.
+    """
+
+    def __init__(self, eps=None, level='standard'):
+        # Relative accuracy of the mass property integration (None = OCC default)
+        self.eps = eps
+        # 'quick' measures bounding boxes only
+        self.level = level
+
+    def measure(self, step_file, index=None, part_hashes=None, part_cache=None):
+        """Return the GeometricProperties of a STEP file, or None if it cannot be read
+
+        index is the file's EntityIndex from the parser, if at hand.
+        part_hashes maps part numbers to the hash of their shape (the
+        revision tree's 'products'); with it, a part whose hash is in
+        part_cache, a dict-like of GeometricProperties, is not transferred
+        again, and new part measurements are added to part_cache. The file
+        is not even read by OCC when every part is found there.
+        """
+        index, instances = self._instances(step_file, index)
+
+        # A part number shared by several definitions has no hash of its own
+        uses = Counter(part_number for _, part_number, _ in instances)
+        keys = {}
+        if part_hashes is not None and part_cache is not None:
+            keys = {row: part_hashes[part_number] for row, part_number, _ in instances
+                    if part_number in part_hashes and uses[part_number] == 1}
+        measured = {row: part_cache.get(key) for row, key in keys.items()}
+        measured = {row: properties for row, properties in measured.items() if properties is not None}
+
+        totals = AssemblyProperties()
+        if instances and len(measured) == len(instances):
+            logger.info(f"Reusing the measurements of all {len(instances)} parts of {step_file}")
+        else:
+            reader = self._read(step_file)
+            if reader is None:
+                return None
+            logger.info(f"Measuring {step_file} part by part, {len(measured)} of {len(instances)} parts known")
+            for transfer, number, name, transforms, row in self._parts(reader, index, instances, measured):
+                properties = self._transfer_part(reader, transfer, number, name, self._measure_shape)
+                if properties is None:
+                    continue
+                if row is None:
+                    totals.add(name, properties, transforms)
+                    continue
+                measured[row] = properties
+                if row in keys:
+                    part_cache[keys[row]] = properties
+
+        for row, part_number, transforms in instances:
+            if row in measured:
+                totals.add(part_number, measured[row], transforms)
+        return totals.properties()
+
+    def write_stl(self, step_file, stl_file, index=None, linear_deflection=0.1, angular_deflection=0.5):
+        """Mesh a STEP file one part at a time into a binary STL; returns the triangle count, or None
+
+        Each part is meshed once in its own frame and written once per
+        placement, so the whole shape is never built. None if the file
+        cannot be read.
+        """
+        index, instances = self._instances(step_file, index)
+        reader = self._read(step_file)
+        if reader is None:
+            return None
+
+        def mesh(shape):
+            return shape_mesh(shape, linear_deflection, angular_deflection)
+
+        logger.info(f"Meshing {step_file} part by part")
+        count = 0
+        with open(stl_file, 'wb') as stl:
+            stl.write(b'Binary STL meshed part by part'.ljust(80, b' ') + struct.pack('<I', 0))
+            for transfer, number, name, transforms, _ in self._parts(reader, index, instances):
+                part_mesh = self._transfer_part(reader, transfer, number, name, mesh)
+                if part_mesh is None:
+                    continue
+                vertices, triangles = part_mesh
+                for transform in transforms:
+                    _stl_triangles(vertices @ transform[:3, :3].T + transform[:3, 3], triangles).tofile(stl)
+                    count += len(triangles)
+            # The header holds the triangle count, known only now
+            stl.seek(80)
+            stl.write(struct.pack('<I', count))
+        return count
+
+    def _instances(self, step_file, index):
+        """The file's EntityIndex, built if not given, and its part instances"""
+        with StepTokenizer(step_file) as tokenizer:
+            if index is None:
+                index = tokenizer.build_index()
+            return index, part_instances(index, tokenizer.buffer)
+
+    def _read(self, step_file):
+        """A STEPControl_Reader holding the file's model, or None if it cannot be read"""
+        reader = STEPControl_Reader()
+        with spilled_step_file(step_file) as plain_path:
+            status = reader.ReadFile(plain_path)
+        if status != IFSelect_RetDone:
+            logger.error(f"Failed to read STEP file: {step_file}")
+            return None
+        return reader
+
+    def _parts(self, reader, index, instances, skip=()):
+        """(transfer, number, name, transforms, row) of each part not in skip
+
+        Files without products yield their transfer roots instead, with no row.
+        """
+        if not instances:
+            for number in range(1, reader.NbRootsForTransfer() + 1):
+                yield reader.TransferRoot, number, f"Root {number}", [np.eye(4)], None
+            return
+        numbers = self._model_numbers(reader, index, [row for row, _, _ in instances if row not in skip])
+        for row, part_number, transforms in instances:
+            if row in skip:
+                continue
+            if row not in numbers:
+                logger.warning(f"Product definition #{index.ids[row]} is not in the OCC model, skipping it")
+                continue
+            yield reader.TransferOne, numbers[row], part_number, transforms, row
+
+    def _measure_shape(self, shape):
+        """Properties of one part in its own frame, as deep as the level needs"""
+        if self.level == 'quick':
+            return GeometricProperties.extents(shape)
+        return GeometricProperties.from_shape(shape, self.eps, oriented=False)
+
+    def _transfer_part(self, reader, transfer, number, name, function):
+        """Transfer one entity, apply function to its shape and free the shape; None on failure"""
+        try:
+            if not transfer(number):
+                logger.warning(f"Could not transfer part {name}")
+                return None
+            shape = reader.Shape(reader.NbShapes())
+            return function(shape)
+        except Exception as e:
+            logger.warning(f"Error processing part {name}: {str(e)}")
+            return None
+        finally:
+            shape = None
+            self._release(reader)
+
+    def _release(self, reader):
+        """Drop the transferred shapes and the transfer results that keep them alive"""
+        reader.ClearShapes()
+        try:
+            reader.WS().TransferReader().TransientProcess().Clear()
+        except Exception as e:
+            logger.debug(f"Could not clear the transfer results: {str(e)}")
+
+    def _model_numbers(self, reader, index, rows):
+        """Rank in the OCC model of the entity at each index row"""
+        model = reader.StepModel()
+        count = model.NbEntities()
+        numbers = {}
+        missing = {}
+        for row in rows:
+            entity_id = int(index.ids[row])
+            # Both rank entities in file order, so the row usually gives the rank
+            if row < count and model.IdentLabel(model.Value(row + 1)) == entity_id:
+                numbers[row] = row + 1
+            else:
+                missing[entity_id] = row
+        number = 1
+        while missing and number <= count:
+            row = missing.pop(model.IdentLabel(model.Value(number)), None)
+            if row is not None:
+                numbers[row] = number
+            number += 1
+        return numbers
+
+
+def _stl_triangles(vertices, triangles):
+    """Binary STL records of a mesh, with unit normals from the triangle winding"""
+    corners = vertices[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    records = np.zeros(len(triangles), dtype=_STL_TRIANGLE)
+    records['normal'] = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    records['corners'] = corners
+    return records
+
+
+def measure_streaming(step_file, eps=None, level='standard', index=None):
+    """Measure a STEP file part by part; returns (properties, None, None, None), all None if unreadable"""
+    properties = StreamingGeometry(eps, level).measure(step_file, index)
+    return properties, None, None, None
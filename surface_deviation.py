@@ -0,0 +1,294 @@
+import numpy as np
+from scipy.spatial import cKDTree
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Triangles per BVH leaf
+LEAF_SIZE = 8
+# Query points handled together; bounds the memory of the traversal frontier
+QUERY_CHUNK = 65536
+# Vertices measured per direction; the vertices of larger meshes are measured
+# on an even subset and take the distance of their nearest measured vertex
+MAX_DEVIATION_POINTS = 100000
+_MORTON_BITS = 21
+
+
+def _spread_bits(values):
+    """Insert two zero bits after each of the low 21 bits (for 3D Morton codes)"""
+    values = values.astype(np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def _morton_codes(points, lower, extent):
+    """Morton code of each point within the box [lower, lower + extent]"""
+    scaled = (points - lower) / extent * ((1 << _MORTON_BITS) - 1)
+    cells = np.clip(scaled, 0, (1 << _MORTON_BITS) - 1).astype(np.uint64)
+    return (_spread_bits(cells[:, 0]) << np.uint64(2)) | (_spread_bits(cells[:, 1]) << np.uint64(1)) | \
+        _spread_bits(cells[:, 2])
+
+
+def closest_points_on_triangles(points, a, b, c):
+    """Point of each triangle (a, b, c) closest to the matching point, row by row
+
+    Vectorized closest-point-on-triangle by Voronoi region (Ericson,
+    Real-Time Collision Detection, 5.1.5). Degenerate triangles fall back to
+    the nearest of their vertices.
+    """
+    ab, ac, ap = b - a, c - a, points - a
+    bp, cp = points - b, points - c
+    d1, d2 = np.einsum('ij,ij->i', ab, ap), np.einsum('ij,ij->i', ac, ap)
+    d3, d4 = np.einsum('ij,ij->i', ab, bp), np.einsum('ij,ij->i', ac, bp)
+    d5, d6 = np.einsum('ij,ij->i', ab, cp), np.einsum('ij,ij->i', ac, cp)
+    va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+
+    region_a = (d1 <= 0) & (d2 <= 0)
+    region_b = (d3 >= 0) & (d4 <= d3)
+    region_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+    region_c = (d6 >= 0) & (d5 <= d6)
+    region_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+    region_bc = (va <= 0) & (d4 >= d3) & (d5 >= d6)
+    conditions = [region_a, region_b, region_ab, region_c, region_ac, region_bc]
+
+    # Barycentric (v, w) of the closest point in each region; rows outside a
+    # region may divide by zero there, which np.select then discards
+    with np.errstate(divide='ignore', invalid='ignore'):
+        on_ab = d1 / (d1 - d3)
+        on_ac = d2 / (d2 - d6)
+        on_bc = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        denominator = va + vb + vc
+        zeros, ones = np.zeros_like(d1), np.ones_like(d1)
+        v = np.select(conditions, [zeros, ones, on_ab, zeros, zeros, 1 - on_bc], default=vb / denominator)
+        w = np.select(conditions, [zeros, zeros, zeros, ones, on_ac, on_bc], default=vc / denominator)
+        closest = a + v[:, None] * ab + w[:, None] * ac
+
+    degenerate = ~np.isfinite(closest).all(axis=1)
+    if degenerate.any():
+        corners = np.stack([a[degenerate], b[degenerate], c[degenerate]], axis=1)
+        offsets = np.stack([ap[degenerate], bp[degenerate], cp[degenerate]], axis=1)
+        nearest = np.einsum('ijk,ijk->ij', offsets, offsets).argmin(axis=1)
+        closest[degenerate] = corners[np.arange(len(nearest)), nearest]
+    return closest
+
+
+def point_triangle_distances(points, a, b, c):
+    """Distance from each point to the matching triangle (a, b, c), row by row"""
+    return np.linalg.norm(points - closest_points_on_triangles(points, a, b, c), axis=1)
+
+
+class TriangleBVH:
+    """Bounding volume hierarchy over a triangle mesh for nearest-surface queries
+
+    Triangles are sorted along a Morton curve and grouped into leaves of
+    LEAF_SIZE; the tree is a complete binary tree over the leaves, stored as
+    one array of boxes per level, so building it is a sort and a few
+    reductions. Queries walk the tree for a whole batch of points at once:
+    the triangle with the nearest centroid gives each point an upper bound,
+    then every level prunes the (point, node) pairs whose box is farther
+    than that bound, and only the triangles left in reach are measured.
+    """
+
+    def __init__(self, vertices, triangles, leaf_size=LEAF_SIZE):
+        vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        if not len(triangles):
+            raise ValueError("Mesh has no triangles")
+        self.leaf_size = leaf_size
+
+        corners = vertices[triangles]
+        self.lower = corners.reshape(-1, 3).min(axis=0)
+        self.extent = np.maximum(corners.reshape(-1, 3).max(axis=0) - self.lower, 1e-12)
+        centroids = corners.mean(axis=1)
+        order = np.argsort(_morton_codes(centroids, self.lower, self.extent), kind='stable')
+        self.a, self.b, self.c = (corners[order, i] for i in range(3))
+        # Input index of each sorted triangle
+        self.order = order
+        self.count = len(order)
+        self.centroids = cKDTree(centroids[order])
+
+        # Leaf boxes, padded with empty boxes to a power of two
+        leaves = -(-self.count // leaf_size)
+        padded_leaves = 1 << max(leaves - 1, 0).bit_length()
+        padded = padded_leaves * leaf_size
+        lows = np.full((padded, 3), np.inf)
+        highs = np.full((padded, 3), -np.inf)
+        self.lows = np.minimum(np.minimum(self.a, self.b), self.c)
+        self.highs = np.maximum(np.maximum(self.a, self.b), self.c)
+        lows[:self.count] = self.lows
+        highs[:self.count] = self.highs
+        lows = lows.reshape(padded_leaves, leaf_size, 3).min(axis=1)
+        highs = highs.reshape(padded_leaves, leaf_size, 3).max(axis=1)
+
+        # levels[0] is the root, levels[-1] the leaves
+        self.levels = [(lows, highs)]
+        while len(lows) > 1:
+            lows = lows.reshape(-1, 2, 3).min(axis=1)
+            highs = highs.reshape(-1, 2, 3).max(axis=1)
+            self.levels.insert(0, (lows, highs))
+
+    def distances(self, points, chunk_size=QUERY_CHUNK):
+        """Distance from every point to the nearest point on the mesh surface"""
+        return self._nearest(np.asarray(points, dtype=float).reshape(-1, 3), chunk_size)[0]
+
+    def signed_distances(self, points, chunk_size=QUERY_CHUNK):
+        """Distance to the surface, negative for points behind the nearest triangle
+
+        The sign follows the triangle winding, so with outward-facing
+        triangles points inside the mesh are negative.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        distances, triangles = self._nearest(points, chunk_size)
+        a, b, c = self.a[triangles], self.b[triangles], self.c[triangles]
+        offsets = points - closest_points_on_triangles(points, a, b, c)
+        behind = np.einsum('ij,ij->i', offsets, np.cross(b - a, c - a)) < 0
+        return np.where(behind, -distances, distances)
+
+    def nearest(self, points, chunk_size=QUERY_CHUNK):
+        """Distance from every point to the mesh surface and the index of the nearest triangle"""
+        distances, triangles = self._nearest(np.asarray(points, dtype=float).reshape(-1, 3), chunk_size)
+        return distances, self.order[triangles]
+
+    def _nearest(self, points, chunk_size):
+        """Nearest-surface distances and nearest triangles in sorted order"""
+        # Nearby points visit the same nodes; walking them in Morton order
+        # keeps the gathers of node boxes and triangles cache friendly
+        order = np.argsort(_morton_codes(points, self.lower, self.extent))
+        distances = np.empty(len(points))
+        triangles = np.empty(len(points), dtype=np.int64)
+        for start in range(0, len(points), chunk_size):
+            chunk = order[start:start + chunk_size]
+            distances[chunk], triangles[chunk] = self._query(points[chunk])
+        return distances, triangles
+
+    def _query(self, points):
+        """Nearest-surface distances and (sorted) nearest triangles of one batch of points"""
+        count = len(points)
+
+        # Initial bound: the triangle with the nearest centroid, which for
+        # points on or near the surface is already about exact
+        _, seeds = self.centroids.query(points)
+        best = point_triangle_distances(points, self.a[seeds], self.b[seeds], self.c[seeds])
+
+        # Boxes are compared by squared distance, with some slack for rounding
+        bound = (best * (1 + 1e-9)) ** 2
+        point_rows = np.arange(count)
+        nodes = np.zeros(count, dtype=np.int64)
+        for depth, (lows, highs) in enumerate(self.levels):
+            if depth:
+                # Descend to both children
+                point_rows = np.repeat(point_rows, 2)
+                nodes = (np.repeat(nodes, 2) << 1) | np.tile([0, 1], len(nodes))
+            query = np.take(points, point_rows, axis=0)
+            gaps = np.maximum(np.maximum(np.take(lows, nodes, axis=0) - query,
+                                         query - np.take(highs, nodes, axis=0)), 0)
+            nearest = np.einsum('ij,ij->i', gaps, gaps)
+            keep = nearest <= bound[point_rows]
+            point_rows, nodes = point_rows[keep], nodes[keep]
+
+        # Exact distances only to the leaf triangles whose own box is in reach
+        triangles = (nodes[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+        point_rows = np.repeat(point_rows, self.leaf_size)
+        valid = triangles < self.count
+        triangles, point_rows = triangles[valid], point_rows[valid]
+        query = np.take(points, point_rows, axis=0)
+        gaps = np.maximum(np.maximum(np.take(self.lows, triangles, axis=0) - query,
+                                     query - np.take(self.highs, triangles, axis=0)), 0)
+        keep = np.einsum('ij,ij->i', gaps, gaps) <= bound[point_rows]
+        triangles, point_rows = triangles[keep], point_rows[keep]
+        distances = point_triangle_distances(query[keep], self.a[triangles], self.b[triangles],
+                                             self.c[triangles])
+
+        # Closest candidate of each point, the seed included
+        point_rows = np.concatenate([np.arange(count), point_rows])
+        triangles = np.concatenate([seeds, triangles])
+        distances = np.concatenate([best, distances])
+        order = np.lexsort((distances, point_rows))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = point_rows[order[1:]] != point_rows[order[:-1]]
+        return distances[order[first]], triangles[order[first]]
+
+
+def _statistics(distances):
+    """Max, mean and RMS of a set of distances, and how many there are"""
+    if not distances.size:
+        return {'max': 0.0, 'mean': 0.0, 'rms': 0.0, 'points': 0}
+    distances = np.abs(distances)
+    return {
+        'max': float(distances.max()),
+        'mean': float(distances.mean()),
+        'rms': float(np.sqrt(np.mean(distances ** 2))),
+        'points': int(distances.size)
+    }
+
+
+def _measure_vertices(bvh, vertices, max_points):
+    """Signed distance of every vertex to a mesh, and the distances actually measured
+
+    Meshes list their vertices face by face, so an even stride samples every
+    face in proportion to its vertex count.
+    """
+    if len(vertices) <= max_points:
+        distances = bvh.signed_distances(vertices)
+        return distances, distances
+    sample = np.linspace(0, len(vertices) - 1, max_points).astype(np.int64)
+    measured = bvh.signed_distances(vertices[sample])
+    _, nearest = cKDTree(vertices[sample]).query(vertices)
+    logger.info(f"Measured the deviation of {max_points} of {len(vertices)} vertices")
+    return measured[nearest], measured
+
+
+def surface_deviation(vertices1, triangles1, vertices2, triangles2, bvh1=None, bvh2=None,
+                      max_points=MAX_DEVIATION_POINTS):
+    """Deviation between two triangle meshes, in both directions
+
+    The vertices of each mesh are measured against the other mesh's surface,
+    at most max_points of them per direction: above that, the statistics
+    and the Hausdorff distance come from an even sample and may miss a
+    local peak. A TriangleBVH already built for either mesh can be passed
+    as bvh1/bvh2. Returns the statistics of each direction, the symmetric
+    Hausdorff distance, and the per-vertex signed distances of both meshes
+    as NumPy arrays: positive where a vertex lies outside the other mesh.
+    """
+    vertices1 = np.asarray(vertices1, dtype=float).reshape(-1, 3)
+    vertices2 = np.asarray(vertices2, dtype=float).reshape(-1, 3)
+    distances1, measured1 = _measure_vertices(bvh2 if bvh2 is not None else TriangleBVH(vertices2, triangles2),
+                                              vertices1, max_points)
+    distances2, measured2 = _measure_vertices(bvh1 if bvh1 is not None else TriangleBVH(vertices1, triangles1),
+                                              vertices2, max_points)
+    file1_to_file2 = _statistics(measured1)
+    file2_to_file1 = _statistics(measured2)
+    return {
+        'file1_to_file2': file1_to_file2,
+        'file2_to_file1': file2_to_file1,
+        'hausdorff': max(file1_to_file2['max'], file2_to_file1['max']),
+        'distances1': distances1,
+        'distances2': distances2
+    }
+
+
+def quantize_deviations(distances, scale):
+    """Encode signed distances as bytes for the viewer
+
+    Distances in [-scale, scale] map linearly onto 1..255 with 128 for
+    zero; larger deviations saturate. The viewer decodes a byte q as
+    (q - 128) / 127 * scale.
+    """
+    distances = np.asarray(distances, dtype=float)
+    if scale <= 0:
+        return np.full(distances.shape, 128, dtype=np.uint8)
+    return (np.clip(np.round(distances / scale * 127), -127, 127) + 128).astype(np.uint8)
+
+
+def corner_deviation_buffer(distances, triangles):
+    """Quantized deviation of every triangle corner, in STL vertex order
+
+    An STL file repeats the three corners of each triangle, so the viewer's
+    vertex i is corner i % 3 of triangle i // 3. Returns the bytes and the
+    scale they decode with.
+    """
+    corners = np.asarray(distances, dtype=float)[np.asarray(triangles, dtype=np.int64)].ravel()
+    scale = float(np.abs(corners).max()) if corners.size else 0.0
+    return quantize_deviations(corners, scale).tobytes(), scale
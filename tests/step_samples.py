@@ -0,0 +1,69 @@
+"""Small Part 21 files written by the tests"""
+
+PART21 = """ISO-10303-21;
+HEADER;
+FILE_DESCRIPTION((''),'2;1');
+FILE_NAME('{name}','2024',(''),(''),'','','');
+FILE_SCHEMA(('AP242_MANAGED_MODEL_BASED_3D_ENGINEERING_MIM_LF'));
+ENDSEC;
+DATA;
+{records}
+ENDSEC;
+END-ISO-10303-21;
+"""
+
+# Length unit records, always #30, by name
+LENGTH_UNITS = {
+    'mm': ["#30=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));"],
+    'm': ["#30=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT($,.METRE.));"],
+    'inch': ["#30=(CONVERSION_BASED_UNIT('INCH',#32)LENGTH_UNIT()NAMED_UNIT(#33));",
+             "#31=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));",
+             "#32=LENGTH_MEASURE_WITH_UNIT(LENGTH_MEASURE(25.4),#31);",
+             "#33=DIMENSIONAL_EXPONENTS(1.,0.,0.,0.,0.,0.,0.);"],
+    'furlong': ["#30=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT($,.FURLONG.));"]
+}
+
+
+def write_step(directory, name, records):
+    """Write records into the DATA section of a new file; returns its path"""
+    path = directory / name
+    path.write_text(PART21.format(name=name, records='\n'.join(records)))
+    return str(path)
+
+
+def assembly_records(placements, unit='mm', part='BOLT'):
+    """An assembly ASM using one part once per (x, y, z) placement, in the given length unit"""
+    records = [
+        "#1=APPLICATION_CONTEXT('mechanical design');",
+        "#2=PRODUCT_CONTEXT('',#1,'mechanical');",
+        "#3=PRODUCT_DEFINITION_CONTEXT('part definition',#1,'design');",
+        "#10=PRODUCT('ASM','Assembly','',(#2));",
+        "#11=PRODUCT_DEFINITION_FORMATION('','',#10);",
+        "#12=PRODUCT_DEFINITION('asm','',#11,#3);",
+        f"#20=PRODUCT('{part}','Part','',(#2));",
+        "#21=PRODUCT_DEFINITION_FORMATION('','',#20);",
+        "#22=PRODUCT_DEFINITION('part','',#21,#3);",
+        *LENGTH_UNITS[unit],
+        "#34=(NAMED_UNIT(*)PLANE_ANGLE_UNIT()SI_UNIT($,.RADIAN.));",
+        "#35=(GEOMETRIC_REPRESENTATION_CONTEXT(3)GLOBAL_UNIT_ASSIGNED_CONTEXT((#30,#34))"
+        "REPRESENTATION_CONTEXT('',''));",
+        "#40=CARTESIAN_POINT('',(0.,0.,0.));",
+        "#41=DIRECTION('',(0.,0.,1.));",
+        "#42=DIRECTION('',(1.,0.,0.));",
+        "#43=AXIS2_PLACEMENT_3D('',#40,#41,#42);",
+        "#50=SHAPE_REPRESENTATION('asm',(#43),#35);",
+        "#51=SHAPE_REPRESENTATION('part',(#43),#35);",
+    ]
+    for k, (x, y, z) in enumerate(placements):
+        first = 100 + 10 * k
+        records += [
+            f"#{first}=CARTESIAN_POINT('',({float(x)!r},{float(y)!r},{float(z)!r}));",
+            f"#{first + 1}=AXIS2_PLACEMENT_3D('',#{first},#41,#42);",
+            f"#{first + 2}=NEXT_ASSEMBLY_USAGE_OCCURRENCE('u{k + 1}','','',#12,#22,$);",
+            f"#{first + 3}=PRODUCT_DEFINITION_SHAPE('','',#{first + 2});",
+            f"#{first + 4}=(REPRESENTATION_RELATIONSHIP('','',#51,#50)"
+            f"REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION(#{first + 5})SHAPE_REPRESENTATION_RELATIONSHIP());",
+            f"#{first + 5}=ITEM_DEFINED_TRANSFORMATION('','',#43,#{first + 1});",
+            f"#{first + 6}=CONTEXT_DEPENDENT_SHAPE_REPRESENTATION(#{first + 4},#{first + 3});",
+        ]
+    return records
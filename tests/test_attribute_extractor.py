@@ -0,0 +1,74 @@
+import pytest
+from attribute_extractor import AttributeExtractor
+from step_tokenizer import StepTokenizer
+from step_samples import write_step
+
+
+def attribute_records(body_color=(1.0, 0.0, 0.0), face_color=(0.0, 0.0, 1.0), layer_items=('#20', '#22'),
+                      material='Steel'):
+    """A named solid and one of its faces, each coloured, on a layer, of a part with a material"""
+    def color_chain(first, rgb):
+        return [
+            f"#{first}=COLOUR_RGB('',{rgb[0]!r},{rgb[1]!r},{rgb[2]!r});",
+            f"#{first + 1}=FILL_AREA_STYLE_COLOUR('',#{first});",
+            f"#{first + 2}=FILL_AREA_STYLE('',(#{first + 1}));",
+            f"#{first + 3}=SURFACE_STYLE_FILL_AREA(#{first + 2});",
+            f"#{first + 4}=SURFACE_SIDE_STYLE('',(#{first + 3}));",
+            f"#{first + 5}=SURFACE_STYLE_USAGE(.BOTH.,#{first + 4});",
+            f"#{first + 6}=PRESENTATION_STYLE_ASSIGNMENT((#{first + 5}));",
+        ]
+
+    return [
+        "#1=APPLICATION_CONTEXT('mechanical design');",
+        "#2=PRODUCT_CONTEXT('',#1,'mechanical');",
+        "#3=PRODUCT_DEFINITION_CONTEXT('part definition',#1,'design');",
+        "#10=PRODUCT('P-100','Bracket','',(#2));",
+        "#11=PRODUCT_DEFINITION_FORMATION('B','',#10);",
+        "#12=PRODUCT_DEFINITION('design','',#11,#3);",
+        "#13=PRODUCT_DEFINITION_SHAPE('','',#12);",
+        "#20=MANIFOLD_SOLID_BREP('body',#21);",
+        "#21=CLOSED_SHELL('',(#22));",
+        "#22=ADVANCED_FACE('',(),$,.T.);",
+        *color_chain(30, body_color),
+        "#37=STYLED_ITEM('color',(#36),#20);",
+        *color_chain(40, face_color),
+        "#47=STYLED_ITEM('color',(#46),#22);",
+        f"#50=PRESENTATION_LAYER_ASSIGNMENT('Layer1','',({','.join(layer_items)}));",
+        f"#60=MATERIAL_DESIGNATION('{material}',(#13));",
+    ]
+
+
+def extract(path):
+    with StepTokenizer(path) as tokenizer:
+        return AttributeExtractor(tokenizer.build_index(), tokenizer.buffer).extract()
+
+
+@pytest.fixture
+def original(tmp_path):
+    return extract(write_step(tmp_path, 'original.stp', attribute_records()))
+
+
+def test_attributes(original):
+    assert original['product:P-100'] == {'category': 'product', 'part_number': 'P-100', 'name': 'Bracket',
+                                         'description': '', 'revisions': ['B']}
+    assert original['color:MANIFOLD_SOLID_BREP:body']['color'] == '#ff0000'
+    assert original['colors:ADVANCED_FACE']['counts'] == {'#0000ff': 1}
+    assert original['layer:Layer1']['item_types'] == {'ADVANCED_FACE': 1, 'MANIFOLD_SOLID_BREP': 1}
+    assert original['material:Steel']['applied_to'] == ['P-100']
+
+
+@pytest.mark.parametrize('change, key', [
+    ({'body_color': (0.0, 1.0, 0.0)}, 'color:MANIFOLD_SOLID_BREP:body'),
+    ({'face_color': (1.0, 1.0, 1.0)}, 'colors:ADVANCED_FACE'),
+    ({'layer_items': ('#20',)}, 'layer:Layer1'),
+])
+def test_change_keeps_the_key(tmp_path, original, change, key):
+    changed = extract(write_step(tmp_path, 'changed.stp', attribute_records(**change)))
+    assert changed.keys() == original.keys()
+    assert changed[key] != original[key]
+    assert all(changed[other] == original[other] for other in original if other != key)
+
+
+def test_renamed_material_is_a_new_key(tmp_path, original):
+    changed = extract(write_step(tmp_path, 'changed.stp', attribute_records(material='Aluminium')))
+    assert 'material:Aluminium' in changed and 'material:Steel' not in changed
@@ -0,0 +1,42 @@
+import shutil
+import pytest
+
+pytest.importorskip('OCC.Core.STEPControl')
+
+from batch_comparison import BaselineComparison, rank_results
+from step_samples import write_step, assembly_records
+
+
+def summary_result(name, score, total, hausdorff=0.0):
+    return {'file': name, 'error': None, 'differences': {
+        'summary': {'similarity_score': score, 'total_differences': total, 'identical': None},
+        'geometric': {'deviation': {'hausdorff': hausdorff}}}}
+
+
+def test_rank_orders_by_similarity_with_failures_last():
+    results = [summary_result('far.stp', 60, 40), {'file': 'broken.stp', 'differences': None, 'error': 'bad'},
+               summary_result('near.stp', 95, 5), summary_result('tie.stp', 95, 3)]
+    ranked = rank_results(results)
+    assert [entry['file'] for entry in ranked] == ['tie.stp', 'near.stp', 'far.stp', 'broken.stp']
+    assert [entry['rank'] for entry in ranked] == [1, 2, 3, 4]
+    assert ranked[-1]['error'] == 'bad'
+
+
+def test_candidates_against_one_baseline(tmp_path):
+    baseline = write_step(tmp_path, 'baseline.stp', assembly_records([(0, 0, 0), (50, 0, 0)]))
+    copy = str(tmp_path / 'copy.stp')
+    shutil.copyfile(baseline, copy)
+    renamed = write_step(tmp_path, 'renamed.stp', assembly_records([(0, 0, 0), (50, 0, 0)]))
+    moved = write_step(tmp_path, 'moved.stp', assembly_records([(0, 0, 0), (60, 0, 0)]))
+    missing = str(tmp_path / 'missing.stp')
+
+    results = BaselineComparison(jobs=1, geometry=False).compare(baseline, [moved, copy, missing, renamed])
+    assert [result['file'] for result in results] == [moved, copy, missing, renamed]
+    assert results[1]['differences']['summary']['identical'] == 'byte'
+    # Only the HEADER file name differs, which the entity hashes leave out
+    assert results[3]['differences']['summary']['identical'] == 'semantic'
+    assert results[2]['error']
+    assert results[0]['differences']['structural']['assembly_differences']['value_differences']
+
+    ranked = rank_results(results)
+    assert [entry['file'] for entry in ranked][-2:] == [moved, missing]
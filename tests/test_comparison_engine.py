@@ -0,0 +1,81 @@
+import multiprocessing
+import time
+import pytest
+
+pytest.importorskip('OCC.Core.STEPControl')
+
+import comparison_engine
+from comparison_engine import ComparisonEngine, Comparator, COMPARATORS, register_comparator
+
+DATA = {'header': {'name': 'a.stp'}, 'entities': {'PRODUCT': 1}, 'pmi_data': {},
+        'product_structure': {'products': {}}, 'revision_tree': {}}
+
+
+def header_comparator(budget=5):
+    return Comparator('header', lambda engine, data1, data2, job: engine._compare_headers(data1['header'],
+                                                                                         data2['header']),
+                      inputs=('header',), sections=[('header',)], budget=budget)
+
+
+def sleeper(seconds):
+    def compare(engine, data1, data2, job):
+        time.sleep(seconds)
+        engine.differences['header']['late'] = True
+    return compare
+
+
+def test_overrunning_comparator_is_timed_out():
+    comparators = [header_comparator(), Comparator('slow', sleeper(5), sections=[('header',)], budget=0.2)]
+    start = time.perf_counter()
+    differences = ComparisonEngine(comparators=comparators).compare(DATA, dict(DATA, header={'name': 'b.stp'}))
+    assert time.perf_counter() - start < 2
+    assert differences['comparators']['slow'] == {'status': 'timed_out', 'budget': 0.2}
+    assert differences['comparators']['header']['status'] == 'complete'
+    assert differences['header'] == {'name': {'file1': 'a.stp', 'file2': 'b.stp'}}
+    assert differences['summary']['partial']
+
+
+def test_failing_and_skipped_comparators():
+    def fail(engine, data1, data2, job):
+        raise ValueError('broken')
+    comparators = [Comparator('failing', fail, sections=[('header',)]),
+                   Comparator('deep', sleeper(0), sections=[('header',)], level='precise'),
+                   Comparator('needs_pmi', sleeper(0), inputs=('attributes',), sections=[('header',)])]
+    differences = ComparisonEngine(comparators=comparators).compare(DATA, DATA, level='standard')
+    assert differences['comparators']['failing'] == {'status': 'failed', 'error': 'broken'}
+    assert differences['comparators']['deep'] == {'status': 'skipped', 'reason': 'not run at the standard level'}
+    assert differences['comparators']['needs_pmi'] == {'status': 'skipped', 'reason': 'missing attributes'}
+    assert differences['summary']['partial']
+
+
+def test_register_comparator_replaces_by_name(monkeypatch):
+    monkeypatch.setattr(comparison_engine, 'COMPARATORS', list(COMPARATORS))
+    names = [comparator.name for comparator in comparison_engine.COMPARATORS]
+    register_comparator(header_comparator(budget=1))
+    register_comparator(Comparator('extra', sleeper(0)))
+    assert [comparator.name for comparator in comparison_engine.COMPARATORS] == names + ['extra']
+    assert comparison_engine.COMPARATORS[names.index('header')].budget == 1
+
+
+def slow_measurement(step_file, eps, level='precise', streamed=False, index=None):
+    time.sleep(30)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_overrunning_transfer_is_terminated(monkeypatch, tmp_path):
+    # fork, so the child sees the slow measurement patched in here
+    monkeypatch.setattr(comparison_engine, '_PROCESS_CONTEXT', 'fork')
+    monkeypatch.setattr(comparison_engine, 'measure_step_file', slow_measurement)
+    monkeypatch.setattr(comparison_engine, 'TRANSFER_BUDGET', 0)
+    geometry = next(comparator for comparator in COMPARATORS if comparator.name == 'geometry')
+    comparators = [Comparator('geometry', geometry.function, sections=geometry.sections, geometry=True,
+                              isolated=True, budget=1)]
+    file1, file2 = tmp_path / 'a.stp', tmp_path / 'b.stp'
+    file1.write_text('ISO-10303-21;')
+    file2.write_text('ISO-10303-21;')
+    start = time.perf_counter()
+    differences = ComparisonEngine(comparators=comparators).compare(DATA, DATA, str(file1), str(file2))
+    time.sleep(0.5)
+    assert time.perf_counter() - start < 5
+    assert differences['comparators']['geometry'] == {'status': 'timed_out', 'budget': 1}
+    assert not multiprocessing.active_children()
@@ -0,0 +1,63 @@
+import gzip
+import os
+import zipfile
+import numpy as np
+import pytest
+from compressed_step import compression_of, read_decompressed, spilled_step_file
+from parse_cache import file_sha256
+from step_tokenizer import StepTokenizer
+from step_samples import write_step, assembly_records
+
+
+@pytest.fixture
+def plain(tmp_path):
+    return write_step(tmp_path, 'assembly.stp', assembly_records([(0, 0, 0), (50, 0, 0)]))
+
+
+@pytest.fixture(params=['gzip', 'zip'])
+def compressed(request, tmp_path, plain):
+    """The plain file gzipped, or zipped next to a smaller member"""
+    text = open(plain, 'rb').read()
+    if request.param == 'gzip':
+        path = str(tmp_path / 'assembly.stp.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(text)
+    else:
+        path = str(tmp_path / 'assembly.stpZ')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('readme.txt', 'notes')
+            archive.writestr('assembly.stp', text)
+    return request.param, path
+
+
+def index_of(path):
+    with StepTokenizer(path) as tokenizer:
+        return tokenizer.build_index(), tokenizer.sha256
+
+
+def test_compression_is_told_by_content(plain, compressed):
+    kind, path = compressed
+    assert compression_of(plain) is None
+    assert compression_of(path) == kind
+
+
+def test_decompressed_text_and_hash(plain, compressed):
+    buffer, sha256 = read_decompressed(compressed[1])
+    assert bytes(buffer) == open(plain, 'rb').read()
+    assert sha256 == file_sha256(plain) == file_sha256(compressed[1])
+
+
+def test_index_matches_the_plain_file(plain, compressed):
+    index, sha256 = index_of(compressed[1])
+    plain_index, _ = index_of(plain)
+    assert sha256 == file_sha256(plain)
+    for name, array in plain_index.to_arrays().items():
+        assert np.array_equal(index.to_arrays()[name], array)
+
+
+def test_spilled_copy_is_removed(plain, compressed):
+    with spilled_step_file(plain) as path:
+        assert path == plain
+    with spilled_step_file(compressed[1]) as path:
+        assert open(path, 'rb').read() == open(plain, 'rb').read()
+    assert not os.path.exists(path)
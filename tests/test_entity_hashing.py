@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from entity_hashing import entity_hashes, minhash_signature, same_entities
+from step_tokenizer import StepTokenizer
+
+LOOP = """ISO-10303-21;
+HEADER;
+FILE_DESCRIPTION((''),'2;1');
+FILE_NAME('loop','2024',(''),(''),'','','');
+FILE_SCHEMA(('AP242'));
+ENDSEC;
+DATA;
+{records}
+ENDSEC;
+END-ISO-10303-21;
+"""
+
+
+def write_step(directory, name, records):
+    path = directory / name
+    path.write_text(LOOP.format(records='\n'.join(records)))
+    return str(path)
+
+
+def sorted_hashes(path):
+    with StepTokenizer(path) as tokenizer:
+        index = tokenizer.build_index()
+        return np.sort(entity_hashes(index, tokenizer.buffer))
+
+
+def loop_records(first=1, order=(0, 1, 2)):
+    points = [f"#{first + i}=CARTESIAN_POINT('',({x}.,{y}.,0.));"
+              for i, (x, y) in enumerate([(0, 0), (1, 0), (0, 1)])]
+    references = ','.join(f"#{first + i}" for i in order)
+    return points + [f"#{first + 3}=POLY_LOOP('',({references}));"]
+
+
+@pytest.fixture
+def original(tmp_path):
+    return sorted_hashes(write_step(tmp_path, 'original.stp', loop_records()))
+
+
+def test_renumbered_loop_hashes_equal(tmp_path, original):
+    renumbered = write_step(tmp_path, 'renumbered.stp', loop_records(first=101))
+    assert np.array_equal(original, sorted_hashes(renumbered))
+
+
+def test_reordered_records_hash_equal(tmp_path, original):
+    records = loop_records()
+    reordered = write_step(tmp_path, 'reordered.stp', records[:3][::-1] + records[3:])
+    assert np.array_equal(original, sorted_hashes(reordered))
+
+
+def test_reversed_loop_is_a_change(tmp_path, original):
+    reversed_loop = write_step(tmp_path, 'reversed.stp', loop_records(order=(2, 1, 0)))
+    assert not np.array_equal(original, sorted_hashes(reversed_loop))
+
+
+def test_rotated_loop_is_a_change(tmp_path, original):
+    rotated = write_step(tmp_path, 'rotated.stp', loop_records(order=(1, 2, 0)))
+    assert not np.array_equal(original, sorted_hashes(rotated))
+
+
+def test_references_in_other_slots_keep_their_position(tmp_path):
+    records = ["#1=CARTESIAN_POINT('',(0.,0.,0.));", "#2=DIRECTION('',(0.,0.,1.));",
+               "#3=DIRECTION('',(1.,0.,0.));"]
+    placement = write_step(tmp_path, 'placement.stp', records + ["#4=AXIS2_PLACEMENT_3D('',#1,#2,#3);"])
+    swapped = write_step(tmp_path, 'swapped.stp', records + ["#4=AXIS2_PLACEMENT_3D('',#1,#3,#2);"])
+    assert not np.array_equal(sorted_hashes(placement), sorted_hashes(swapped))
+
+
+def test_reordered_list_is_not_the_same_model(tmp_path):
+    original = sorted_hashes(write_step(tmp_path, 'original.stp', loop_records()))
+    renumbered = sorted_hashes(write_step(tmp_path, 'renumbered.stp', loop_records(first=101)))
+    reordered = sorted_hashes(write_step(tmp_path, 'reordered.stp', loop_records(order=(0, 2, 1))))
+    assert same_entities(original, renumbered)
+    assert not same_entities(original, reordered)
+
+
+def test_minhash_signature_estimates_jaccard_similarity():
+    hashes = np.arange(1, 20001, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    signature = minhash_signature(hashes)
+    assert np.array_equal(signature, minhash_signature(np.concatenate([hashes[::-1], hashes[:500]])))
+    # Half of the hashes shared: Jaccard similarity 1/3
+    other = minhash_signature(np.concatenate([hashes[:10000], hashes[:10000] + np.uint64(1)]))
+    assert abs(np.mean(signature == other) - 1 / 3) < 0.15
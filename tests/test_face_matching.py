@@ -0,0 +1,63 @@
+import numpy as np
+from face_matching import FACE_SIGNATURE_FIELDS, SURFACE_TYPES, match_faces
+
+PLANE, CYLINDER = SURFACE_TYPES.index('PLANE'), SURFACE_TYPES.index('CYLINDER')
+
+
+def face(surface_type, area, centroid, normal, lower, upper):
+    return [surface_type, area, *centroid, *normal, *lower, *upper]
+
+
+def box_faces(height=10.0):
+    """The six planar faces of a 10 x 10 x height box at the origin"""
+    top, side = 100.0, 10.0 * height
+    return np.array([
+        face(PLANE, top, (5, 5, 0), (0, 0, -1), (0, 0, 0), (10, 10, 0)),
+        face(PLANE, top, (5, 5, height), (0, 0, 1), (0, 0, height), (10, 10, height)),
+        face(PLANE, side, (5, 0, height / 2), (0, -1, 0), (0, 0, 0), (10, 0, height)),
+        face(PLANE, side, (5, 10, height / 2), (0, 1, 0), (0, 10, 0), (10, 10, height)),
+        face(PLANE, side, (0, 5, height / 2), (-1, 0, 0), (0, 0, 0), (0, 10, height)),
+        face(PLANE, side, (10, 5, height / 2), (1, 0, 0), (10, 0, 0), (10, 10, height)),
+    ])
+
+
+def hole(x=5.0, y=5.0, height=10.0):
+    return face(CYLINDER, 2 * np.pi * height, (x, y, height / 2), (0, 0, 0), (x - 1, y - 1, 0),
+                (x + 1, y + 1, height))
+
+
+def test_signature_columns():
+    assert len(hole()) == len(FACE_SIGNATURE_FIELDS)
+
+
+def test_reordered_faces_within_tolerance_are_unchanged():
+    faces1 = np.vstack([box_faces(), [hole()]])
+    faces2 = faces1[::-1] + np.where(np.arange(faces1.shape[1]) > 0, 1e-4, 0)
+    result = match_faces(faces1, faces2)
+    assert result['unchanged'] == len(faces1)
+    assert not result['removed'] and not result['added'] and not result['modified']
+
+
+def test_raised_top_face_is_modified():
+    result = match_faces(box_faces(), box_faces(height=10.5))
+    modified = {entry['face1']: entry for entry in result['modified']}
+    assert modified[1]['face2'] == 1
+    assert modified[1]['changed'] == ['bounding_box', 'centroid']
+    assert modified[1]['file1']['surface_type'] == 'PLANE'
+    assert not result['removed'] and not result['added']
+
+
+def test_filled_and_drilled_holes():
+    result = match_faces(np.vstack([box_faces(), [hole()]]), np.vstack([box_faces(), [hole(x=2.0, y=2.0)]]))
+    assert result['unchanged'] == 6
+    # 4 mm is beyond the search radius of this small box, so the hole is not a move
+    assert [entry['face1'] for entry in result['removed']] == [6]
+    assert [entry['face2'] for entry in result['added']] == [6]
+
+
+def test_changed_surface_type_is_not_a_match():
+    faces2 = box_faces()
+    faces2[0, 0] = SURFACE_TYPES.index('BSPLINE_SURFACE')
+    result = match_faces(box_faces(), faces2)
+    assert result['removed'][0]['file1']['surface_type'] == 'PLANE'
+    assert result['added'][0]['file2']['surface_type'] == 'BSPLINE_SURFACE'
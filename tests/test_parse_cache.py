@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from entity_hashing import entity_hashes
+from parse_cache import ParseCache
+from product_structure import ProductStructureExtractor
+from step_tokenizer import StepTokenizer
+from step_samples import write_step, assembly_records
+
+
+@pytest.fixture
+def assembly(tmp_path):
+    return write_step(tmp_path, 'assembly.stp', assembly_records([(0, 0, 0), (50, 0, 0)], 'inch'))
+
+
+def result_of(path):
+    with StepTokenizer(path) as tokenizer:
+        index = tokenizer.build_index()
+        return {
+            'header': tokenizer.read_header(),
+            'entities': index.type_counts(),
+            'relationships': index.edge_type_counts(),
+            'product_structure': ProductStructureExtractor(index, tokenizer.buffer).extract(),
+            'entity_hashes': entity_hashes(index, tokenizer.buffer),
+            'index': index
+        }
+
+
+def test_round_trip(tmp_path, assembly):
+    fresh = result_of(assembly)
+    cache = ParseCache(str(tmp_path / 'cache'))
+    cache.store('abc', 1, fresh)
+    cached = cache.load('abc', 1)
+
+    assert cached.keys() == fresh.keys()
+    for key in ('header', 'entities', 'relationships', 'product_structure'):
+        assert cached[key] == fresh[key]
+    assert np.array_equal(cached['entity_hashes'], fresh['entity_hashes'])
+    for name, array in fresh['index'].to_arrays().items():
+        assert np.array_equal(cached['index'].to_arrays()[name], array)
+    assert cached['index'].edge_type_counts() == fresh['index'].edge_type_counts()
+
+
+def test_other_version_or_broken_entry_is_a_miss(tmp_path, assembly):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    cache.store('abc', 1, result_of(assembly))
+    assert cache.load('abc', 2) is None
+    assert cache.load('missing', 1) is None
+
+    with open(cache._path('abc', 1), 'wb') as f:
+        f.write(b'not an archive')
+    assert cache.load('abc', 1) is None
+
+
+def test_parser_result_is_the_same_from_the_cache(tmp_path, assembly):
+    pytest.importorskip('OCC.Core.STEPControl')
+    from step_parser import StepParser
+
+    cache = ParseCache(str(tmp_path / 'cache'))
+    fresh = StepParser(cache=cache).parse(assembly)
+    cached = StepParser(cache=cache).parse(assembly)
+    assert cached is not fresh and cached.keys() == fresh.keys()
+    for key in ('header', 'entities', 'relationships', 'pmi_data', 'attributes', 'product_structure',
+                'revision_tree'):
+        assert cached[key] == fresh[key]
+    assert np.array_equal(cached['entity_hashes'], fresh['entity_hashes'])
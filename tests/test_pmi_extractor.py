@@ -0,0 +1,65 @@
+import pytest
+from pmi_extractor import PmiExtractor
+from step_tokenizer import StepTokenizer
+from step_samples import write_step
+
+
+def pmi_records(flatness=0.05, diameter=10.0, upper=0.1, first=1):
+    """A flatness tolerance against datum A and a toleranced diameter, numbered from first"""
+    n = {name: f"#{first + i}" for i, name in enumerate(
+        ['mm', 'definition', 'face', 'hole', 'magnitude', 'flatness', 'datum', 'size', 'nominal',
+         'context', 'representation', 'characteristic', 'lower', 'upper', 'range', 'plus_minus'])}
+    return [
+        f"{n['mm']}=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));",
+        f"{n['definition']}=PRODUCT_DEFINITION_SHAPE('','',$);",
+        f"{n['face']}=SHAPE_ASPECT('top face','',{n['definition']},.T.);",
+        f"{n['hole']}=SHAPE_ASPECT('bore','',{n['definition']},.T.);",
+        f"{n['magnitude']}=LENGTH_MEASURE_WITH_UNIT(LENGTH_MEASURE({flatness!r}),{n['mm']});",
+        f"{n['flatness']}=FLATNESS_TOLERANCE('flat1','',{n['magnitude']},{n['face']});",
+        f"{n['datum']}=DATUM('A','',{n['definition']},.F.,'A');",
+        f"{n['size']}=DIMENSIONAL_SIZE({n['hole']},'diameter');",
+        f"{n['nominal']}=(LENGTH_MEASURE_WITH_UNIT()MEASURE_REPRESENTATION_ITEM()"
+        f"MEASURE_WITH_UNIT(LENGTH_MEASURE({diameter!r}),{n['mm']})REPRESENTATION_ITEM('nominal value'));",
+        f"{n['context']}=REPRESENTATION_CONTEXT('','');",
+        f"{n['representation']}=SHAPE_DIMENSION_REPRESENTATION('',({n['nominal']}),{n['context']});",
+        f"{n['characteristic']}=DIMENSIONAL_CHARACTERISTIC_REPRESENTATION({n['size']},{n['representation']});",
+        f"{n['lower']}=LENGTH_MEASURE_WITH_UNIT(LENGTH_MEASURE(-0.1),{n['mm']});",
+        f"{n['upper']}=LENGTH_MEASURE_WITH_UNIT(LENGTH_MEASURE({upper!r}),{n['mm']});",
+        f"{n['range']}=TOLERANCE_VALUE({n['lower']},{n['upper']});",
+        f"{n['plus_minus']}=PLUS_MINUS_TOLERANCE({n['range']},{n['size']});",
+    ]
+
+
+def extract(path):
+    with StepTokenizer(path) as tokenizer:
+        return PmiExtractor(tokenizer.build_index(), tokenizer.buffer).extract()
+
+
+@pytest.fixture
+def original(tmp_path):
+    return extract(write_step(tmp_path, 'original.stp', pmi_records()))
+
+
+def test_tolerance_datum_and_dimension(original):
+    flatness = original['tolerance:FLATNESS_TOLERANCE:flat1:top face']
+    assert flatness['value'] == 0.05 and flatness['unit'] == 'MILLIMETRE'
+    assert original['datum:A']['label'] == 'A'
+    diameter = original['dimension:DIMENSIONAL_SIZE:diameter:bore']
+    assert diameter['value'] == 10.0
+    assert diameter['tolerance'] == {'lower': -0.1, 'upper': 0.1}
+
+
+def test_keys_survive_renumbering(tmp_path, original):
+    assert extract(write_step(tmp_path, 'renumbered.stp', pmi_records(first=501))) == original
+
+
+@pytest.mark.parametrize('change, key, field', [
+    ({'flatness': 0.1}, 'tolerance:FLATNESS_TOLERANCE:flat1:top face', 'value'),
+    ({'diameter': 12.0}, 'dimension:DIMENSIONAL_SIZE:diameter:bore', 'value'),
+    ({'upper': 0.2}, 'dimension:DIMENSIONAL_SIZE:diameter:bore', 'tolerance'),
+])
+def test_value_change_keeps_the_key(tmp_path, original, change, key, field):
+    changed = extract(write_step(tmp_path, 'changed.stp', pmi_records(**change)))
+    assert changed.keys() == original.keys()
+    assert changed[key][field] != original[key][field]
+    assert all(changed[other] == original[other] for other in original if other != key)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from product_structure import ProductStructureExtractor
+from step_tokenizer import StepTokenizer
+from step_samples import write_step, assembly_records
+
+
+def extract(path):
+    with StepTokenizer(path) as tokenizer:
+        return ProductStructureExtractor(tokenizer.build_index(), tokenizer.buffer).extract()
+
+
+def translations(structure):
+    return {occurrence['id']: np.array(occurrence['transform'])[:3, 3].tolist()
+            for occurrence in structure['occurrences'].values()}
+
+
+@pytest.mark.parametrize('unit, placement', [('mm', (10, 20, 30)), ('m', (0.01, 0.02, 0.03)),
+                                             ('inch', (10 / 25.4, 20 / 25.4, 30 / 25.4))])
+def test_placements_are_in_millimetres(tmp_path, unit, placement):
+    structure = extract(write_step(tmp_path, f'{unit}.stp', assembly_records([placement], unit)))
+    assert np.allclose(translations(structure)['u1'], [10, 20, 30])
+    assert structure['unscaled_placements'] == 0
+
+
+def test_unknown_unit_is_counted(tmp_path):
+    structure = extract(write_step(tmp_path, 'odd.stp', assembly_records([(1, 2, 3)], 'furlong')))
+    assert translations(structure)['u1'] == [1, 2, 3]
+    assert structure['unscaled_placements'] == 1
+
+
+def test_products_roots_and_occurrences(tmp_path):
+    structure = extract(write_step(tmp_path, 'assembly.stp', assembly_records([(0, 0, 0), (50, 0, 0)])))
+    assert structure['products'] == {'ASM': {'name': 'Assembly', 'definitions': ['asm']},
+                                     'BOLT': {'name': 'Part', 'definitions': ['part']}}
+    assert structure['roots'] == ['ASM']
+    assert sorted(structure['occurrences']) == ['ASM/BOLT:u1', 'ASM/BOLT:u2']
+    assert translations(structure) == {'u1': [0, 0, 0], 'u2': [50, 0, 0]}
+
+
+def test_moved_occurrence_changes_only_its_transform(tmp_path):
+    original = extract(write_step(tmp_path, 'original.stp', assembly_records([(0, 0, 0), (50, 0, 0)])))
+    moved = extract(write_step(tmp_path, 'moved.stp', assembly_records([(0, 0, 0), (50, 5, 0)])))
+    assert moved['occurrences'].keys() == original['occurrences'].keys()
+    assert moved['occurrences']['ASM/BOLT:u1'] == original['occurrences']['ASM/BOLT:u1']
+    assert moved['occurrences']['ASM/BOLT:u2']['transform'] != original['occurrences']['ASM/BOLT:u2']['transform']
+
+
+def test_added_occurrence_is_a_new_key(tmp_path):
+    original = extract(write_step(tmp_path, 'original.stp', assembly_records([(0, 0, 0)])))
+    added = extract(write_step(tmp_path, 'added.stp', assembly_records([(0, 0, 0), (0, 0, 20)])))
+    assert set(added['occurrences']) - set(original['occurrences']) == {'ASM/BOLT:u2'}
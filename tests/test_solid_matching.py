@@ -0,0 +1,51 @@
+import numpy as np
+from solid_matching import FINGERPRINT_FIELDS, match_solids
+
+
+def cube(x, y, z, side=10.0):
+    """Fingerprint of a solid cube centred at (x, y, z)"""
+    moment = side ** 5 / 6
+    return [side ** 3, 6 * side ** 2, x, y, z, moment, moment, moment, side, side, side]
+
+
+def grid(count=5, side=10.0):
+    return np.array([cube(40.0 * i, 40.0 * j, 0.0, side) for i in range(count) for j in range(count)])
+
+
+def test_fingerprint_columns():
+    assert len(cube(0, 0, 0)) == len(FINGERPRINT_FIELDS)
+
+
+def test_reordered_solids_are_unchanged():
+    solids = grid()
+    result = match_solids(solids, solids[np.random.default_rng(0).permutation(len(solids))])
+    assert result['unchanged'] == len(solids)
+    assert not result['removed'] and not result['added'] and not result['modified']
+
+
+def test_moved_and_grown_solids_are_modified():
+    solids1 = grid()
+    solids2 = solids1.copy()
+    solids2[3] = cube(solids1[3, 2] + 5, solids1[3, 3], 0.0)
+    solids2[7] = cube(solids1[7, 2], solids1[7, 3], 0.0, side=10.5)
+    result = match_solids(solids1, solids2)
+
+    modified = {(entry['solid1'], entry['solid2']): entry['changed'] for entry in result['modified']}
+    assert modified[(3, 3)] == ['center_of_mass']
+    assert set(modified[(7, 7)]) == {'volume', 'surface_area', 'principal_moments', 'bounding_box'}
+    assert result['unchanged'] == len(solids1) - 2
+    assert not result['removed'] and not result['added']
+
+
+def test_replaced_solid_is_removed_and_added():
+    solids1 = grid()
+    solids2 = np.vstack([np.delete(solids1, 12, axis=0), [cube(500.0, 500.0, 500.0, side=2.0)]])
+    result = match_solids(solids1, solids2)
+    assert [entry['solid1'] for entry in result['removed']] == [12]
+    assert [entry['solid2'] for entry in result['added']] == [len(solids2) - 1]
+    assert result['unchanged'] == len(solids1) - 1
+
+
+def test_empty_side():
+    result = match_solids(grid(2), np.zeros((0, len(FINGERPRINT_FIELDS))))
+    assert len(result['removed']) == 4 and result['unchanged'] == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from step_tokenizer import StepTokenizer, EntityIndex
+
+ENTITIES = 20000
+
+
+@pytest.fixture
+def tricky_file(tmp_path):
+    """Every record holds a string that looks like a record boundary; a comment hides a quote"""
+    records = [f"#{i}=PRODUCT('part;#12=copy','it''s;#{i}= here','',(#{max(i - 1, 1)}));"
+               for i in range(1, ENTITIES + 1)]
+    records.insert(ENTITIES // 3, "/* don't split here;#7=X(); */")
+    path = tmp_path / 'tricky.stp'
+    path.write_text("ISO-10303-21;\nHEADER;\nFILE_DESCRIPTION((''),'2;1');\nENDSEC;\nDATA;\n" +
+                    '\n'.join(records) + "\nENDSEC;\nEND-ISO-10303-21;\n")
+    return str(path)
+
+
+@pytest.mark.parametrize('parts', [3, 64, 997])
+def test_split_ranges_do_not_cut_strings(tricky_file, parts):
+    with StepTokenizer(tricky_file) as tokenizer:
+        serial = tokenizer.build_index()
+        ranges = tokenizer.split_ranges(0, len(tokenizer.buffer), parts)
+        chunked = EntityIndex.from_batches([batch for start, end in ranges
+                                            for batch in tokenizer.iter_batches(start, end)])
+        size = len(tokenizer.buffer)
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == size
+    assert all(previous[1] == following[0] for previous, following in zip(ranges, ranges[1:]))
+    assert len(serial) == ENTITIES
+    assert np.array_equal(chunked.ids, serial.ids)
+    assert np.array_equal(chunked.offsets, serial.offsets)
+    assert np.array_equal(chunked.lengths, serial.lengths)
+
+
+def test_header_estimate_counts_records_after_comments(tmp_path):
+    records = [f"#{i}=CARTESIAN_POINT('',(0.,0.,{i}.));/* point {i} */" for i in range(1, 101)]
+    records += ["/* a block */ #101=DIRECTION('',(0.,0.,1.));", "#102=DIRECTION('',(1.,0.,0.)); /* end */"]
+    path = tmp_path / 'commented.stp'
+    path.write_text("ISO-10303-21;\nHEADER;\nFILE_NAME('commented','2024',(''),(''),'','','');\nENDSEC;\n"
+                    "DATA;\n" + '\n'.join(records) + "\nENDSEC;\nEND-ISO-10303-21;\n")
+    with StepTokenizer(str(path)) as tokenizer:
+        header = tokenizer.read_header()
+        assert len(tokenizer.build_index()) == 102
+    assert not header['estimate_sampled']
+    assert header['estimated_entities'] == 102
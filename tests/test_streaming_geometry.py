@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('OCC.Core.STEPControl')
+
+from geometric_properties import GeometricProperties
+from step_tokenizer import StepTokenizer
+from streaming_geometry import part_instances, AssemblyProperties
+from step_samples import write_step, assembly_records
+
+
+def instances(path):
+    with StepTokenizer(path) as tokenizer:
+        return part_instances(tokenizer.build_index(), tokenizer.buffer)
+
+
+def test_metre_assembly_sums_in_millimetres(tmp_path):
+    path = write_step(tmp_path, 'metres.stp', assembly_records([(0, 0, 0), (0.1, 0, 0)], 'm'))
+    (_, part_number, transforms), = instances(path)
+    assert part_number == 'BOLT'
+
+    # A 10 mm cube measured by OCC in its own frame, in millimetres
+    cube = GeometricProperties(volume=1000.0, surface_area=600.0, center_of_mass=[5.0, 5.0, 5.0],
+                               inertia=(np.eye(3) * 1000.0 * 200.0 / 12).tolist(),
+                               bounding_box={'min': [0, 0, 0], 'max': [10, 10, 10],
+                                             'dimensions': [10, 10, 10], 'volume': 1000})
+    totals = AssemblyProperties()
+    totals.add(part_number, cube, transforms)
+    properties = totals.properties()
+
+    assert np.allclose(properties.center_of_mass, [55, 5, 5])
+    assert np.allclose(properties.bounding_box['dimensions'], [110, 10, 10])
+    assert properties.parts['BOLT']['instances'] == 2
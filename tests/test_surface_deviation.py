@@ -0,0 +1,31 @@
+import numpy as np
+from surface_deviation import TriangleBVH, point_triangle_distances, surface_deviation
+
+
+def grid(size, height=0.0):
+    """A size x size square of the plane z = height, split into triangles"""
+    u, v = np.meshgrid(np.arange(size + 1.0), np.arange(size + 1.0), indexing='ij')
+    vertices = np.stack([u.ravel(), v.ravel(), np.full(u.size, height)], axis=1)
+    index = np.arange(vertices.shape[0]).reshape(size + 1, size + 1)
+    a, b, c, d = index[:-1, :-1], index[1:, :-1], index[1:, 1:], index[:-1, 1:]
+    triangles = np.concatenate([np.stack([a, b, c], -1).reshape(-1, 3), np.stack([a, c, d], -1).reshape(-1, 3)])
+    return vertices, triangles
+
+
+def test_bvh_matches_brute_force():
+    vertices, triangles = grid(12)
+    points = np.random.default_rng(0).uniform(-2, 14, size=(200, 3))
+    a, b, c = (vertices[triangles[:, i]] for i in range(3))
+    expected = np.array([point_triangle_distances(np.repeat(point[None], len(triangles), axis=0), a, b, c).min()
+                         for point in points])
+    assert np.allclose(TriangleBVH(vertices, triangles).distances(points), expected)
+
+
+def test_large_meshes_are_measured_on_a_sample():
+    vertices1, triangles1 = grid(30)
+    vertices2, triangles2 = grid(30, height=0.5)
+    deviation = surface_deviation(vertices1, triangles1, vertices2, triangles2, max_points=100)
+    assert deviation['file1_to_file2']['points'] == 100
+    assert deviation['distances1'].shape == (len(vertices1),)
+    assert np.allclose(deviation['distances2'], 0.5)
+    assert np.isclose(deviation['hausdorff'], 0.5)
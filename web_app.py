@@ -4,14 +4,19 @@ import tempfile
 import uuid
 import logging
 import subprocess
-import hashlib
 import time
 import threading
 from functools import lru_cache
 from werkzeug.middleware.proxy_fix import ProxyFix
 from step_parser import StepParser
-from comparison_engine import ComparisonEngine
+from comparison_engine import ComparisonEngine, COMPARISON_LEVELS
 from report_generator import ReportGenerator
+from parse_cache import ParseCache, file_sha256
+from compressed_step import COMPRESSED_EXTENSIONS
+from shape_provider import shape_provider
+from streaming_geometry import StreamingGeometry, large_assembly
+from surface_deviation import corner_deviation_buffer
+from similarity_index import SimilarityIndex, INDEX_FILE_NAME
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -38,15 +43,23 @@ file_storage = {}
 comparison_cache = {}
 # Dictionary to store background processing tasks
 background_tasks = {}
+# Parse results persisted across jobs and restarts, shared with the CLI
+parse_cache = ParseCache(os.path.join(CACHE_FOLDER, 'parse'))
+# Every parsed file, for "closest earlier revision" lookups; shared with the CLI
+similarity_index = SimilarityIndex(os.path.join(parse_cache.cache_dir, INDEX_FILE_NAME))
+
+# Plain Part 21 files and their gzip/zip-compressed variants
+ALLOWED_EXTENSIONS = ('.stp', '.step', '.p21') + COMPRESSED_EXTENSIONS
+
+def allowed_file(filename):
+    """Check whether an uploaded file has a supported STEP extension"""
+    return filename.lower().endswith(ALLOWED_EXTENSIONS)
 
 # Calculate file hash for caching
 def calculate_file_hash(file_path):
     """Calculate SHA-256 hash of a file for caching purposes"""
-    hash_sha256 = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+    # Same digest the parse cache is keyed by
+    return file_sha256(file_path)
 
 # Cache decorator for expensive operations
 @lru_cache(maxsize=32)
@@ -69,87 +82,59 @@ def process_files_in_background(file1_path, file2_path, file1_id, file2_id, task
         file1_hash = calculate_file_hash(file1_path)
         file2_hash = calculate_file_hash(file2_path)
         
+        # Check comparison cache; each level of the same pair is its own entry
+        level = background_tasks[task_id]['level']
+        cache_key = f"{file1_hash}_{file2_hash}_{level}"
+        result = comparison_cache.get(cache_key)
+        data1 = data2 = None
+        if result is not None:
+            logger.info(f"Using cached comparison for {cache_key}")
+            identity = result['differences']['summary'].get('identical')
+        else:
+            # Identity is known from the hashes and the parse, before any shape is transferred
+            data1, data2, identity = parse_files(file1_path, file2_path, file1_hash, file2_hash, task_id)
+        
         # Check STL cache
         cached_stl1 = get_cached_stl(file1_hash)
-        cached_stl2 = get_cached_stl(file2_hash)
         
-        # Convert STEP files to STL for visualization
+        # Convert STEP files to STL for visualization, before the comparison,
+        # so it measures the shapes the meshing transferred
         if cached_stl1:
             # Use cached STL
             file_storage[file1_id]['stl'] = cached_stl1
         else:
             # Convert and cache
             stl_path = file_storage[file1_id]['stl']
-            if not convert_step_to_stl(file1_path, stl_path):
-                convert_step_to_stl(file1_path, stl_path)
+            if not convert_step_to_stl(file1_path, stl_path, file1_hash, data1):
+                convert_step_to_stl(file1_path, stl_path, file1_hash, data1)
             # Cache the result
             cache_path = os.path.join(app.config['CACHE_FOLDER'], f"{file1_hash}.stl")
             if os.path.exists(stl_path):
                 with open(stl_path, 'rb') as src, open(cache_path, 'wb') as dst:
                     dst.write(src.read())
         
-        if cached_stl2:
+        if identity:
+            # Same model, same triangulation: show file 1's mesh on both sides
+            file_storage[file2_id]['stl'] = file_storage[file1_id]['stl']
+        elif get_cached_stl(file2_hash):
             # Use cached STL
-            file_storage[file2_id]['stl'] = cached_stl2
+            file_storage[file2_id]['stl'] = get_cached_stl(file2_hash)
         else:
             # Convert and cache
             stl_path = file_storage[file2_id]['stl']
-            if not convert_step_to_stl(file2_path, stl_path):
-                convert_step_to_stl(file2_path, stl_path)
+            if not convert_step_to_stl(file2_path, stl_path, file2_hash, data2):
+                convert_step_to_stl(file2_path, stl_path, file2_hash, data2)
             # Cache the result
             cache_path = os.path.join(app.config['CACHE_FOLDER'], f"{file2_hash}.stl")
             if os.path.exists(stl_path):
                 with open(stl_path, 'rb') as src, open(cache_path, 'wb') as dst:
                     dst.write(src.read())
         
-        # Check comparison cache
-        cache_key = f"{file1_hash}_{file2_hash}"
-        if cache_key in comparison_cache:
-            logger.info(f"Using cached comparison for {cache_key}")
-            background_tasks[task_id]['result'] = comparison_cache[cache_key]
-        else:
-            # Parse STEP files
-            logger.info("Parsing file 1")
-            parser = StepParser()
-            data1 = parser.parse(file1_path)
-            
-            logger.info("Parsing file 2")
-            parser = StepParser()
-            data2 = parser.parse(file2_path)
-            
-            # Compare the files
-            logger.info("Comparing files")
-            engine = ComparisonEngine()
-            differences = engine.compare(data1, data2, file1_path, file2_path)
-            
-            # Generate reports
-            logger.info("Generating report")
-            file1_name = os.path.basename(file1_path)
-            file2_name = os.path.basename(file2_path)
-            generator = ReportGenerator(differences, file1_name, file2_name)
-            
-            # Generate HTML report
-            report_html = generator.generate_html_report()
-            
-            # Generate PDF report
-            pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], f"report_{task_id}.pdf")
-            generator.generate_pdf_report(pdf_path)
-            
-            # Generate CSV report
-            csv_path = os.path.join(app.config['UPLOAD_FOLDER'], f"report_{task_id}.csv")
-            generator.generate_csv_report(csv_path)
-            
-            # Store result
-            result = {
-                'differences': differences,
-                'report_html': report_html,
-                'pdf_path': pdf_path,
-                'csv_path': csv_path
-            }
-            
+        if result is None:
+            result = compare_files(file1_path, file2_path, data1, data2, identity, task_id, level)
             # Cache the result
             comparison_cache[cache_key] = result
-            background_tasks[task_id]['result'] = result
+        background_tasks[task_id]['result'] = result
         
         background_tasks[task_id]['status'] = 'completed'
         logger.info(f"Background task {task_id} completed")
@@ -158,12 +143,82 @@ def process_files_in_background(file1_path, file2_path, file1_id, file2_id, task
         background_tasks[task_id]['status'] = 'error'
         background_tasks[task_id]['error'] = str(e)
 
+def parse_files(file1_path, file2_path, file1_hash, file2_hash, task_id):
+    """Parse two STEP files; returns (data1, data2, identity), identity 'byte' or 'semantic' if they are the same model"""
+    if file1_hash == file2_hash:
+        # A copy of the same file needs neither a parse nor a shape transfer
+        logger.info("Files are byte-identical")
+        return None, None, 'byte'
+    
+    # Parse STEP files
+    logger.info("Parsing file 1")
+    parser = StepParser(cache=parse_cache, similarity_index=similarity_index)
+    data1 = parser.parse(file1_path, file1_hash, background_tasks[task_id]['file1_name'])
+    
+    logger.info("Parsing file 2")
+    parser = StepParser(cache=parse_cache, similarity_index=similarity_index)
+    data2 = parser.parse(file2_path, file2_hash, background_tasks[task_id]['file2_name'])
+    
+    if ComparisonEngine().same_model(data1, data2):
+        # A re-export that only renumbers instances or rewrites the HEADER
+        logger.info("Files hold the same entities up to renumbering")
+        return data1, data2, 'semantic'
+    return data1, data2, None
+
+def compare_files(file1_path, file2_path, data1, data2, identity, task_id, level='standard'):
+    """Compare two parsed STEP files at a comparison level and generate their reports"""
+    engine = ComparisonEngine(parallel=True)
+    if identity:
+        differences = engine.identical(identity)
+    else:
+        # Compare the files
+        logger.info(f"Comparing files ({level})")
+        # Shapes not already transferred for meshing are measured in parallel
+        differences = engine.compare(data1, data2, file1_path, file2_path, level=level)
+    
+    # Generate reports
+    logger.info("Generating report")
+    file1_name = os.path.basename(file1_path)
+    file2_name = os.path.basename(file2_path)
+    generator = ReportGenerator(differences, file1_name, file2_name)
+    
+    # Generate HTML report
+    report_html = generator.generate_html_report()
+    
+    # Generate PDF report
+    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], f"report_{task_id}.pdf")
+    generator.generate_pdf_report(pdf_path)
+    
+    # Generate CSV report
+    csv_path = os.path.join(app.config['UPLOAD_FOLDER'], f"report_{task_id}.csv")
+    generator.generate_csv_report(csv_path)
+    
+    # Deviation of file 2 against file 1 at each vertex of the file 2
+    # STL, which is written from the same triangulation
+    deviation_map = None
+    if engine.deviation:
+        mesh2 = engine.deviation['file2']
+        data, scale = corner_deviation_buffer(mesh2['distances'], mesh2['triangles'])
+        deviation_map = {'data': data, 'scale': scale}
+    
+    return {
+        'differences': differences,
+        'report_html': report_html,
+        'pdf_path': pdf_path,
+        'csv_path': csv_path,
+        'deviation_map': deviation_map
+    }
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-def convert_step_to_stl(step_file, stl_file):
-    """Convert STEP file to STL using OCC"""
+def convert_step_to_stl(step_file, stl_file, file_hash=None, data=None):
+    """Convert STEP file to STL using OCC
+
+    data is the file's parse result, if at hand; otherwise it is taken
+    from the parse cache, or parsed, to tell whether the file is streamed.
+    """
     try:
         logger.info(f"Starting STEP to STL conversion: {step_file} -> {stl_file}")
         
@@ -181,8 +236,6 @@ def convert_step_to_stl(step_file, stl_file):
         
         # Import OCC modules
         try:
-            from OCC.Core.STEPControl import STEPControl_Reader
-            from OCC.Core.IFSelect import IFSelect_RetDone
             from OCC.Core.StlAPI import StlAPI_Writer
             from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
             logger.info("Successfully imported OCC modules")
@@ -190,19 +243,22 @@ def convert_step_to_stl(step_file, stl_file):
             logger.error(f"Failed to import OCC modules: {str(e)}")
             return False
         
-        # Read STEP file
-        logger.info("Creating STEP reader")
-        step_reader = STEPControl_Reader()
-        logger.info(f"Reading STEP file: {step_file}")
-        status = step_reader.ReadFile(step_file)
-        logger.info(f"Read status: {status}")
+        # Large assemblies are meshed one part at a time and never cached whole,
+        # decided like the comparison's part by part measurement
+        if data is None:
+            data = StepParser(cache=parse_cache).parse(step_file, file_hash)
+        if large_assembly(data):
+            triangles = StreamingGeometry().write_stl(step_file, stl_file, data.get('index'))
+            if triangles is None or not os.path.exists(stl_file):
+                logger.error(f"Failed to read STEP file: {step_file}")
+                return False
+            logger.info(f"Successfully converted {step_file} to {stl_file}, {triangles} triangles")
+            return True
         
-        if status == IFSelect_RetDone:
-            logger.info("Transferring roots")
-            step_reader.TransferRoots()
-            logger.info("Getting shape")
-            shape = step_reader.OneShape()
-            
+        # Read and transfer the STEP file, or reuse the shape of an earlier job
+        shape = shape_provider.get_shape(step_file, file_hash)
+        
+        if shape is not None:
             # Mesh the shape
             logger.info("Meshing shape")
             mesh = BRepMesh_IncrementalMesh(shape, 0.1)
@@ -335,19 +391,13 @@ def convert_step_to_stl_using_occ(step_file, stl_file):
     try:
         logger.info(f"Converting {step_file} to {stl_file} using OCC")
         
-        from OCC.Core.STEPControl import STEPControl_Reader
         from OCC.Core.StlAPI import StlAPI_Writer
         from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
-        from OCC.Core.IFSelect import IFSelect_RetDone
         
         # Read the STEP file
-        step_reader = STEPControl_Reader()
-        status = step_reader.ReadFile(step_file)
+        shape = shape_provider.get_shape(step_file)
         
-        if status == IFSelect_RetDone:
-            step_reader.TransferRoots()
-            shape = step_reader.Shape()
-            
+        if shape is not None:
             # Mesh the shape
             mesh = BRepMesh_IncrementalMesh(shape, 0.1)
             mesh.Perform()
@@ -379,6 +429,15 @@ def compare():
         if file1.filename == '' or file2.filename == '':
             return "No files selected", 400
         
+        # Compressed files are parsed as they are, without unpacking them first
+        if not allowed_file(file1.filename) or not allowed_file(file2.filename):
+            return "Unsupported file type", 400
+        
+        # Deeper levels take longer; precise is only run when asked for
+        level = request.form.get('level', 'standard')
+        if level not in COMPARISON_LEVELS:
+            return "Unknown comparison level", 400
+        
         # Generate unique IDs for the files
         file1_id = str(uuid.uuid4())
         file2_id = str(uuid.uuid4())
@@ -392,11 +451,13 @@ def compare():
         
         # Store file paths for later use
         file_storage[file1_id] = {
+            'name': file1.filename,
             'path': file1_path,
             'stl': os.path.join(app.config['UPLOAD_FOLDER'], f"{file1_id}.stl")
         }
         
         file_storage[file2_id] = {
+            'name': file2.filename,
             'path': file2_path,
             'stl': os.path.join(app.config['UPLOAD_FOLDER'], f"{file2_id}.stl")
         }
@@ -409,6 +470,7 @@ def compare():
             'file2_id': file2_id,
             'file1_name': file1.filename,
             'file2_name': file2.filename,
+            'level': level,
             'created_at': time.time()
         }
         
@@ -458,6 +520,53 @@ def task_status(task_id):
     
     return jsonify(response)
 
+@app.route('/api/face_differences/<task_id>')
+def face_differences(task_id):
+    if task_id not in background_tasks or background_tasks[task_id]['status'] != 'completed':
+        return jsonify({'status': 'not_found'}), 404
+    
+    # Added, removed and modified faces with their bounding boxes, for the viewer
+    result = background_tasks[task_id].get('result', {})
+    faces = result.get('differences', {}).get('geometric', {}).get('faces', {})
+    return jsonify({
+        'removed': faces.get('removed', []),
+        'added': faces.get('added', []),
+        'modified': faces.get('modified', [])
+    })
+
+@app.route('/api/deviation_map/<task_id>')
+def deviation_map(task_id):
+    if task_id not in background_tasks or background_tasks[task_id]['status'] != 'completed':
+        return jsonify({'status': 'not_found'}), 404
+    
+    # One byte per STL vertex of model 2; the viewer decodes (q - 128) / 127 * scale
+    deviation = background_tasks[task_id].get('result', {}).get('deviation_map')
+    if not deviation:
+        return jsonify({'status': 'not_available'}), 404
+    
+    response = app.response_class(deviation['data'], mimetype='application/octet-stream')
+    response.headers['X-Deviation-Scale'] = repr(deviation['scale'])
+    response.headers['X-Deviation-Encoding'] = 'uint8'
+    return response
+
+@app.route('/api/similar/<file_id>')
+def similar_files(file_id):
+    """Previously seen files most similar to an uploaded file"""
+    if file_id not in file_storage:
+        return jsonify({'status': 'not_found'}), 404
+    
+    try:
+        file_path = file_storage[file_id]['path']
+        file_hash = calculate_file_hash(file_path)
+        if file_hash not in similarity_index:
+            parser = StepParser(cache=parse_cache, similarity_index=similarity_index)
+            parser.parse(file_path, file_hash, file_storage[file_id]['name'])
+        matches = similarity_index.query(file_hash, request.args.get('k', 10, type=int))
+    except Exception as e:
+        logger.error(f"Error finding files similar to {file_id}: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+    return jsonify({'status': 'ok', 'file': file_storage[file_id]['name'], 'matches': matches})
+
 @app.route('/results/<task_id>')
 def show_results(task_id):
     if task_id not in background_tasks: